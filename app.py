@@ -7,19 +7,40 @@ API QEDU — Flask para Render + n8n  (WSGI — compatível com gunicorn)
 GET  /gerar?ibge=2304400        →  JSON com 5 relatórios TXT (município)
 GET  /gerar?ibge=23              →  JSON com 5 relatórios TXT (estado)
 GET  /gerar/<ibge>              →  idem (path param)
+GET  /gerar?ibge=2304400&tipos=censo,ideb  →  só os relatórios pedidos
 GET  /relatorio?ibge=2304400&tipo=censo  →  TXT puro de 1 relatório
 GET  /municipio?ibge=2304400    →  nome + UF
+GET  /municipio/buscar?q=paulinia  →  municípios/estados por nome (sem acento)
 GET  /health                    →  status
+
+Respostas 200 de /gerar e /relatorio levam ETag (fraco, dos hashes dos
+relatórios), Cache-Control, Last-Modified e Age; /municipio, ETag do corpo.
+If-None-Match que bate com a saída em disco → 304 antes de gerar qualquer coisa.
+Corpos grandes saem comprimidos (br/gzip) conforme o Accept-Encoding.
 ==============================================================================
 """
 
 import os
+import gzip
+import json
+import hashlib
 import logging
+import pathlib
+import threading
 import traceback
 from datetime import datetime
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
+
+try:
+    import brotli  # compressão br (opcional — sem ele, só gzip)
+except ImportError:
+    brotli = None
 
-from gerador import gerar_todos, descobrir_municipio, is_estado, OUTPUT_DIR
+from gerador import (obter_relatorios, validar_saida, normalizar_tipos,
+                     descobrir_municipio, buscar_municipios, is_estado,
+                     indice_municipios, MUNICIPIOS_CSV, UF_CODES,
+                     OUTPUT_DIR, TIPOS_RELATORIO, SAIDA_MAX_IDADE, SAIDA_MAX_IDADE_DURA,
+                     CacheLRU, CACHE_TTL)
 
 # =============================================================================
 # LOGGING
@@ -32,8 +53,28 @@ log = logging.getLogger("api_qedu")
 # =============================================================================
 app = Flask(__name__)
 
+API_VERSAO = "2.0.0"
+
 # Tipos de relatório válidos
-TIPOS_VALIDOS = ["aprendizado", "infra", "censo", "ideb", "taxa_rendimento"]
+TIPOS_VALIDOS = list(TIPOS_RELATORIO)
+
+# Cache HTTP (n8n / CDN): relatórios seguem QEDU_SAIDA_MAX_IDADE_H; município é quase fixo
+CACHE_MUNICIPIO_S = int(os.environ.get("QEDU_CACHE_MUNICIPIO_S", "86400"))
+
+# Compressão negociada: abaixo de COMPRIMIR_MIN_BYTES não compensa
+COMPRIMIR_MIN_BYTES = int(os.environ.get("QEDU_COMPRIMIR_MIN_BYTES", "1024"))
+GZIP_NIVEL          = int(os.environ.get("QEDU_GZIP_NIVEL", "6"))
+BROTLI_NIVEL        = int(os.environ.get("QEDU_BROTLI_NIVEL", "5"))
+COMPRIMIDO_CACHE_ITENS = int(os.environ.get("QEDU_COMPRIMIDO_CACHE_ITENS", "200"))
+COMPRIMIDO_CACHE_BYTES = int(float(os.environ.get("QEDU_COMPRIMIDO_CACHE_MB", "16")) * 1024 * 1024)
+COMPRIMIDO_DISCO_ARQUIVOS = int(os.environ.get("QEDU_COMPRIMIDO_DISCO_ARQUIVOS", "32"))  # por pasta
+
+# Cadastro de municípios + índice de busca carregados no boot (não na 1ª requisição)
+_n_municipios = len(indice_municipios()) - len(UF_CODES)
+if _n_municipios > 0:
+    log.info(f"Cadastro de municípios: {_n_municipios} município(s) de {MUNICIPIOS_CSV}")
+else:
+    log.warning(f"Cadastro de municípios vazio ({MUNICIPIOS_CSV}) — nomes virão da API")
 
 
 # =============================================================================
@@ -47,6 +88,167 @@ def add_cors(response):
     return response
 
 
+# =============================================================================
+# CACHE HTTP — ETag, Cache-Control, Last-Modified, 304
+# =============================================================================
+X_CACHE = {"disco": "HIT", "disco_expirado": "STALE", "gerado": "MISS"}
+
+
+def _etag_relatorios(ibge: str, tipos, hashes: dict, formato: str):
+    """ETag dos relatórios a partir dos hashes dos modelos (não do corpo, que
+    traz `gerado_em`): mesma versão da API, formato, IBGE, tipos e hashes →
+    mesma ETag, gerada agora ou lida do relatorios.json. None se algum tipo
+    saiu com erro (sem hash). Fraca: garante o mesmo conteúdo, não os mesmos bytes."""
+    if any(t not in hashes for t in tipos):
+        return None
+    partes = [API_VERSAO, formato, ibge, list(tipos), [hashes[t] for t in tipos]]
+    return hashlib.sha256(json.dumps(partes).encode()).hexdigest()[:32]
+
+
+def _etag_pedida(etag: str):
+    """Variante de `etag` (pura ou com sufixo da codificação) que o cliente
+    mandou no If-None-Match, ou None."""
+    for variante in (etag, *(f"{etag}-{enc}" for enc in _COMPRESSORES)):
+        if request.if_none_match.contains_weak(variante):
+            return variante
+    return None
+
+
+def _validadores(response, meta, max_age):
+    """Cache-Control (+ Age / X-Cache / X-Gerado-Em / Last-Modified nos relatórios).
+    Vale para 200 e 304 — o 304 repete os validadores da resposta completa."""
+    if meta:
+        # Age conta a partir da geração: max-age é a vida toda do relatório.
+        # Expirado (ou ano novo na fonte) → max-age=0, mas ainda utilizável
+        # enquanto o servidor regera (stale-while-revalidate).
+        max_age = 0 if meta["origem"] == "disco_expirado" else int(SAIDA_MAX_IDADE)
+        swr = max(int(SAIDA_MAX_IDADE_DURA - SAIDA_MAX_IDADE), 0)
+        response.headers["Cache-Control"] = f"public, max-age={max_age}, stale-while-revalidate={swr}"
+        response.headers["Age"] = str(int(meta["idade_s"]))
+        response.headers["X-Cache"] = X_CACHE.get(meta["origem"], "MISS")
+        response.headers["X-Gerado-Em"] = meta["gerado_em"]
+        try:
+            response.last_modified = datetime.fromisoformat(meta["gerado_em"]).astimezone()
+        except ValueError:
+            pass
+    else:
+        response.headers["Cache-Control"] = f"public, max-age={max_age}"
+
+
+# =============================================================================
+# COMPRESSÃO — br/gzip negociados, corpos comprimidos em cache
+# =============================================================================
+# Relatórios: a versão comprimida fica junto dos TXTs, em
+# output/<ibge>/comprimidos/<chave>.<enc>, com a chave tirada da ETag (hashes
+# dos relatórios), do gerado_em e dos digests dos TXTs como de fato gravados/lidos
+# (`digests`) — o que determina o corpo. Sobrevive a restarts e
+# é compartilhada entre workers; as mais antigas saem além de
+# COMPRIMIDO_DISCO_ARQUIVOS por pasta. Na frente, um LRU em memória (chave,
+# codificação) → bytes, que também atende as demais rotas pelo hash do corpo.
+COMPRIMIDOS_DIR = "comprimidos"
+_COMPRIMIDOS = CacheLRU(COMPRIMIDO_CACHE_ITENS, COMPRIMIDO_CACHE_BYTES, CACHE_TTL)
+
+_COMPRESSORES = {"gzip": lambda b: gzip.compress(b, GZIP_NIVEL, mtime=0)}
+if brotli is not None:
+    _COMPRESSORES = {"br": lambda b: brotli.compress(b, quality=BROTLI_NIVEL), **_COMPRESSORES}
+
+
+def _codificacao(response, tamanho: int):
+    """'br' / 'gzip' aceito pelo cliente, ou None se não vale comprimir."""
+    if tamanho < COMPRIMIR_MIN_BYTES or "Content-Encoding" in response.headers:
+        return None
+    return request.accept_encodings.best_match(list(_COMPRESSORES))
+
+
+def _chave_relatorio(meta):
+    """Chave do corpo de um relatório sem hashear o corpo: ETag + gerado_em +
+    digest de cada TXT servido. None se faltar algum (ex.: tipo com erro)."""
+    if not meta or not meta.get("etag") or None in meta.get("digests", [None]):
+        return None
+    partes = [meta["etag"], meta["gerado_em"], *meta["digests"]]
+    return hashlib.sha256("\0".join(partes).encode()).hexdigest()[:32]
+
+
+def _comprimir(corpo: bytes, chave: str, enc: str, pasta: pathlib.Path = None) -> bytes:
+    """Corpo comprimido: LRU em memória → <pasta>/comprimidos/ → comprime (e guarda)."""
+    z = _COMPRIMIDOS.get((chave, enc), None)
+    if z is not None:
+        return z
+    arquivo = pasta / COMPRIMIDOS_DIR / f"{chave}.{enc}" if pasta else None
+    if arquivo is not None:
+        try:
+            z = arquivo.read_bytes()
+        except OSError:
+            pass
+    if z is None:
+        z = _COMPRESSORES[enc](corpo)
+        if arquivo is not None:
+            _gravar_comprimido(arquivo, z)
+    _COMPRIMIDOS.set((chave, enc), z, tamanho=len(z))
+    return z
+
+
+def _gravar_comprimido(arquivo: pathlib.Path, z: bytes):
+    """Grava via temporário + replace e poda a pasta às COMPRIMIDO_DISCO_ARQUIVOS
+    versões mais recentes. Disco somente leitura → segue só com o LRU."""
+    tmp = arquivo.with_name(f"{arquivo.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        arquivo.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(z)
+        tmp.replace(arquivo)
+        antigos = sorted((p for p in arquivo.parent.iterdir() if not p.name.endswith(".tmp")),
+                         key=lambda p: p.stat().st_mtime, reverse=True)[COMPRIMIDO_DISCO_ARQUIVOS:]
+        for p in antigos:
+            p.unlink(missing_ok=True)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+
+
+@app.after_request
+def add_cache_headers(response):
+    """Validadores nas respostas 200 de relatórios (`g.relatorio_meta`, vindo de
+    `_gerar`) e município (`g.cache_max_age`). Relatórios: ETag fraca dos hashes
+    (`_etag_relatorios`); município: ETag forte do corpo — ambas com sufixo da
+    codificação quando comprimido. Se o cliente mandar If-None-Match /
+    If-Modified-Since que batem, vira 304 sem corpo. Qualquer 200 grande sai
+    comprimido conforme o Accept-Encoding."""
+    if request.method not in ("GET", "HEAD") or response.direct_passthrough:
+        return response
+    meta = g.get("relatorio_meta")
+    max_age = g.get("cache_max_age")
+    if response.status_code == 304 and meta is not None:  # 304 antecipado de `_gerar`
+        _validadores(response, meta, max_age)
+        response.vary.add("Accept-Encoding")
+        response.set_etag(meta["etag"], weak=True)
+        return response
+    if response.status_code != 200:
+        return response
+    cacheavel = meta is not None or max_age is not None
+    corpo = response.get_data()
+    enc = _codificacao(response, len(corpo))
+    if not (cacheavel or enc):
+        return response
+    chave_rel = _chave_relatorio(meta)
+    chave = chave_rel or hashlib.sha256(corpo).hexdigest()[:32]
+    if len(corpo) >= COMPRIMIR_MIN_BYTES:
+        response.vary.add("Accept-Encoding")
+
+    if cacheavel:
+        _validadores(response, meta, max_age)
+        etag = meta.get("etag") if meta else chave
+        if etag:
+            response.set_etag(f"{etag}-{enc}" if enc else etag, weak=meta is not None)
+        response = response.make_conditional(request)
+        if response.status_code != 200:
+            return response  # 304: nada a comprimir
+
+    if enc:
+        pasta = meta.get("pasta") if chave_rel else None
+        response.set_data(_comprimir(corpo, chave, enc, pasta))
+        response.headers["Content-Encoding"] = enc
+    return response
+
+
 # =============================================================================
 # HELPERS
 # =============================================================================
@@ -62,17 +264,40 @@ def _validar_ibge(ibge: str):
     return ibge, None
 
 
-def _gerar(ibge: str):
-    """Roda o gerador e retorna (dict, None) ou (None, erro_response)."""
+def _validar_tipos(tipos: str):
+    """'censo,ideb' → ("censo", "ideb") via `normalizar_tipos` do gerador (ordem
+    de TIPOS_RELATORIO, sem repetidos; vazio = todos).
+    Retorna (tupla, None) ou (None, erro 400)."""
+    try:
+        return normalizar_tipos(tipos), None
+    except ValueError as e:
+        return None, (jsonify({"erro": str(e)}), 400)
+
+
+def _gerar(ibge: str, tipos=None, formato: str = "json"):
+    """Relatórios (todos ou só `tipos`) de output/<ibge> se ainda frescos, senão
+    roda o gerador. Retorna (dict, None) ou (None, resposta) — erro, ou 304 se o
+    If-None-Match bate com os hashes da saída em disco (sem gerar nada)."""
     ibge, erro = _validar_ibge(ibge)
     if erro:
         return None, erro
+    tipos_etag = list(normalizar_tipos(tipos))
+    out_dir = OUTPUT_DIR / ibge
 
-    log.info(f"Gerando relatórios para IBGE {ibge}...")
+    if request.if_none_match:
+        v = validar_saida(ibge, out_dir, tipos)
+        etag = v and _etag_relatorios(ibge, tipos_etag, v["hashes"], formato)
+        pedida = etag and _etag_pedida(etag)
+        if pedida:
+            log.info(f"304: IBGE {ibge} ({','.join(tipos_etag)}) [{v['origem']}]")
+            g.relatorio_meta = {**{k: v[k] for k in ("origem", "idade_s", "gerado_em")},
+                                "etag": pedida}
+            return None, Response(status=304)
+
+    log.info(f"Gerando relatórios para IBGE {ibge} ({','.join(tipos_etag)})...")
 
     try:
-        out_dir = OUTPUT_DIR / ibge
-        resultado = gerar_todos(ibge, out_dir)
+        resultado = obter_relatorios(ibge, out_dir, tipos)
     except Exception as e:
         log.error(f"Erro ao gerar IBGE {ibge}: {e}\n{traceback.format_exc()}")
         return None, (jsonify({"erro": f"Erro ao gerar: {str(e)}", "ibge": ibge}), 500)
@@ -85,13 +310,19 @@ def _gerar(ibge: str):
                 relatorios[tipo] = conteudo
                 break
 
-    log.info(f"OK: {resultado['municipio']} ({resultado['uf']}) — {len(relatorios)} relatórios")
+    log.info(f"OK: {resultado['municipio']} ({resultado['uf']}) — {len(relatorios)} relatórios"
+             f" [{resultado['origem']}, {resultado['idade_s']:.0f}s]")
+    g.relatorio_meta = {**{k: resultado[k] for k in ("origem", "idade_s", "gerado_em")},
+                        "etag": _etag_relatorios(ibge, tipos_etag, resultado["hashes"], formato),
+                        "digests": [resultado["digests"].get(t) for t in tipos_etag],
+                        "pasta": out_dir}
 
     resp = {
         "municipio": resultado["municipio"],
         "uf": resultado["uf"],
         "ibge": ibge,
         "tipo": "estado" if is_estado(ibge) else "municipio",
+        "gerado_em": resultado["gerado_em"],
         "relatorios": relatorios,
     }
 
@@ -115,7 +346,7 @@ def health():
     """Health check — Render usa /health para saber se está vivo."""
     return jsonify(
         status="ok",
-        version="2.0.0",
+        version=API_VERSAO,
         timestamp=datetime.now().isoformat(),
         tipos_disponiveis=TIPOS_VALIDOS,
     )
@@ -125,28 +356,33 @@ def health():
 
 @app.route("/gerar")
 def gerar_query():
-    """GET /gerar?ibge=2304400 — formato preferido pro n8n."""
+    """GET /gerar?ibge=2304400[&tipos=censo,ideb] — formato preferido pro n8n."""
     ibge = request.args.get("ibge", "").strip()
     if not ibge:
         return jsonify({"erro": "Parâmetro 'ibge' obrigatório. Ex: /gerar?ibge=2304400"}), 400
+    tipos, erro = _validar_tipos(request.args.get("tipos"))
+    if erro:
+        return erro
 
-    r, erro = _gerar(ibge)
+    r, erro = _gerar(ibge, tipos)
     if erro:
         return erro
 
-    r["gerado_em"] = datetime.now().isoformat()
     r["total_relatorios"] = len(r["relatorios"])
     return jsonify(r)
 
 
 @app.route("/gerar/<ibge>")
 def gerar_path(ibge):
-    """GET /gerar/2304400 — atalho via URL."""
-    r, erro = _gerar(ibge)
+    """GET /gerar/2304400[?tipos=censo,ideb] — atalho via URL."""
+    tipos, erro = _validar_tipos(request.args.get("tipos"))
+    if erro:
+        return erro
+
+    r, erro = _gerar(ibge, tipos)
     if erro:
         return erro
 
-    r["gerado_em"] = datetime.now().isoformat()
     r["total_relatorios"] = len(r["relatorios"])
     return jsonify(r)
 
@@ -164,7 +400,7 @@ def relatorio_individual():
     if tipo not in TIPOS_VALIDOS:
         return jsonify({"erro": f"Tipo inválido. Use: {TIPOS_VALIDOS}"}), 400
 
-    r, erro = _gerar(ibge)
+    r, erro = _gerar(ibge, [tipo], "txt")  # só o relatório pedido (e só as chamadas dele)
     if erro:
         return erro
 
@@ -189,9 +425,25 @@ def identificar_municipio_query():
         return erro
 
     mun, uf = descobrir_municipio(ibge)
+    g.cache_max_age = CACHE_MUNICIPIO_S
     return jsonify(municipio=mun, uf=uf, ibge=ibge)
 
 
+@app.route("/municipio/buscar")
+def buscar_municipio():
+    """Busca por nome — ?q=sao jose&uf=SP&limite=10. Ignora acentos e caixa."""
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"erro": "Parâmetro 'q' obrigatório."}), 400
+    try:
+        limite = int(request.args.get("limite", 10))
+    except ValueError:
+        return jsonify({"erro": "Parâmetro 'limite' deve ser um número."}), 400
+
+    resultados = buscar_municipios(q, limite, request.args.get("uf") or None)
+    return jsonify(q=q, total=len(resultados), resultados=resultados)
+
+
 @app.route("/municipio/<ibge>")
 def identificar_municipio_path(ibge):
     ibge, erro = _validar_ibge(ibge)
@@ -199,6 +451,7 @@ def identificar_municipio_path(ibge):
         return erro
 
     mun, uf = descobrir_municipio(ibge)
+    g.cache_max_age = CACHE_MUNICIPIO_S
     return jsonify(municipio=mun, uf=uf, ibge=ibge)
 
 
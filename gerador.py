@@ -12,15 +12,29 @@ Anos detectados DINAMICAMENTE.
 ==============================================================================
 """
 
-import pathlib, time, sys, re
+import os, json, hashlib, pathlib, random, time, sys, re, threading
+import contextvars, sqlite3, zlib, unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Optional, Tuple, Dict, List
+from typing import Any, Callable, Optional, Tuple, Dict, List
 
 try:
     import numpy as np
 except ImportError:
     np = None
 
+try:
+    import pyarrow.feather as feather  # cache colunar do IDEB (opcional)
+except ImportError:
+    feather = None
+
+try:
+    from unidecode import unidecode  # busca de municípios sem acento
+except ImportError:
+    unidecode = None
+
 try:
     import requests
 except ImportError:
@@ -37,12 +51,14 @@ except ImportError:
 BASE_DIR   = pathlib.Path(__file__).parent
 DADOS_DIR  = BASE_DIR / "dados"
 OUTPUT_DIR = BASE_DIR / "output"
+CACHE_DIR  = pathlib.Path(os.environ.get("QEDU_CACHE_DIR", BASE_DIR / "cache"))
 
 IDEB_MUN_CSV = DADOS_DIR / "ideb_saeb_municipios_28_07_final 1.csv"
 IDEB_UF_CSV  = DADOS_DIR / "ideb_saeb_estados_28_07_final 1.csv"
 
 BASE_URL  = "https://qedu.org.br/api/v1"
 ANO_ATUAL = datetime.now().year
+ANOS_REGISTRO_TTL = float(os.environ.get("QEDU_ANOS_TTL_HORAS", "24")) * 3600  # revalida ano mais recente
 LINE      = "=" * 80
 SUBLINE   = "-" * 80
 
@@ -53,6 +69,57 @@ HEADERS = {
     "Referer": "https://qedu.org.br/",
 }
 
+# ---------- pool HTTP (keep-alive com qedu.org.br) ----------
+HTTP_POOL_SIZE = int(os.environ.get("QEDU_HTTP_POOL_SIZE", "16"))   # conexões simultâneas por host
+HTTP_KEEPALIVE = os.environ.get("QEDU_HTTP_KEEPALIVE", "1") != "0"  # 0 = fecha conexão a cada chamada
+HTTP_TIMEOUT   = float(os.environ.get("QEDU_HTTP_TIMEOUT", "30"))
+
+# ---------- paralelismo ----------
+PREFETCH_WORKERS = int(os.environ.get("QEDU_PREFETCH_WORKERS", "8"))  # chamadas simultâneas por geração
+PROBE_PARALELO   = os.environ.get("QEDU_PROBE_PARALELO", "1") != "0"  # sonda todos os anos de uma vez
+PROBE_WORKERS    = int(os.environ.get("QEDU_PROBE_WORKERS", "12"))
+
+# ---------- cache em memória das respostas da API ----------
+CACHE_TTL       = float(os.environ.get("QEDU_CACHE_TTL_MIN", "360")) * 60
+CACHE_MAX_ITENS = int(os.environ.get("QEDU_CACHE_MAX_ITENS", "5000"))
+CACHE_MAX_BYTES = int(float(os.environ.get("QEDU_CACHE_MAX_MB", "64")) * 1024 * 1024)
+NEG_TTL_VAZIO   = float(os.environ.get("QEDU_NEG_TTL_VAZIO_MIN", "360")) * 60  # "sem dados" confirmado
+NEG_TTL_FALHA   = float(os.environ.get("QEDU_NEG_TTL_FALHA_S", "15"))          # falha transitória
+
+# ---------- relatórios já gravados em OUTPUT_DIR (leitura antes de gerar) ----------
+# Até SAIDA_MAX_IDADE: serve do disco. Até SAIDA_MAX_IDADE_DURA: serve do disco
+# e regera em segundo plano. Depois disso: quem pede espera a geração.
+SAIDA_MAX_IDADE      = float(os.environ.get("QEDU_SAIDA_MAX_IDADE_H", "24")) * 3600  # 0 = sempre gera
+SAIDA_MAX_IDADE_DURA = float(os.environ.get("QEDU_SAIDA_MAX_IDADE_DURA_H", "168")) * 3600
+REVALIDAR_WORKERS    = int(os.environ.get("QEDU_REVALIDAR_WORKERS", "2"))  # regerações em segundo plano
+
+# ---------- cache de renderização (TXT por hash do modelo de entrada) ----------
+RENDER_CACHE_ITENS = int(os.environ.get("QEDU_RENDER_CACHE_ITENS", "500"))
+RENDER_CACHE_BYTES = int(float(os.environ.get("QEDU_RENDER_CACHE_MB", "32")) * 1024 * 1024)
+
+# ---------- retentativas / circuit breaker ----------
+RETRY_BASE_S     = float(os.environ.get("QEDU_RETRY_BASE_S", "0.5"))   # 0.5s, 1s, 2s ... com jitter
+RETRY_MAX_S      = float(os.environ.get("QEDU_RETRY_MAX_S", "8"))
+CIRCUITO_FALHAS  = int(os.environ.get("QEDU_CIRCUITO_FALHAS", "5"))     # falhas seguidas para abrir
+CIRCUITO_PAUSA_S = float(os.environ.get("QEDU_CIRCUITO_PAUSA_S", "30"))  # tempo aberto (falha rápida)
+
+# ---------- cache em disco (sobrevive a restart/scale do Render) ----------
+DISCO_CACHE           = os.environ.get("QEDU_DISCO_CACHE", "1") != "0"
+DISCO_CACHE_FILE      = CACHE_DIR / "respostas.sqlite3"
+DISCO_CACHE_MAX_BYTES = int(float(os.environ.get("QEDU_DISCO_CACHE_MAX_MB", "256")) * 1024 * 1024)
+DISCO_CACHE_TTL = {  # horas, por endpoint — QEDU_DISCO_TTL_<ENDPOINT>_HORAS
+    ep: float(os.environ.get(f"QEDU_DISCO_TTL_{ep.upper()}_HORAS", horas)) * 3600
+    for ep, horas in {"aprendizado": 168, "censo": 168, "infra": 168,
+                      "taxa": 168, "outros": 24}.items()
+}
+
+# ---------- limite de taxa adaptativo (evita 403/429 do qedu.org.br) ----------
+RATE_GLOBAL_RPS    = float(os.environ.get("QEDU_RATE_RPS", "20"))           # teto global
+RATE_ENDPOINT_RPS  = float(os.environ.get("QEDU_RATE_ENDPOINT_RPS", "10"))  # teto por base
+RATE_BURST         = int(os.environ.get("QEDU_RATE_BURST", "20"))
+CONCORRENCIA_MAX   = int(os.environ.get("QEDU_CONCORRENCIA_MAX", str(HTTP_POOL_SIZE)))
+LATENCIA_ALVO      = float(os.environ.get("QEDU_LATENCIA_ALVO_S", "5"))     # acima disso, desacelera
+
 # ---------- mapeamentos ----------
 DEPENDENCIAS = {0: "Todas as redes", 1: "Federal", 2: "Estadual",
                 3: "Municipal", 4: "Privada", 5: "Pública"}
@@ -127,79 +194,739 @@ def is_estado(codigo):
 # =============================================================================
 # DETECÇÃO DINÂMICA DE ANOS
 # =============================================================================
-def _anos_candidatos(n: int = 6) -> list:
+# Disponibilidade por ano é global de cada base (censo, infra, taxa,
+# aprendizado) — não depende do município. O registro guarda o ano mais
+# recente já confirmado com dados e é persistido em disco; passado
+# ANOS_REGISTRO_TTL a entrada vence e a próxima consulta volta a sondar a
+# partir do ano atual (detecta quando sai um ano novo).
+ANOS_REGISTRO_FILE = CACHE_DIR / "anos_disponiveis.json"
+
+_ANOS_REGISTRO: Dict[str, dict] = {}
+_ANOS_REGISTRO_LOCK = threading.Lock()
+_ANOS_REGISTRO_CARREGADO = False
+
+
+def _carregar_registro_anos():
+    global _ANOS_REGISTRO_CARREGADO
+    if _ANOS_REGISTRO_CARREGADO:
+        return
+    try:
+        dados = json.loads(ANOS_REGISTRO_FILE.read_text(encoding="utf-8"))
+        if isinstance(dados, dict):
+            _ANOS_REGISTRO.update(dados)
+    except (OSError, ValueError):
+        pass
+    _ANOS_REGISTRO_CARREGADO = True
+
+
+def _salvar_registro_anos():
+    try:
+        ANOS_REGISTRO_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = ANOS_REGISTRO_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps(_ANOS_REGISTRO, indent=1, sort_keys=True), encoding="utf-8")
+        tmp.replace(ANOS_REGISTRO_FILE)
+    except OSError:
+        pass  # disco somente leitura — registro fica só em memória
+
+
+def _ano_registrado(endpoint: str) -> Optional[int]:
+    """Ano mais recente com dados para o endpoint, se o registro ainda vale."""
+    with _ANOS_REGISTRO_LOCK:
+        _carregar_registro_anos()
+        e = _ANOS_REGISTRO.get(endpoint)
+    if not e or time.time() - e.get("atualizado_em", 0) > ANOS_REGISTRO_TTL:
+        return None
+    return e.get("ano")
+
+
+def _registrar_ano(endpoint: str, ano: int):
+    """Registra que o endpoint tem dados em `ano` (mantém o maior já visto)."""
+    if not ano:
+        return
+    agora = time.time()
+    with _ANOS_REGISTRO_LOCK:
+        _carregar_registro_anos()
+        e = _ANOS_REGISTRO.get(endpoint)
+        vencido = not e or agora - e.get("atualizado_em", 0) > ANOS_REGISTRO_TTL
+        if not vencido and ano <= e.get("ano", 0):
+            return
+        ano_novo = max(ano, e.get("ano", 0)) if e else ano
+        _ANOS_REGISTRO[endpoint] = {"ano": ano_novo, "atualizado_em": agora}
+        _salvar_registro_anos()
+
+
+def _anos_candidatos(n: int = 6, endpoint: str = None) -> list:
     """Retorna [ano_atual, ano-1, ..., ano-n+1] — fallback amplo para garantir dados.
 
     Sempre tenta do ano atual para trás. Com n=6 e ANO_ATUAL=2026:
     [2026, 2025, 2024, 2023, 2022, 2021] — censo/infra disponível em 2024,
     taxa em 2023, garantia máxima de encontrar dados.
+    Com `endpoint` e registro válido, começa do ano registrado.
     """
-    return [ANO_ATUAL - i for i in range(n)]
+    inicio = (_ano_registrado(endpoint) if endpoint else None) or ANO_ATUAL
+    return [inicio - i for i in range(n)]
 
 
 def _anos_saeb() -> list:
     """SAEB é bienal ímpar: 2023, 2021, 2019 ... Tenta do mais recente."""
-    a = ANO_ATUAL if ANO_ATUAL % 2 == 1 else ANO_ATUAL - 1
+    a = _ano_registrado("aprendizado") or ANO_ATUAL
+    a = a if a % 2 == 1 else a - 1
     return [a - 2 * i for i in range(5)]
 
 
 # =============================================================================
-# HTTP  (com cache por sessão — evita chamadas duplicadas)
+# CACHE  (LRU + TTL, compartilhado entre threads)
 # =============================================================================
-_FETCH_CACHE: Dict[tuple, Any] = {}
+_AUSENTE = object()  # sentinela — None é um valor válido no cache
+
+
+def _tamanho_aprox(valor) -> int:
+    try:
+        return len(json.dumps(valor, ensure_ascii=False, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(valor)
+
+
+class CacheLRU:
+    """Cache LRU thread-safe com TTL por entrada e limite de itens e de bytes."""
+
+    def __init__(self, max_itens: int, max_bytes: int, ttl: float):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._dados: "OrderedDict[Any, tuple]" = OrderedDict()  # chave → (valor, expira_em, tamanho)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = self.misses = 0
+
+    def get(self, chave, default=_AUSENTE):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                self.misses += 1
+                return default
+            valor, expira_em, _ = item
+            if expira_em < time.monotonic():
+                self._remover(chave)
+                self.misses += 1
+                return default
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def set(self, chave, valor, ttl: float = None, tamanho: int = None):
+        if tamanho is None:
+            tamanho = _tamanho_aprox(valor)
+        expira_em = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if chave in self._dados:
+                self._remover(chave)
+            self._dados[chave] = (valor, expira_em, tamanho)
+            self._bytes += tamanho
+            while self._dados and (len(self._dados) > self.max_itens
+                                   or self._bytes > self.max_bytes):
+                self._remover(next(iter(self._dados)))
+
+    def discard(self, chave):
+        with self._lock:
+            if chave in self._dados:
+                self._remover(chave)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+            self._bytes = 0
+
+    def _remover(self, chave):
+        _, _, tamanho = self._dados.pop(chave)
+        self._bytes -= tamanho
+
+    def __len__(self):
+        return len(self._dados)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"itens": len(self._dados), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class _VisaoCache:
+    """Visão de uma geração sobre o cache compartilhado.
+
+    Fixa localmente tudo que a geração leu ou gravou: evicção/expiração no
+    cache global não afeta uma geração em andamento, e gerações concorrentes
+    não apagam o cache umas das outras.
+    """
+
+    def __init__(self, base: CacheLRU, max_idade: float = None):
+        self._base = base
+        self._local: Dict[Any, Any] = {}
+        # respostas não podem ser mais velhas que `max_idade` (s): o cache
+        # compartilhado só vale se o TTL dele já garante isso
+        self.max_idade = max_idade
+        self._ler_base = max_idade is None or base.ttl <= max_idade
+
+    def get(self, chave, default=_AUSENTE):
+        if chave in self._local:
+            return self._local[chave]
+        if not self._ler_base:
+            return default
+        valor = self._base.get(chave)
+        if valor is _AUSENTE:
+            return default
+        self._local[chave] = valor
+        return valor
+
+    def set(self, chave, valor, ttl: float = None, tamanho: int = None):
+        self._local[chave] = valor
+        self._base.set(chave, valor, ttl=ttl, tamanho=tamanho)
+
+    def discard(self, chave):
+        self._local.pop(chave, None)
+        self._base.discard(chave)
+
+    def fixar(self, chave, valor):
+        """Fixa só nesta visão (não grava no cache compartilhado)."""
+        self._local[chave] = valor
+
+
+# Positivo: respostas com dados. Negativo (separado, TTL próprio): "sem dados"
+# confirmado — ex. censo 2026 — lembrado por horas; falha transitória, por segundos.
+_FETCH_CACHE = CacheLRU(CACHE_MAX_ITENS, CACHE_MAX_BYTES, CACHE_TTL)
+_NEG_CACHE   = CacheLRU(CACHE_MAX_ITENS * 4, CACHE_MAX_BYTES // 4, NEG_TTL_VAZIO)
+_VISAO_CACHE: contextvars.ContextVar = contextvars.ContextVar("qedu_visao_cache", default=None)
+
+
+def _cache():
+    """Cache ativo: a visão da geração corrente, ou o cache global."""
+    return _VISAO_CACHE.get() or _FETCH_CACHE
+
+
+@contextmanager
+def _escopo_cache(max_idade: float = None):
+    """Abre uma visão de cache para uma geração (propagada às threads via _submit).
+    Com `max_idade` (s), respostas em cache mais velhas que isso (memória ou
+    disco) são buscadas de novo — a geração não herda dados de dias atrás."""
+    token = _VISAO_CACHE.set(_VisaoCache(_FETCH_CACHE, max_idade))
+    try:
+        yield
+    finally:
+        _VISAO_CACHE.reset(token)
 
 
 def _clear_cache():
     _FETCH_CACHE.clear()
+    _NEG_CACHE.clear()
+
+
+def _marcar_negativo(cache, chave, valor, ttl: float):
+    """Guarda resposta vazia/falha no cache negativo (e fixa na visão corrente)."""
+    _NEG_CACHE.set(chave, valor, ttl=ttl)
+    if isinstance(cache, _VisaoCache):
+        cache.fixar(chave, valor)
+
+
+def _endpoint_de(url: str) -> str:
+    """Base de dados QEdu de uma URL: aprendizado, censo, infra, taxa ou outros."""
+    caminho = url[len(BASE_URL):] if url.startswith(BASE_URL) else url
+    for ep, trecho in (("taxa", "/taxa-rendimento/"), ("aprendizado", "/aprendizado/"),
+                       ("censo", "/censo/"), ("infra", "/infra/")):
+        if caminho.startswith(trecho):
+            return ep
+    return "outros"
+
+
+class CacheDisco:
+    """Cache persistente de respostas em SQLite.
+
+    Chave = (url, params); valor = JSON comprimido com zlib. TTL por endpoint
+    e evicção pelos acessos mais antigos quando passa de `max_bytes`.
+    O total de bytes fica em memória (somado uma vez ao abrir o arquivo e
+    atualizado a cada escrita/remoção) — gravar não varre a tabela.
+    Qualquer erro de disco desliga o cache silenciosamente (vira só miss).
+    """
+
+    def __init__(self, caminho: pathlib.Path, max_bytes: int, ttls: Dict[str, float]):
+        self.caminho = caminho
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._ativo = True
+        self._bytes: Optional[int] = None  # None = recontar na próxima escrita
+
+    def _conexao(self) -> Optional[sqlite3.Connection]:
+        if self._conn is None and self._ativo:
+            try:
+                self.caminho.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(str(self.caminho), check_same_thread=False, timeout=5)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""CREATE TABLE IF NOT EXISTS respostas (
+                                    chave TEXT PRIMARY KEY, endpoint TEXT, dados BLOB,
+                                    tamanho INTEGER, expira_em REAL, acessado_em REAL)""")
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_acesso ON respostas (acessado_em)")
+                self._conn = conn
+            except (OSError, sqlite3.Error):
+                self._ativo = False
+        return self._conn
+
+    def _total(self, conn) -> int:
+        if self._bytes is None:
+            self._bytes = conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+        return self._bytes
+
+    @staticmethod
+    def _chave(chave) -> str:
+        url, params = chave
+        return json.dumps([url, list(params)], ensure_ascii=False, default=str)
+
+    def _ttl(self, endpoint: str) -> float:
+        return self.ttls.get(endpoint, self.ttls.get("outros", 86400))
+
+    def get(self, chave, default=_AUSENTE, max_idade: float = None):
+        """Resposta guardada, ou `default`. Com `max_idade` (s), gravadas há mais
+        tempo que isso contam como miss (continuam lá para quem aceita o TTL)."""
+        with self._lock:
+            conn = self._conexao()
+            if conn is None:
+                return default
+            try:
+                k = self._chave(chave)
+                row = conn.execute("SELECT dados, expira_em, tamanho, endpoint FROM respostas "
+                                   "WHERE chave = ?", (k,)).fetchone()
+                if row is None:
+                    return default
+                if row[1] < time.time():
+                    conn.execute("DELETE FROM respostas WHERE chave = ?", (k,))
+                    conn.commit()
+                    if self._bytes is not None:
+                        self._bytes -= row[2]
+                    return default
+                # gravada em = expira_em - TTL do endpoint
+                if max_idade is not None and time.time() - (row[1] - self._ttl(row[3])) > max_idade:
+                    return default
+                conn.execute("UPDATE respostas SET acessado_em = ? WHERE chave = ?",
+                             (time.time(), k))
+                conn.commit()
+                return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+            except (sqlite3.Error, zlib.error, ValueError):
+                return default
+
+    def set(self, chave, valor, endpoint: str):
+        with self._lock:
+            conn = self._conexao()
+            if conn is None:
+                return
+            try:
+                blob = zlib.compress(json.dumps(valor, ensure_ascii=False).encode("utf-8"), 6)
+                agora = time.time()
+                ttl = self._ttl(endpoint)
+                k = self._chave(chave)
+                total = self._total(conn)
+                antigo = conn.execute("SELECT tamanho FROM respostas WHERE chave = ?", (k,)).fetchone()
+                conn.execute("INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?, ?)",
+                             (k, endpoint, blob, len(blob), agora + ttl, agora))
+                self._bytes = total + len(blob) - (antigo[0] if antigo else 0)
+                if self._bytes > self.max_bytes:
+                    self._evictar(conn)
+                conn.commit()
+            except (sqlite3.Error, TypeError, ValueError):
+                self._bytes = None  # transação pode ter sido desfeita — reconta
+
+    def _evictar(self, conn):
+        """Remove vencidos e, se ainda passar, os acessos mais antigos até 90% do limite."""
+        agora = time.time()
+        vencidos = conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas WHERE expira_em < ?",
+                                (agora,)).fetchone()[0]
+        if vencidos:
+            conn.execute("DELETE FROM respostas WHERE expira_em < ?", (agora,))
+            self._bytes -= vencidos
+        alvo = int(self.max_bytes * 0.9)
+        if self._bytes <= alvo:
+            return
+        for k, tam in conn.execute("SELECT chave, tamanho FROM respostas ORDER BY acessado_em").fetchall():
+            if self._bytes <= alvo:
+                break
+            conn.execute("DELETE FROM respostas WHERE chave = ?", (k,))
+            self._bytes -= tam
+
+    def clear(self):
+        with self._lock:
+            conn = self._conexao()
+            if conn is not None:
+                try:
+                    conn.execute("DELETE FROM respostas")
+                    conn.commit()
+                    self._bytes = 0
+                except sqlite3.Error:
+                    self._bytes = None
 
 
-def fetch_json(url: str, params: dict = None, tentativas: int = 3) -> Any:
+_DISCO_CACHE = CacheDisco(DISCO_CACHE_FILE, DISCO_CACHE_MAX_BYTES, DISCO_CACHE_TTL) if DISCO_CACHE else None
+
+
+# =============================================================================
+# LIMITE DE TAXA  (token bucket global + por base, concorrência AIMD)
+# =============================================================================
+class TokenBucket:
+    """Balde de fichas: `taxa` fichas/s, acumulando até `capacidade`."""
+
+    def __init__(self, taxa: float, capacidade: int):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._fichas = float(capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def ajustar(self, taxa: float):
+        """Troca a taxa; fichas acumuladas até agora contam pela taxa antiga."""
+        with self._lock:
+            self._repor(time.monotonic())
+            self.taxa = taxa
+
+    def _repor(self, agora: float):
+        self._fichas = min(self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa)
+        self._ultimo = agora
+
+    def adquirir(self):
+        """Bloqueia até haver uma ficha disponível."""
+        while True:
+            with self._lock:
+                self._repor(time.monotonic())
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.taxa
+            time.sleep(espera)
+
+
+class LimitadorAdaptativo:
+    """Controla taxa e concorrência das chamadas a qedu.org.br.
+
+    Fichas: um balde global e um por base (censo, infra, taxa, aprendizado).
+    Adaptação AIMD: 403/429/5xx, erro de conexão ou latência média acima de
+    LATENCIA_ALVO cortam pela metade a concorrência e as taxas (no máximo um
+    corte por segundo); cada sucesso devolve um pouco, até os tetos.
+    """
+
+    FATOR_MIN = 0.1
+
+    def __init__(self, rps_global: float, rps_endpoint: float, burst: int,
+                 concorrencia_max: int, latencia_alvo: float):
+        self.rps_global = rps_global
+        self.rps_endpoint = rps_endpoint
+        self.burst = burst
+        self.concorrencia_max = max(1, concorrencia_max)
+        self.latencia_alvo = latencia_alvo
+        self._global = TokenBucket(rps_global, burst)
+        self._por_endpoint: Dict[str, TokenBucket] = {}
+        self._fator = 1.0                          # multiplicador das taxas (0.1 – 1)
+        self._limite = float(self.concorrencia_max)
+        self._ativos = 0
+        self._latencia: Optional[float] = None     # média móvel (EWMA)
+        self._ultimo_corte = 0.0
+        self._cond = threading.Condition()
+
+    def _bucket(self, endpoint: str) -> TokenBucket:
+        with self._cond:
+            b = self._por_endpoint.get(endpoint)
+            if b is None:
+                b = self._por_endpoint[endpoint] = TokenBucket(
+                    self.rps_endpoint * self._fator, self.burst)
+            return b
+
+    @contextmanager
+    def slot(self, endpoint: str):
+        """Reserva uma vaga de concorrência e uma ficha (global e da base)."""
+        with self._cond:
+            while self._ativos >= int(self._limite):
+                self._cond.wait()
+            self._ativos += 1
+        try:
+            self._bucket(endpoint).adquirir()
+            self._global.adquirir()
+            yield
+        finally:
+            with self._cond:
+                self._ativos -= 1
+                self._cond.notify()
+
+    def registrar(self, status: int, latencia: float):
+        """Feedback de uma chamada — status 0 = erro de conexão/timeout."""
+        with self._cond:
+            self._latencia = latencia if self._latencia is None \
+                else 0.8 * self._latencia + 0.2 * latencia
+            congestionado = (status in (0, 403, 429) or status >= 500
+                             or self._latencia > self.latencia_alvo)
+            agora = time.monotonic()
+            if congestionado:
+                if agora - self._ultimo_corte < 1.0:
+                    return
+                self._ultimo_corte = agora
+                self._limite = max(1.0, self._limite / 2)
+                self._fator = max(self.FATOR_MIN, self._fator / 2)
+            else:
+                self._limite = min(self.concorrencia_max, self._limite + 1 / self._limite)
+                self._fator = min(1.0, self._fator + 0.02)
+            self._global.ajustar(self.rps_global * self._fator)
+            for b in self._por_endpoint.values():
+                b.ajustar(self.rps_endpoint * self._fator)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"concorrencia": int(self._limite), "ativos": self._ativos,
+                    "rps_global": round(self._global.taxa, 2),
+                    "latencia_media_s": round(self._latencia or 0.0, 3)}
+
+
+_LIMITADOR = LimitadorAdaptativo(RATE_GLOBAL_RPS, RATE_ENDPOINT_RPS, RATE_BURST,
+                                 CONCORRENCIA_MAX, LATENCIA_ALVO)
+
+
+# =============================================================================
+# FALHAS  (classificação, backoff com jitter, circuit breaker por base)
+# =============================================================================
+def _erro_transitorio(status: int) -> bool:
+    """Vale a pena repetir? 0 = conexão/timeout. 403/429 = bloqueio por excesso
+    de chamadas no qedu.org.br. Demais 4xx (404, 400...) são definitivos."""
+    return status in (0, 403, 408, 429) or status >= 500
+
+
+def _backoff(tentativa: int, retry_after: Optional[str] = None) -> float:
+    """Espera exponencial com jitter; respeita Retry-After (limitado a RETRY_MAX_S)."""
+    if retry_after:
+        try:
+            return min(RETRY_MAX_S, float(retry_after))
+        except ValueError:
+            pass
+    teto = min(RETRY_MAX_S, RETRY_BASE_S * 2 ** tentativa)
+    return teto / 2 + random.uniform(0, teto / 2)
+
+
+class CircuitBreaker:
+    """Circuit breaker por base da API.
+
+    Após `falhas_max` falhas transitórias seguidas o circuito abre e as
+    chamadas falham na hora por `pausa` segundos — sem prender workers em
+    timeouts enquanto o QEdu está fora. Depois, uma única chamada de teste
+    passa (meio-aberto): sucesso fecha o circuito, falha reabre.
+    """
+
+    def __init__(self, falhas_max: int, pausa: float):
+        self.falhas_max = falhas_max
+        self.pausa = pausa
+        self._estado: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint):
+        return self._estado.setdefault(endpoint, {"falhas": 0, "aberto_ate": 0.0, "teste": False})
+
+    def permite(self, endpoint: str) -> bool:
+        with self._lock:
+            e = self._get(endpoint)
+            if not e["aberto_ate"]:
+                return True
+            if time.monotonic() < e["aberto_ate"] or e["teste"]:
+                return False
+            e["teste"] = True  # meio-aberto: deixa passar só esta
+            return True
+
+    def sucesso(self, endpoint: str):
+        with self._lock:
+            e = self._get(endpoint)
+            e["falhas"], e["aberto_ate"], e["teste"] = 0, 0.0, False
+
+    def falha(self, endpoint: str):
+        with self._lock:
+            e = self._get(endpoint)
+            e["falhas"] += 1
+            if e["teste"] or e["falhas"] >= self.falhas_max:
+                e["aberto_ate"] = time.monotonic() + self.pausa
+                e["teste"] = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            agora = time.monotonic()
+            return {ep: ("aberto" if e["aberto_ate"] > agora else
+                         "meio-aberto" if e["aberto_ate"] else "fechado")
+                    for ep, e in self._estado.items()}
+
+
+_CIRCUITO = CircuitBreaker(CIRCUITO_FALHAS, CIRCUITO_PAUSA_S)
+
+
+# =============================================================================
+# HTTP  (com cache por sessão — evita chamadas duplicadas)
+# =============================================================================
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """Sessão HTTP compartilhada entre threads, com pool de conexões keep-alive.
+
+    Todas as chamadas à API reutilizam as mesmas conexões TCP/TLS — o handshake
+    com qedu.org.br é pago uma vez por conexão do pool, não a cada request.
+    """
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                s = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=2,
+                                                        pool_maxsize=HTTP_POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                s.headers.update(HEADERS)
+                if not HTTP_KEEPALIVE:
+                    s.headers["Connection"] = "close"
+                _SESSION = s
+    return _SESSION
+
+
+def fetch_json(url: str, params: dict = None, tentativas: int = 3,
+               tem_dados: Callable[[Any], bool] = None) -> Any:
+    """GET JSON na API QEdu com cache, limite de taxa, retentativas e circuit breaker.
+
+    `tem_dados`, se informado, separa resposta válida porém vazia (ex. ano
+    ainda sem dados) — que vai para o cache negativo em vez do positivo.
+    """
     cache_key = (url, tuple(sorted((params or {}).items())))
-    if cache_key in _FETCH_CACHE:
-        return _FETCH_CACHE[cache_key]
+    cache = _cache()
+    max_idade = cache.max_idade if isinstance(cache, _VisaoCache) else None
+    hit = cache.get(cache_key)
+    if hit is not _AUSENTE:
+        return hit
+    hit = _NEG_CACHE.get(cache_key) if max_idade is None or _NEG_CACHE.ttl <= max_idade else _AUSENTE
+    if hit is not _AUSENTE:
+        if isinstance(cache, _VisaoCache):
+            cache.fixar(cache_key, hit)
+        return hit
+    endpoint = _endpoint_de(url)
+    if _DISCO_CACHE is not None:
+        hit = _DISCO_CACHE.get(cache_key, max_idade=max_idade)
+        if hit is not _AUSENTE:
+            cache.set(cache_key, hit)
+            return hit
     for i in range(tentativas):
+        if not _CIRCUITO.permite(endpoint):
+            break  # upstream fora — falha rápida
+        status, retry_after = 0, None
         try:
-            r = requests.get(url, params=params, headers=HEADERS, timeout=30)
+            with _LIMITADOR.slot(endpoint):
+                t0 = time.monotonic()
+                try:
+                    r = _get_session().get(url, params=params, timeout=HTTP_TIMEOUT)
+                except requests.RequestException:
+                    _LIMITADOR.registrar(0, time.monotonic() - t0)
+                    raise
+                _LIMITADOR.registrar(r.status_code, time.monotonic() - t0)
+            status, retry_after = r.status_code, r.headers.get("Retry-After")
             r.raise_for_status()
             result = r.json()
-            _FETCH_CACHE[cache_key] = result
-            return result
         except Exception:
-            if i == tentativas - 1:
-                _FETCH_CACHE[cache_key] = None
+            if status >= 400 and not _erro_transitorio(status):
+                _CIRCUITO.sucesso(endpoint)  # upstream respondeu: 404 etc. não vão mudar
+                _marcar_negativo(cache, cache_key, None, NEG_TTL_VAZIO)
                 return None
-            time.sleep(0.5)
+            _CIRCUITO.falha(endpoint)
+            if i < tentativas - 1:
+                time.sleep(_backoff(i, retry_after if status == 429 else None))
+            continue
+        _CIRCUITO.sucesso(endpoint)
+        if tem_dados is not None and not tem_dados(result):
+            _marcar_negativo(cache, cache_key, result, NEG_TTL_VAZIO)
+            return result
+        cache.set(cache_key, result, tamanho=len(r.content))
+        if _DISCO_CACHE is not None:
+            _DISCO_CACHE.set(cache_key, result, endpoint)
+        return result
+    _marcar_negativo(cache, cache_key, None, NEG_TTL_FALHA)
     return None
 
 
 # =============================================================================
 # COLETA — com fallback de anos
 # =============================================================================
+def _sondar_anos(endpoint, anos, consulta, tem_dados):
+    """Retorna (dados, ano) do primeiro ano de `anos` com dados, ou (None, 0).
+
+    `anos` vem do mais recente para o mais antigo. Se o primeiro é o ano do
+    registro, ele é consultado sozinho (quase sempre acerta). Senão, em modo
+    paralelo todos os anos são consultados de uma vez; assim que um ano
+    confirma dados, as sondas mais antigas ainda na fila são canceladas e
+    as em voo, ignoradas.
+    """
+    if anos and anos[0] == _ano_registrado(endpoint):
+        d = consulta(anos[0])
+        if tem_dados(d):
+            return d, anos[0]
+        anos = anos[1:]
+
+    achado = None, 0
+    if not PROBE_PARALELO or len(anos) < 2:
+        for a in anos:
+            d = consulta(a)
+            if tem_dados(d):
+                achado = d, a
+                break
+    else:
+        pool = _pool("probe", PROBE_WORKERS)
+        futuros = [(a, _submit(pool, consulta, a)) for a in anos]
+        try:
+            for a, f in futuros:
+                d = f.result()
+                if tem_dados(d):
+                    achado = d, a
+                    break
+        finally:
+            for _, f in futuros:
+                f.cancel()
+    _registrar_ano(endpoint, achado[1])
+    return achado
+
+
+def _censo_tem_dados(d):
+    return bool(d and d.get("censo"))
+
+
 def fetch_censo(ibge, dep_id, ano=None, loc=0, oferta=0):
-    for a in ([ano] if ano else _anos_candidatos()):
-        d = fetch_json(f"{BASE_URL}/censo/territorios/matriculas",
-                       {"ibge_id": ibge, "ano": a, "dependencia_id": dep_id,
-                        "localizacao_id": loc, "oferta_id": oferta})
-        if d and d.get("censo"):
-            return d, a
-    return None, 0
+    def consulta(a):
+        return fetch_json(f"{BASE_URL}/censo/territorios/matriculas",
+                          {"ibge_id": ibge, "ano": a, "dependencia_id": dep_id,
+                           "localizacao_id": loc, "oferta_id": oferta},
+                          tem_dados=_censo_tem_dados)
+    return _sondar_anos("censo", [ano] if ano else _anos_candidatos(endpoint="censo"),
+                        consulta, _censo_tem_dados)
+
+
+def _infra_tem_valores(d):
+    if d and isinstance(d, list):
+        for s in d:
+            for it in s.get("items", []):
+                if it.get("values"):
+                    return True
+    return False
 
 
 def fetch_infra(ibge, dep_id, ano=None):
-    for a in ([ano] if ano else _anos_candidatos()):
-        d = fetch_json(f"{BASE_URL}/infra/{ibge}/comparativo",
-                       {"dependencia_id": dep_id, "ano": a})
-        if d and isinstance(d, list):
-            for s in d:
-                for it in s.get("items", []):
-                    if it.get("values"):
-                        return d, a
-    return None, 0
+    def consulta(a):
+        return fetch_json(f"{BASE_URL}/infra/{ibge}/comparativo",
+                          {"dependencia_id": dep_id, "ano": a},
+                          tem_dados=_infra_tem_valores)
+    return _sondar_anos("infra", [ano] if ano else _anos_candidatos(endpoint="infra"),
+                        consulta, _infra_tem_valores)
 
 
 def fetch_aprendizado(ibge, dep_id, ciclo):
-    return fetch_json(f"{BASE_URL}/aprendizado/{ibge}/ultimos-comparativo",
-                      {"dependencia_id": dep_id, "ciclo_id": ciclo})
+    d = fetch_json(f"{BASE_URL}/aprendizado/{ibge}/ultimos-comparativo",
+                   {"dependencia_id": dep_id, "ciclo_id": ciclo})
+    if d and isinstance(d, list):
+        anos = [r.get("ano") or 0 for g in d if isinstance(g, list)
+                for r in g if isinstance(r, dict)]
+        _registrar_ano("aprendizado", max(anos, default=0))
+    return d
 
 
 def _normalizar_taxa_keys(d):
@@ -217,41 +944,150 @@ def _normalizar_taxa_keys(d):
     }
 
 
+def _taxa_tem_dados(d):
+    return bool(d and (d.get("entidade") or d.get("municipio") or d.get("brasil")))
+
+
 def fetch_taxa(ibge, ciclo, dep_id=0, ano=None, loc=0):
-    for a in ([ano] if ano else _anos_candidatos()):
-        d = fetch_json(
+    def consulta(a):
+        return fetch_json(
             f"{BASE_URL}/taxa-rendimento/taxa-rendimento/{ibge}/comparacao",
             {"dependencia_id": dep_id, "ano": a,
-             "ciclo_id": ciclo, "localizacao_id": loc})
-        if d and (d.get("entidade") or d.get("municipio") or d.get("brasil")):
-            norm = _normalizar_taxa_keys(d)
-            # Detectar ano real mais recente nos dados (API pode ignorar param ano)
-            ano_real = 0
-            for regs in norm.values():
-                if isinstance(regs, list):
-                    for r in regs:
-                        ra = r.get("ano")
-                        if ra and ra > ano_real:
-                            ano_real = ra
-            return norm, ano_real if ano_real else a
-    return None, 0
+             "ciclo_id": ciclo, "localizacao_id": loc},
+            tem_dados=_taxa_tem_dados)
+    d, a = _sondar_anos("taxa", [ano] if ano else _anos_candidatos(endpoint="taxa"),
+                        consulta, _taxa_tem_dados)
+    if not d:
+        return None, 0
+    norm = _normalizar_taxa_keys(d)
+    # Detectar ano real mais recente nos dados (API pode ignorar param ano)
+    ano_real = 0
+    for regs in norm.values():
+        if isinstance(regs, list):
+            for r in regs:
+                ra = r.get("ano")
+                if ra and ra > ano_real:
+                    ano_real = ra
+    return norm, ano_real if ano_real else a
 
 
 def fetch_taxa_historico(ibge, ciclo, dep_id=0, loc=0):
     """Busca últimos 3 anos de taxa para evolução histórica."""
     resultados = {}
-    for a in _anos_candidatos(8):
+    for a in _anos_candidatos(8, endpoint="taxa"):
         d = fetch_json(
             f"{BASE_URL}/taxa-rendimento/taxa-rendimento/{ibge}/comparacao",
             {"dependencia_id": dep_id, "ano": a,
-             "ciclo_id": ciclo, "localizacao_id": loc})
-        if d and (d.get("entidade") or d.get("municipio") or d.get("brasil")):
+             "ciclo_id": ciclo, "localizacao_id": loc},
+            tem_dados=_taxa_tem_dados)
+        if _taxa_tem_dados(d):
             resultados[a] = _normalizar_taxa_keys(d)
         if len(resultados) >= 3:
             break
+    if resultados:
+        _registrar_ano("taxa", max(resultados))
     return resultados
 
 
+# =============================================================================
+# PREFETCH — dispara em paralelo as chamadas dos 5 relatórios
+# =============================================================================
+_POOLS: Dict[str, ThreadPoolExecutor] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _pool(nome: str, workers: int) -> ThreadPoolExecutor:
+    """Pool de threads compartilhado e limitado, criado sob demanda."""
+    with _POOLS_LOCK:
+        ex = _POOLS.get(nome)
+        if ex is None:
+            ex = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"qedu-{nome}")
+            _POOLS[nome] = ex
+        return ex
+
+
+def _submit(pool: ThreadPoolExecutor, fn, *args):
+    """pool.submit preservando o contexto (visão de cache) da thread chamadora."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _prefetch(ibge, tipos=None):
+    """Aquece o cache com todas as chamadas independentes dos relatórios
+    (só dos `tipos` pedidos, se informados).
+
+    Os geradores (e coletar_dados_estruturados) depois leem tudo do cache —
+    a latência total passa a ser a da chamada mais lenta, não a soma delas.
+    """
+    por_tipo = {
+        "aprendizado":     [(fetch_aprendizado, (ibge, 5, cid)) for cid in CICLOS],
+        "censo":           [(fetch_censo, (ibge, 3))],
+        "infra":           [(fetch_infra, (ibge, 3))],
+        "taxa_rendimento": [(fetch_taxa, (ibge, cid)) for cid in CICLOS],
+    }
+    tarefas = [t for tipo, ts in por_tipo.items() if tipos is None or tipo in tipos for t in ts]
+
+    pool = _pool("prefetch", PREFETCH_WORKERS)
+    futuros = [_submit(pool, fn, *args) for fn, args in tarefas]
+    for f in futuros:
+        try:
+            f.result()
+        except Exception:
+            pass  # o gerador refaz a chamada e trata o erro no próprio relatório
+
+
+# =============================================================================
+# COALESCÊNCIA  (single-flight — N chamadas iguais simultâneas → 1 execução)
+# =============================================================================
+class _Chamada:
+    __slots__ = ("evento", "resultado", "erro")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Chamadas concorrentes com a mesma chave esperam uma única execução e
+    recebem o mesmo resultado (ou a mesma exceção)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._em_voo: Dict[Any, _Chamada] = {}
+
+    def do(self, chave, fn, *args, cobre: Callable[[Any], bool] = None, **kwargs):
+        """`cobre(chave_em_voo)` → True se uma execução já em voo também serve
+        para esta chamada (ex.: gera um superconjunto do pedido); nesse caso
+        espera por ela em vez de abrir outra."""
+        with self._lock:
+            chamada = self._em_voo.get(chave)
+            if chamada is None and cobre is not None:
+                chamada = next((c for k, c in self._em_voo.items() if cobre(k)), None)
+            lider = chamada is None
+            if lider:
+                chamada = self._em_voo[chave] = _Chamada()
+
+        if not lider:
+            chamada.evento.wait()
+            if chamada.erro is not None:
+                raise chamada.erro
+            return chamada.resultado
+
+        try:
+            chamada.resultado = fn(*args, **kwargs)
+            return chamada.resultado
+        except BaseException as e:
+            chamada.erro = e
+            raise
+        finally:
+            with self._lock:
+                self._em_voo.pop(chave, None)
+            chamada.evento.set()
+
+
+_SINGLE_FLIGHT = SingleFlight()
+
+
 # =============================================================================
 # IDEB (CSV)
 # =============================================================================
@@ -268,70 +1104,519 @@ def _normalizar_segmento(s):
     return s.strip()
 
 
-def load_ideb(ibge):
-    """Retorna (df_mun, df_uf, brasil_stats) ou (None, None, None)."""
-    if not IDEB_MUN_CSV.exists() or not IDEB_UF_CSV.exists():
-        return None, None, None
+class _IdebStore:
+    """CSVs do IDEB lidos e normalizados uma vez por processo.
+
+    Índices por `codigo_ibge` (municípios) e `indicador_uf` (estados) guardam
+    as posições das linhas — consulta por IBGE vira um acesso ao dicionário,
+    não uma varredura da coluna inteira.
 
-    mun_df = pd.read_csv(IDEB_MUN_CSV, sep=",", dtype={"codigo_ibge": str})
-    uf_df  = pd.read_csv(IDEB_UF_CSV, sep=";")
+    Os DataFrames ficam compactos (ver `_compactar_ideb`); as fatias entregues
+    por `municipio`/`estado` voltam aos dtypes "largos" que os geradores usam.
+    """
 
-    mun_df.columns = [c.strip().lower() for c in mun_df.columns]
-    uf_df.columns  = [c.strip().lower() for c in uf_df.columns]
+    def __init__(self, mun_df: "pd.DataFrame", uf_df: "pd.DataFrame"):
+        self.mun = _compactar_ideb(mun_df)
+        self.uf = _compactar_ideb(uf_df)
+        self._idx_mun = self.mun.groupby("codigo_ibge", sort=False, observed=True).indices \
+            if "codigo_ibge" in self.mun.columns else {}
+        self._idx_uf = self.uf.groupby("indicador_uf", sort=False, observed=True).indices \
+            if "indicador_uf" in self.uf.columns else {}
+        self.brasil_stats = self._calcular_brasil_stats(_expandir_ideb(self.uf))
+
+    @staticmethod
+    def _calcular_brasil_stats(uf_df) -> Optional["pd.DataFrame"]:
+        """Brasil = stats dos estados por indicador × ano × segmento."""
+        if "valor_numerico" not in uf_df.columns or "indicador_tipo_nome" not in uf_df.columns:
+            return None
+        cols_group = ["indicador_tipo_nome", "ano"]
+        if "segmento" in uf_df.columns:
+            cols_group.append("segmento")
+        return (uf_df.groupby(cols_group)["valor_numerico"]
+                .agg(["mean", "median", "std", "min", "max", "count"])
+                .reset_index())
+
+    @staticmethod
+    def _linhas(df, idx, chave):
+        pos = idx.get(chave)
+        # iloc + expansão já produzem colunas novas — nada de .copy() extra
+        return _expandir_ideb(df.iloc[pos] if pos is not None else df.iloc[0:0])
+
+    def municipio(self, ibge) -> "pd.DataFrame":
+        return self._linhas(self.mun, self._idx_mun, str(ibge))
+
+    def estado(self, uf_sigla) -> "pd.DataFrame":
+        return self._linhas(self.uf, self._idx_uf, uf_sigla)
+
+    def memoria(self) -> Dict[str, Any]:
+        """Bytes ocupados por tabela e coluna (memory_usage deep)."""
+        rel = {}
+        for nome, df in [("municipios", self.mun), ("estados", self.uf)]:
+            cols = df.memory_usage(deep=True, index=False)
+            rel[nome] = {
+                "linhas": len(df),
+                "bytes": int(cols.sum()),
+                "colunas": {c: {"dtype": str(df[c].dtype), "bytes": int(cols[c])}
+                            for c in df.columns},
+            }
+        rel["total_bytes"] = rel["municipios"]["bytes"] + rel["estados"]["bytes"]
+        return rel
+
+
+def _ler_csv_ideb(caminho: pathlib.Path, sep: str, dtype: dict = None) -> "pd.DataFrame":
+    """Lê e normaliza um CSV do IDEB (colunas, segmentos, valor numérico)."""
+    df = pd.read_csv(caminho, sep=sep, dtype=dtype)
+    df.columns = [c.strip().lower() for c in df.columns]
 
     # normalizar nomes de colunas
-    if "valor" in uf_df.columns and "valor_numerico" not in uf_df.columns:
-        uf_df.rename(columns={"valor": "valor_numerico"}, inplace=True)
-    if "valor" in mun_df.columns and "valor_numerico" not in mun_df.columns:
-        mun_df.rename(columns={"valor": "valor_numerico"}, inplace=True)
+    if "valor" in df.columns and "valor_numerico" not in df.columns:
+        df.rename(columns={"valor": "valor_numerico"}, inplace=True)
 
-    # normalizar segmentos
-    for df in [mun_df, uf_df]:
-        if "segmento" in df.columns:
-            df["segmento"] = df["segmento"].apply(_normalizar_segmento)
+    # normalizar segmentos (uma vez por valor distinto, não por linha)
+    if "segmento" in df.columns:
+        df["segmento"] = df["segmento"].map(
+            {v: _normalizar_segmento(v) for v in df["segmento"].unique()})
 
     # converter valor_numerico
-    for df in [mun_df, uf_df]:
-        if "valor_numerico" in df.columns:
-            df["valor_numerico"] = pd.to_numeric(df["valor_numerico"], errors="coerce")
+    if "valor_numerico" in df.columns:
+        df["valor_numerico"] = pd.to_numeric(df["valor_numerico"], errors="coerce")
+    return df
+
+
+# ---------- representação compacta em memória ----------
+# Texto repetido → category (códigos inteiros + dicionário), ano → int16,
+# valores → float32. Os valores do IDEB/SAEB têm no máximo 2 casas; ao
+# expandir para float64 arredondamos em IDEB_VALOR_DECIMAIS, o que devolve
+# exatamente o número lido do CSV. Coluna com valor que não sobrevive à ida e
+# volta (ex.: 6.449999999999999) fica em float64 — nunca altera um número.
+IDEB_COLUNAS_CATEGORICAS = ["codigo_ibge", "indicador_municipio", "nome", "indicador_uf",
+                            "indicador_tipo_nome", "esfera", "segmento"]
+IDEB_COLUNAS_FLOAT = ["valor_numerico", "estado_id"]
+IDEB_VALOR_DECIMAIS = 4
+
+
+def _compactar_ideb(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Converte as colunas do IDEB para dtypes estreitos (in-place, idempotente)."""
+    for c in IDEB_COLUNAS_CATEGORICAS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    if "ano" in df.columns and df["ano"].dtype.kind in "iu":
+        df["ano"] = df["ano"].astype("int16")
+    for c in IDEB_COLUNAS_FLOAT:
+        if c in df.columns and df[c].dtype == "float64":
+            estreita = df[c].astype("float32")
+            volta = estreita.astype("float64").round(IDEB_VALOR_DECIMAIS)
+            if ((volta == df[c]) | df[c].isna()).all():
+                df[c] = estreita
+    return df
+
+
+def _expandir_ideb(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Fatia compacta → DataFrame com os dtypes lidos do CSV (object/int64/float64)."""
+    largas = {}
+    for c in df.columns:
+        dt = df[c].dtype
+        if isinstance(dt, pd.CategoricalDtype):
+            largas[c] = df[c].astype(object)
+        elif dt == "int16":
+            largas[c] = df[c].astype("int64")
+        elif dt == "float32":
+            largas[c] = df[c].astype("float64").round(IDEB_VALOR_DECIMAIS)
+        else:
+            largas[c] = df[c]
+    return pd.DataFrame(largas, index=df.index)
+
+
+# ---------- cache colunar (Feather) ao lado dos CSVs ----------
+# Versão do formato — incrementar quando a normalização/compactação mudar.
+IDEB_COLUNAR_VERSAO = 2
+
+
+def _caminho_colunar(csv: pathlib.Path) -> pathlib.Path:
+    return csv.with_suffix(".feather")
+
+
+def _caminho_colunar_meta(csv: pathlib.Path) -> pathlib.Path:
+    return csv.with_name(csv.stem + ".feather.json")
+
+
+def _sha256(caminho: pathlib.Path) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _colunar_atualizado(csv: pathlib.Path) -> bool:
+    """O .feather corresponde ao CSV atual? (mtime/tamanho; na dúvida, hash)."""
+    destino, meta_path = _caminho_colunar(csv), _caminho_colunar_meta(csv)
+    if not destino.exists() or not meta_path.exists():
+        return False
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    if meta.get("versao") != IDEB_COLUNAR_VERSAO:
+        return False
+    st = csv.stat()
+    if meta.get("tamanho") == st.st_size and meta.get("mtime_ns") == st.st_mtime_ns:
+        return True
+    if meta.get("sha256") != _sha256(csv):
+        return False
+    meta["tamanho"], meta["mtime_ns"] = st.st_size, st.st_mtime_ns  # só tocou no arquivo
+    meta_path.write_text(json.dumps(meta, indent=1), encoding="utf-8")
+    return True
+
+
+def _gravar_colunar(csv: pathlib.Path, df: "pd.DataFrame"):
+    """Grava o DataFrame normalizado (já compacto) em Feather — sem compressão → mmap direto."""
+    out = _compactar_ideb(df)
+    destino = _caminho_colunar(csv)
+    tmp = destino.with_name(destino.name + ".tmp")
+    feather.write_feather(out, str(tmp), compression="uncompressed")
+    tmp.replace(destino)
+    st = csv.stat()
+    _caminho_colunar_meta(csv).write_text(json.dumps({
+        "versao": IDEB_COLUNAR_VERSAO, "fonte": csv.name, "sha256": _sha256(csv),
+        "tamanho": st.st_size, "mtime_ns": st.st_mtime_ns,
+        "linhas": len(df), "gerado_em": datetime.now().isoformat(timespec="seconds"),
+    }, indent=1), encoding="utf-8")
+
+
+def _ler_colunar(csv: pathlib.Path) -> "pd.DataFrame":
+    # category/int16/float32 vêm direto do arquivo — sem passar por object
+    return feather.read_table(str(_caminho_colunar(csv)), memory_map=True).to_pandas()
+
+
+def _carregar_ideb(csv: pathlib.Path, sep: str, dtype: dict = None) -> "pd.DataFrame":
+    """DataFrame normalizado de um CSV do IDEB — via Feather se disponível."""
+    if feather is None:
+        return _ler_csv_ideb(csv, sep, dtype)
+    try:
+        if not _colunar_atualizado(csv):
+            _gravar_colunar(csv, _ler_csv_ideb(csv, sep, dtype))
+        return _ler_colunar(csv)
+    except (OSError, ValueError, ImportError):
+        return _ler_csv_ideb(csv, sep, dtype)  # dados/ somente leitura etc.
+
+
+def _ler_csvs_ideb():
+    return (_carregar_ideb(IDEB_MUN_CSV, ",", {"codigo_ibge": str}),
+            _carregar_ideb(IDEB_UF_CSV, ";"))
+
+
+def atualizar_cache_ideb(forcar: bool = False) -> List[pathlib.Path]:
+    """Gera/atualiza os .feather dos CSVs do IDEB. Retorna os arquivos regravados."""
+    if feather is None:
+        raise RuntimeError("pyarrow não instalado — cache colunar indisponível")
+    regravados = []
+    for csv, sep, dtype in [(IDEB_MUN_CSV, ",", {"codigo_ibge": str}), (IDEB_UF_CSV, ";", None)]:
+        if not csv.exists():
+            continue
+        if forcar or not _colunar_atualizado(csv):
+            _gravar_colunar(csv, _ler_csv_ideb(csv, sep, dtype))
+            regravados.append(_caminho_colunar(csv))
+    return regravados
+
+
+_IDEB_STORE: Optional[_IdebStore] = None
+_IDEB_STORE_VERSAO = None
+_IDEB_STORE_LOCK = threading.Lock()
+
+
+def _ideb_store() -> Optional[_IdebStore]:
+    """Store do IDEB (recarrega só se algum CSV mudar), ou None sem CSVs."""
+    global _IDEB_STORE, _IDEB_STORE_VERSAO
+    if not IDEB_MUN_CSV.exists() or not IDEB_UF_CSV.exists():
+        return None
+    st_mun, st_uf = IDEB_MUN_CSV.stat(), IDEB_UF_CSV.stat()
+    versao = (str(IDEB_MUN_CSV), st_mun.st_mtime_ns, st_mun.st_size,
+              str(IDEB_UF_CSV), st_uf.st_mtime_ns, st_uf.st_size)
+    with _IDEB_STORE_LOCK:
+        if _IDEB_STORE is None or _IDEB_STORE_VERSAO != versao:
+            _IDEB_STORE = _IdebStore(*_ler_csvs_ideb())
+            _IDEB_STORE_VERSAO = versao
+        return _IDEB_STORE
+
+
+def ideb_brasil_stats() -> Optional["pd.DataFrame"]:
+    """Tabela Brasil (mean/median/std/min/max/count dos estados) por
+    indicador × ano × segmento. Calculada uma vez por versão dos CSVs —
+    tabela compartilhada, não modificar."""
+    store = _ideb_store()
+    return store.brasil_stats if store is not None else None
 
-    df_mun = mun_df[mun_df["codigo_ibge"] == str(ibge)].copy()
+
+def ideb_memoria() -> Optional[Dict[str, Any]]:
+    """Relatório de memória do store do IDEB (por tabela/coluna), ou None sem CSVs."""
+    store = _ideb_store()
+    return store.memoria() if store is not None else None
+
+
+def load_ideb(ibge):
+    """Retorna (df_mun, df_uf, brasil_stats) ou (None, None, None)."""
+    store = _ideb_store()
+    if store is None:
+        return None, None, None
+
+    df_mun = store.municipio(ibge)
 
     # --- Estado (2 dígitos): usa CSV de estados como dados primários ---
     if is_estado(ibge):
         _, uf_sigla = UF_CODES.get(str(ibge), ("", ""))
-        df_estado = uf_df[uf_df["indicador_uf"] == uf_sigla].copy() if uf_sigla else pd.DataFrame()
+        df_estado = store.estado(uf_sigla) if uf_sigla else pd.DataFrame()
         if df_estado.empty:
             return None, None, None
-        # Brasil = stats dos estados
-        brasil_st = None
-        if "valor_numerico" in uf_df.columns and "indicador_tipo_nome" in uf_df.columns:
-            cols_group = ["indicador_tipo_nome", "ano"]
-            if "segmento" in uf_df.columns:
-                cols_group.append("segmento")
-            brasil_st = (uf_df.groupby(cols_group)["valor_numerico"]
-                         .agg(["mean", "median", "std", "min", "max", "count"])
-                         .reset_index())
         # Retorna estado como df_mun (primário), None como df_uf, e brasil_stats
-        return df_estado, None, brasil_st
+        return df_estado, None, store.brasil_stats
 
     if df_mun.empty:
         return None, None, None
 
     uf_sigla = df_mun["indicador_uf"].iloc[0] if "indicador_uf" in df_mun.columns else None
-    df_uf = uf_df[uf_df["indicador_uf"] == uf_sigla].copy() if uf_sigla else pd.DataFrame()
+    df_uf = store.estado(uf_sigla) if uf_sigla else pd.DataFrame()
 
-    # Brasil = stats dos estados
-    brasil_stats = None
-    if "valor_numerico" in uf_df.columns and "indicador_tipo_nome" in uf_df.columns:
-        cols_group = ["indicador_tipo_nome", "ano"]
-        if "segmento" in uf_df.columns:
-            cols_group.append("segmento")
-        brasil_stats = (uf_df.groupby(cols_group)["valor_numerico"]
-                        .agg(["mean", "median", "std", "min", "max", "count"])
-                        .reset_index())
+    return df_mun, df_uf, store.brasil_stats
 
-    return df_mun, df_uf, brasil_stats
+
+# =============================================================================
+# CADASTRO DE MUNICÍPIOS (IBGE → nome, UF)
+# =============================================================================
+# Cadastro local dos municípios, carregado uma vez e consultado por dicionário.
+# Fonte principal: dados/municipios_ibge.csv (codigo_ibge,nome,uf,codigo_uf),
+# versionado no repositório com os 5.571 municípios do IBGE. `--build-municipios`
+# (no build do Docker/Render) completa o arquivo com códigos que só existam no
+# CSV do IDEB ou nos nomes aprendidos e falha se o cadastro ficar vazio. Nomes
+# descobertos pela API em tempo de execução vão para um complemento em
+# CACHE_DIR e entram na próxima reconstrução do arquivo.
+MUNICIPIOS_CSV = pathlib.Path(os.environ.get("QEDU_MUNICIPIOS_CSV",
+                                              DADOS_DIR / "municipios_ibge.csv"))
+MUNICIPIOS_APRENDIDOS_FILE = CACHE_DIR / "municipios_aprendidos.json"
+
+_MUNICIPIOS: Dict[str, Tuple[str, str]] = {}
+_MUNICIPIOS_VERSAO: Any = _AUSENTE
+_MUNICIPIOS_APRENDIDOS: Optional[Dict[str, List[str]]] = None
+_MUNICIPIOS_GERACAO = 0  # muda a cada recarga/aprendizado — invalida o índice de busca
+_MUNICIPIOS_LOCK = threading.Lock()
+
+
+def _ler_cadastro_municipios(caminho: pathlib.Path) -> Dict[str, Tuple[str, str]]:
+    df = pd.read_csv(caminho, dtype=str, keep_default_na=False)
+    return dict(zip(df["codigo_ibge"], zip(df["nome"], df["uf"])))
+
+
+def _carregar_aprendidos():
+    global _MUNICIPIOS_APRENDIDOS
+    if _MUNICIPIOS_APRENDIDOS is not None:
+        return
+    try:
+        dados = json.loads(MUNICIPIOS_APRENDIDOS_FILE.read_text(encoding="utf-8"))
+        _MUNICIPIOS_APRENDIDOS = dados if isinstance(dados, dict) else {}
+    except (OSError, ValueError):
+        _MUNICIPIOS_APRENDIDOS = {}
+
+
+def _cadastro_municipios() -> Dict[str, Tuple[str, str]]:
+    """Cadastro IBGE → (nome, UF). Relê o CSV só se ele mudar."""
+    global _MUNICIPIOS, _MUNICIPIOS_VERSAO, _MUNICIPIOS_GERACAO
+    try:
+        st = MUNICIPIOS_CSV.stat()
+        versao = (str(MUNICIPIOS_CSV), st.st_mtime_ns, st.st_size)
+    except OSError:
+        versao = None
+    with _MUNICIPIOS_LOCK:
+        _carregar_aprendidos()
+        if versao != _MUNICIPIOS_VERSAO:
+            cadastro = {ibge: tuple(v) for ibge, v in _MUNICIPIOS_APRENDIDOS.items()}
+            if versao is not None:
+                try:
+                    cadastro.update(_ler_cadastro_municipios(MUNICIPIOS_CSV))
+                except (OSError, ValueError, KeyError):
+                    pass
+            _MUNICIPIOS, _MUNICIPIOS_VERSAO = cadastro, versao
+            _MUNICIPIOS_GERACAO += 1
+        return _MUNICIPIOS
+
+
+def municipio_cadastrado(ibge) -> Optional[Tuple[str, str]]:
+    """(nome, UF) do cadastro local, ou None se o código não estiver lá."""
+    return _cadastro_municipios().get(str(ibge).strip())
+
+
+def _aprender_municipio(ibge: str, nome: str, uf: str):
+    """Guarda um nome descoberto via API/CSV — próximas consultas não saem do processo."""
+    global _MUNICIPIOS_GERACAO
+    if not nome or not uf or uf == "??":
+        return
+    cadastro = _cadastro_municipios()
+    with _MUNICIPIOS_LOCK:
+        cadastro[ibge] = (nome, uf)
+        _MUNICIPIOS_GERACAO += 1
+        _MUNICIPIOS_APRENDIDOS[ibge] = [nome, uf]
+        try:
+            MUNICIPIOS_APRENDIDOS_FILE.parent.mkdir(parents=True, exist_ok=True)
+            tmp = MUNICIPIOS_APRENDIDOS_FILE.with_suffix(".tmp")
+            tmp.write_text(json.dumps(_MUNICIPIOS_APRENDIDOS, ensure_ascii=False, indent=1,
+                                      sort_keys=True), encoding="utf-8")
+            tmp.replace(MUNICIPIOS_APRENDIDOS_FILE)
+        except OSError:
+            pass  # disco somente leitura — fica só em memória
+
+
+def atualizar_cadastro_municipios() -> int:
+    """Regrava dados/municipios_ibge.csv juntando o cadastro atual, os nomes
+    aprendidos e códigos que só existam no CSV do IDEB (os nomes do cadastro
+    prevalecem). Retorna o número de municípios gravados."""
+    cadastro = dict(_cadastro_municipios())
+    store = _ideb_store() if IDEB_MUN_CSV.exists() else None
+    if store is not None and {"codigo_ibge", "indicador_municipio", "indicador_uf"} \
+            <= set(store.mun.columns):
+        pares = (store.mun[["codigo_ibge", "indicador_municipio", "indicador_uf"]]
+                 .drop_duplicates("codigo_ibge").astype(object).dropna())
+        for ibge, nome, uf in pares.itertuples(index=False):
+            cadastro.setdefault(str(ibge), (nome, uf))
+    if not cadastro:
+        return 0
+    linhas = sorted((ibge, nome, uf, ibge[:2]) for ibge, (nome, uf) in cadastro.items())
+    df = pd.DataFrame(linhas, columns=["codigo_ibge", "nome", "uf", "codigo_uf"])
+    tmp = MUNICIPIOS_CSV.with_name(MUNICIPIOS_CSV.name + ".tmp")
+    df.to_csv(tmp, index=False, encoding="utf-8")
+    tmp.replace(MUNICIPIOS_CSV)
+    return len(df)
+
+
+# =============================================================================
+# BUSCA DE MUNICÍPIOS POR NOME
+# =============================================================================
+# Índice em memória sobre o cadastro (+ estados): nomes sem acento e em
+# minúsculas; prefixos de cada palavra → ids; trigramas → ids para tolerar
+# erros de digitação. Reconstruído só quando o cadastro muda.
+BUSCA_PREFIXO_MAX = 12   # prefixos indexados até este tamanho (além disso, confere startswith)
+BUSCA_SIMILARIDADE_MIN = 0.3
+BUSCA_LIMITE_MAX = 50
+
+
+def _chave_busca(texto: str) -> str:
+    """'São José dos Pinhais' → 'sao jose dos pinhais'."""
+    if unidecode is not None:
+        texto = unidecode(texto)
+    else:
+        texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", texto.lower()).split())
+
+
+def _trigramas(chave: str) -> set:
+    t = f"  {chave} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+class IndiceMunicipios:
+    """Índice de prefixo + trigramas para busca de municípios/estados por nome."""
+
+    def __init__(self, entradas: List[Tuple[str, str, str]]):
+        # ids em ordem de (tamanho do nome, nome): listas de ids já saem ordenadas
+        # por relevância dentro de cada faixa — a busca para no `limite`.
+        entradas = sorted(((_chave_busca(nome), ibge, nome, uf) for ibge, nome, uf in entradas),
+                          key=lambda e: (len(e[0]), e[0]))
+        self.chave = [e[0] for e in entradas]
+        self.ibge = [e[1] for e in entradas]
+        self.nome = [e[2] for e in entradas]
+        self.uf = [e[3] for e in entradas]
+        self._exato: Dict[str, List[int]] = {}
+        self._inicio: Dict[str, List[int]] = {}    # prefixos do nome inteiro
+        self._palavra: Dict[str, List[int]] = {}   # prefixos a partir das demais palavras
+        self._tri: Dict[str, List[int]] = {}
+        self._n_tri: List[int] = []
+        for i, chave in enumerate(self.chave):
+            self._exato.setdefault(chave, []).append(i)
+            for n in range(1, min(len(chave), BUSCA_PREFIXO_MAX) + 1):
+                self._inicio.setdefault(chave[:n], []).append(i)
+            vistos = set()
+            for m in re.finditer(r" (?=\S)", chave):
+                resto = chave[m.end():]
+                for n in range(1, min(len(resto), BUSCA_PREFIXO_MAX) + 1):
+                    if resto[:n] not in vistos:
+                        vistos.add(resto[:n])
+                        self._palavra.setdefault(resto[:n], []).append(i)
+            tri = _trigramas(chave)
+            self._n_tri.append(len(tri))
+            for t in tri:
+                self._tri.setdefault(t, []).append(i)
+
+    def __len__(self):
+        return len(self.chave)
+
+    def _resultado(self, i: int, score: float) -> dict:
+        return {"ibge": self.ibge[i], "municipio": self.nome[i], "uf": self.uf[i],
+                "tipo": "estado" if len(self.ibge[i]) == 2 else "municipio",
+                "score": round(score, 3)}
+
+    def buscar(self, q: str, limite: int = 10, uf: str = None) -> List[dict]:
+        """Melhores correspondências: nome exato > começo do nome > começo de
+        uma palavra > semelhança por trigramas (só quando nada casa por prefixo)."""
+        q = _chave_busca(q or "")
+        if not q:
+            return []
+        uf = uf.upper() if uf else None
+        chave_q = q[:BUSCA_PREFIXO_MAX]
+        longa = len(q) > BUSCA_PREFIXO_MAX  # prefixo indexado é só o começo — confere o resto
+
+        achados: Dict[int, float] = {}
+        faixas = [(1.0, self._exato.get(q, ()), None),
+                  (0.9, self._inicio.get(chave_q, ()), lambda c: c.startswith(q)),
+                  (0.8, self._palavra.get(chave_q, ()), lambda c: f" {q}" in c)]
+        for score, ids, confere in faixas:
+            for i in ids:
+                if len(achados) >= limite:
+                    break
+                if i in achados or (uf and self.uf[i] != uf):
+                    continue
+                if longa and confere is not None and not confere(self.chave[i]):
+                    continue
+                achados[i] = score
+
+        if not achados:  # nada por prefixo — tenta erros de digitação
+            q_tri = _trigramas(q)
+            comuns: Dict[int, int] = {}
+            for t in q_tri:
+                for i in self._tri.get(t, ()):
+                    comuns[i] = comuns.get(i, 0) + 1
+            for i, c in comuns.items():
+                if uf and self.uf[i] != uf:
+                    continue
+                sim = c / (len(q_tri) + self._n_tri[i] - c)
+                if sim >= BUSCA_SIMILARIDADE_MIN:
+                    achados[i] = 0.7 * sim
+
+        # empate no score: nome mais curto primeiro (ordem dos ids)
+        melhores = sorted(achados.items(), key=lambda kv: (-kv[1], kv[0]))[:limite]
+        return [self._resultado(i, sc) for i, sc in melhores]
+
+
+_INDICE_MUNICIPIOS: Optional[IndiceMunicipios] = None
+_INDICE_GERACAO = None
+_INDICE_LOCK = threading.Lock()
+
+
+def indice_municipios() -> IndiceMunicipios:
+    """Índice de busca do cadastro atual (reconstruído se o cadastro mudou)."""
+    global _INDICE_MUNICIPIOS, _INDICE_GERACAO
+    _cadastro_municipios()  # recarrega o CSV se mudou
+    with _INDICE_LOCK:
+        if _INDICE_MUNICIPIOS is None or _INDICE_GERACAO != _MUNICIPIOS_GERACAO:
+            with _MUNICIPIOS_LOCK:
+                geracao = _MUNICIPIOS_GERACAO
+                entradas = [(ibge, nome, uf) for ibge, (nome, uf) in _MUNICIPIOS.items()]
+            entradas += [(cod, nome, sigla) for cod, (nome, sigla) in UF_CODES.items()]
+            _INDICE_MUNICIPIOS, _INDICE_GERACAO = IndiceMunicipios(entradas), geracao
+        return _INDICE_MUNICIPIOS
+
+
+def buscar_municipios(q: str, limite: int = 10, uf: str = None) -> List[dict]:
+    """Municípios/estados cujo nome corresponde a `q` (sem acento, com prefixo)."""
+    limite = max(1, min(int(limite), BUSCA_LIMITE_MAX))
+    return indice_municipios().buscar(q, limite, uf)
 
 
 # =============================================================================
@@ -340,19 +1625,34 @@ def load_ideb(ibge):
 def descobrir_municipio(ibge):
     """Descobre nome do município/estado e UF via API ou CSV."""
     ibge = str(ibge).strip()
+    return _SINGLE_FLIGHT.do(("municipio", ibge), _descobrir_municipio, ibge)
+
 
+def _descobrir_municipio(ibge):
     # Estado (2 dígitos) — retorna direto do mapa
     if ibge in UF_CODES:
         nome, sigla = UF_CODES[ibge]
         return nome, sigla
 
+    # 0) Cadastro local — sem chamadas à API
+    cadastrado = municipio_cadastrado(ibge)
+    if cadastrado:
+        return cadastrado
+
+    nome, uf = _descobrir_municipio_remoto(ibge)
+    _aprender_municipio(ibge, nome, uf)
+    return nome, uf
+
+
+def _descobrir_municipio_remoto(ibge):
     # 1) Tentar via taxa rendimento — resposta contém territorio.nome
     for ciclo in ["AI", "AF"]:
-        for ano_t in _anos_candidatos():
+        for ano_t in _anos_candidatos(endpoint="taxa"):
             raw = fetch_json(
                 f"{BASE_URL}/taxa-rendimento/taxa-rendimento/{ibge}/comparacao",
                 {"dependencia_id": 0, "ano": ano_t, "ciclo_id": ciclo,
-                 "localizacao_id": 0})
+                 "localizacao_id": 0},
+                tem_dados=_taxa_tem_dados)
             if not raw:
                 continue
             ent = raw.get("entidade") or raw.get("municipio") or []
@@ -377,18 +1677,15 @@ def descobrir_municipio(ibge):
             p = t.get("parent", {})
             return t.get("nome", f"IBGE_{ibge}"), (p.get("sigla", "??") if p else "??")
 
-    # 3) Fallback CSV IDEB
-    if IDEB_MUN_CSV.exists():
-        try:
-            df = pd.read_csv(IDEB_MUN_CSV, sep=",",
-                             dtype={"codigo_ibge": str}, nrows=300000)
-            df.columns = [c.strip().lower() for c in df.columns]
-            r = df[df["codigo_ibge"] == str(ibge)]
-            if not r.empty:
-                return (r.iloc[0].get("indicador_municipio", f"IBGE_{ibge}"),
-                        r.iloc[0].get("indicador_uf", "??"))
-        except Exception:
-            pass
+    # 3) Fallback CSV IDEB (store já carregado/indexado)
+    try:
+        store = _ideb_store()
+        r = store.municipio(ibge) if store is not None else None
+        if r is not None and not r.empty:
+            return (r.iloc[0].get("indicador_municipio", f"IBGE_{ibge}"),
+                    r.iloc[0].get("indicador_uf", "??"))
+    except Exception:
+        pass
     return f"IBGE_{ibge}", "??"
 
 
@@ -433,14 +1730,45 @@ def _hdr(titulo, mun, **kw):
     if kw.get("ciclo"):   t += f"📚 Ciclo: {kw['ciclo']}\n"
     if kw.get("ano"):     t += f"📅 Ano de referência: {kw['ano']}\n"
     if kw.get("periodo"): t += f"📅 Período histórico: {kw['periodo']}\n"
-    t += f"📅 Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n"
-    return t
+    return t  # data de geração vai nos metadados (gerado_em), não no corpo
 
 
 def _footer(fonte="QEdu (qedu.org.br)"):
     return f"\n\n{LINE}\nFonte: {fonte}\n{LINE}\n"
 
 
+class RelatorioTXT:
+    """Buffer de um relatório TXT: as partes vão para uma lista e são unidas
+    uma única vez em `texto()` — `bloco += ...` sem recopiar a string inteira
+    a cada linha (custo linear no tamanho do relatório)."""
+
+    __slots__ = ("_partes",)
+
+    def __init__(self, *partes: str):
+        self._partes: List[str] = list(partes)
+
+    def __iadd__(self, parte):
+        if isinstance(parte, RelatorioTXT):
+            self._partes.extend(parte._partes)
+        else:
+            self._partes.append(parte)
+        return self
+
+    def __bool__(self):
+        return any(self._partes)
+
+    def linhas(self, linhas):
+        """Acrescenta cada item seguido de quebra de linha."""
+        self._partes.extend(f"{l}\n" for l in linhas)
+
+    def secao(self, titulo: str, regua: str = SUBLINE):
+        """Título entre duas réguas (SUBLINE por padrão, LINE nos blocos maiores)."""
+        self._partes.append(f"\n{regua}\n{titulo}\n{regua}\n")
+
+    def texto(self) -> str:
+        return "".join(self._partes)
+
+
 # #############################################################################
 #
 #  1. APRENDIZADO  (SAEB)
@@ -493,27 +1821,47 @@ def _extrair_territorios(dados, ibge):
     return mun, est, br
 
 
-def gerar_txt_aprendizado(ibge, mun, uf):
-    """Gera relatório de Aprendizado (SAEB) — idêntico ao original."""
+def modelo_aprendizado(ibge):
+    """Modelo do relatório de Aprendizado: um item por ciclo com dados do
+    território — registros ordenados por ano e os últimos de cada referência."""
     dep_id = 5  # Pública (todas)
-    txt_final = ""
-
+    ciclos = []
     for cid, cnome in CICLOS.items():
         dados = fetch_aprendizado(ibge, dep_id, cid)
         recs_mun, recs_est, recs_br = _extrair_territorios(dados, ibge)
-
         if not recs_mun:
             continue
+        recs_mun.sort(key=lambda x: x.get("ano", 0))
+        ciclos.append({
+            "cid": cid, "nome": cnome, "recs_mun": recs_mun,
+            "ultimo_mun": recs_mun[-1],
+            "ultimo_br": sorted(recs_br, key=lambda x: x.get("ano", 0))[-1] if recs_br else None,
+            # "Municípios semelhantes" = primeiro grupo que não é o município nem Brasil
+            "ultimo_sem": sorted(recs_est, key=lambda x: x.get("ano", 0))[-1] if recs_est else None,
+        })
+    return ciclos
+
+
+def gerar_txt_aprendizado(ibge, mun, uf):
+    """Gera relatório de Aprendizado (SAEB) — idêntico ao original."""
+    return renderizar_txt_aprendizado(modelo_aprendizado(ibge), mun, uf)
+
+
+def renderizar_txt_aprendizado(ciclos, mun, uf):
+    txt_final = RelatorioTXT()
+
+    for ciclo in ciclos:
+        cnome, recs_mun = ciclo["nome"], ciclo["recs_mun"]
+        ultimo_mun, ultimo_br, ultimo_sem = ciclo["ultimo_mun"], ciclo["ultimo_br"], ciclo["ultimo_sem"]
 
         ciclo_label = cnome
-        if cid in ("AI", "AF"):
+        if ciclo["cid"] in ("AI", "AF"):
             ciclo_label = f"{cnome.split('(')[0].strip()} do Ensino Fundamental ({cnome.split('(')[1]}" if "(" in cnome else cnome
 
-        bloco = _hdr("RELATÓRIO COMPLETO DE APRENDIZADO - DADOS QEDU",
-                      mun, rede="Pública (todas as redes)", ciclo=ciclo_label)
+        bloco = RelatorioTXT(_hdr("RELATÓRIO COMPLETO DE APRENDIZADO - DADOS QEDU",
+                                  mun, rede="Pública (todas as redes)", ciclo=ciclo_label))
         bloco += "\n"
 
-        recs_mun.sort(key=lambda x: x.get("ano", 0))
         anos_disp = [r.get("ano") for r in recs_mun]
 
         # =================================================================
@@ -546,11 +1894,6 @@ def gerar_txt_aprendizado(ibge, mun, uf):
         # =================================================================
         bloco += f"\n\n{'*'*80}\nPARTE 2: COMPARATIVO COM MUNICÍPIOS SEMELHANTES E BRASIL\n{'*'*80}\n"
 
-        ultimo_mun = recs_mun[-1]
-        ultimo_br  = sorted(recs_br, key=lambda x: x.get("ano", 0))[-1] if recs_br else None
-        # "Municípios semelhantes" = primeiro grupo que não é o município nem Brasil
-        ultimo_sem = sorted(recs_est, key=lambda x: x.get("ano", 0))[-1] if recs_est else None
-
         # Resumo adequado
         bloco += f"\nRESUMO - % de Alunos com Aprendizado Adequado:\n\n"
         h_sem = "Municípios semelhantes" if ultimo_sem else "Estado"
@@ -592,12 +1935,12 @@ def gerar_txt_aprendizado(ibge, mun, uf):
         # PARTE 3: ANÁLISE QUALITATIVA
         # =================================================================
         bloco += f"\n\n{'*'*80}\nPARTE 3: ANÁLISE QUALITATIVA\n{'*'*80}\n"
-        bloco += f"\n{LINE}\nANÁLISE QUALITATIVA - EVOLUÇÃO DO APRENDIZADO\n{LINE}\n"
+        bloco.secao("ANÁLISE QUALITATIVA - EVOLUÇÃO DO APRENDIZADO", LINE)
         bloco += f"\n📍 Território: {mun}\n🏫 Rede: Pública (todas as redes)\n"
         bloco += f"📚 Ciclo: {ciclo_label}\n"
         bloco += f"📅 Período analisado: {anos_disp[0]} a {anos_disp[-1]}\n"
 
-        bloco += f"\n{SUBLINE}\nDIAGNÓSTICO ATUAL POR DISCIPLINA\n{SUBLINE}\n"
+        bloco.secao("DIAGNÓSTICO ATUAL POR DISCIPLINA")
 
         alertas_criticos = 0
         abaixo_brasil = 0
@@ -638,7 +1981,7 @@ def gerar_txt_aprendizado(ibge, mun, uf):
                 abaixo_brasil += 1
 
         # Oportunidades
-        bloco += f"\n{SUBLINE}\n🎯 OPORTUNIDADES IDENTIFICADAS\n{SUBLINE}\n"
+        bloco.secao("🎯 OPORTUNIDADES IDENTIFICADAS")
         if not oportunidades:
             bloco += "\n   ✅ Sem oportunidades críticas identificadas.\n"
         for disc_nome, adeq, insuf in oportunidades:
@@ -649,7 +1992,7 @@ def gerar_txt_aprendizado(ibge, mun, uf):
         # Pandemia
         anos_pan = {r.get("ano"): r for r in recs_mun}
         if 2019 in anos_pan and 2021 in anos_pan and 2023 in anos_pan:
-            bloco += f"\n{SUBLINE}\n📉 IMPACTO DA PANDEMIA E RECUPERAÇÃO\n{SUBLINE}\n"
+            bloco.secao("📉 IMPACTO DA PANDEMIA E RECUPERAÇÃO")
             for disc, disc_nome in DISCIPLINAS.items():
                 a19 = _adeq(anos_pan[2019], disc)
                 a21 = _adeq(anos_pan[2021], disc)
@@ -668,7 +2011,7 @@ def gerar_txt_aprendizado(ibge, mun, uf):
                         bloco += f"      ⚠️ Ainda {abs(saldo):.1f}pp ABAIXO do nível pré-pandemia\n"
 
         # Comparativo qualitativo
-        bloco += f"\n{LINE}\nANÁLISE QUALITATIVA - COMPARATIVO COM SEMELHANTES E BRASIL\n{LINE}\n"
+        bloco.secao("ANÁLISE QUALITATIVA - COMPARATIVO COM SEMELHANTES E BRASIL", LINE)
         bloco += f"\n📊 Comparação de {mun} com municípios semelhantes e média nacional\n"
 
         cats = {"abaixo_br": [], "abaixo_sem": [], "acima": []}
@@ -686,7 +2029,7 @@ def gerar_txt_aprendizado(ibge, mun, uf):
             else:
                 cats["acima"].append(item)
 
-        bloco += f"\n{SUBLINE}\n🔴 ABAIXO DA MÉDIA NACIONAL (BRASIL)\n{SUBLINE}\n"
+        bloco.secao("🔴 ABAIXO DA MÉDIA NACIONAL (BRASIL)")
         if not cats["abaixo_br"]:
             bloco += "   ✅ Nenhum indicador abaixo da média nacional.\n"
         for it in cats["abaixo_br"]:
@@ -694,7 +2037,7 @@ def gerar_txt_aprendizado(ibge, mun, uf):
             bloco += f"\n   ❌ {it['disc']} - Adequado\n"
             bloco += f"      Município: {_pct(it['mun'])} | Brasil: {_pct(it['br'])} → {d:+.1f}pp\n"
 
-        bloco += f"\n{SUBLINE}\n🟡 ABAIXO DE MUNICÍPIOS SEMELHANTES (mas acima do Brasil)\n{SUBLINE}\n"
+        bloco.secao("🟡 ABAIXO DE MUNICÍPIOS SEMELHANTES (mas acima do Brasil)")
         if not cats["abaixo_sem"]:
             pass  # vazio igual ao original
         for it in cats["abaixo_sem"]:
@@ -702,7 +2045,7 @@ def gerar_txt_aprendizado(ibge, mun, uf):
             bloco += f"\n   ⚠️ {it['disc']} - Adequado\n"
             bloco += f"      Município: {_pct(it['mun'])} | Semelhantes: {_pct(it['sem'])} → {d:+.1f}pp\n"
 
-        bloco += f"\n{SUBLINE}\n🟢 ACIMA DAS MÉDIAS (Semelhantes e Brasil)\n{SUBLINE}\n"
+        bloco.secao("🟢 ACIMA DAS MÉDIAS (Semelhantes e Brasil)")
         for it in cats["acima"]:
             d_br = (it["mun"] - (it["br"] or 0)) * 100
             d_sem = (it["mun"] - (it["sem"] or 0)) * 100
@@ -717,7 +2060,7 @@ def gerar_txt_aprendizado(ibge, mun, uf):
         bloco += f"   🟢 Acima de ambos:            {len(cats['acima'])} disciplina(s)\n"
 
         # Conclusão
-        bloco += f"\n{LINE}\n💡 CONCLUSÃO E RECOMENDAÇÕES PARA ABORDAGEM COMERCIAL\n{LINE}\n"
+        bloco.secao("💡 CONCLUSÃO E RECOMENDAÇÕES PARA ABORDAGEM COMERCIAL", LINE)
         bloco += f"\n📍 {mun.upper()}\n"
 
         if alertas_criticos > 0 or abaixo_brasil > 0:
@@ -737,10 +2080,10 @@ def gerar_txt_aprendizado(ibge, mun, uf):
         txt_final += bloco
 
     if not txt_final:
-        txt_final = _hdr("RELATÓRIO COMPLETO DE APRENDIZADO - DADOS QEDU", mun)
+        txt_final += _hdr("RELATÓRIO COMPLETO DE APRENDIZADO - DADOS QEDU", mun)
         txt_final += "\n  ⚠️ Sem dados de aprendizado disponíveis.\n"
         txt_final += _footer()
-    return txt_final
+    return txt_final.texto()
 
 
 # #############################################################################
@@ -749,17 +2092,13 @@ def gerar_txt_aprendizado(ibge, mun, uf):
 #
 # #############################################################################
 
-def gerar_txt_infra(ibge, mun, uf):
-    """Gera relatório de infraestrutura — idêntico ao original."""
+def modelo_infra(ibge):
+    """Modelo do relatório de Infraestrutura, ou None sem dados: itens
+    (território × Estado × Brasil), os relevantes e todos os valores por entidade."""
     dep_id = 3  # Municipal
     dados, ano = fetch_infra(ibge, dep_id)
-
     if not dados:
-        return (_hdr("RELATÓRIO DE INFRAESTRUTURA ESCOLAR - DADOS QEDU", mun, ano="N/D")
-                + "\n  ⚠️ Sem dados.\n" + _footer())
-
-    bloco = _hdr("RELATÓRIO DE INFRAESTRUTURA ESCOLAR - DADOS QEDU",
-                  mun, rede="Municipal", ano=ano)
+        return None
 
     # Extrair itens
     items_data = []
@@ -804,6 +2143,33 @@ def gerar_txt_infra(ibge, mun, uf):
     if not items_rel:
         items_rel = items_data[:10]
 
+    # Todos os valores por indicador × entidade (dados estruturados)
+    indicadores = {}
+    for sec in dados:
+        for item in sec.get("items", []):
+            label = item.get("label", "")
+            for v in item.get("values", []):
+                val = v.get("value")
+                if val is not None:
+                    indicadores.setdefault(label, {})[v.get("entidade", "").lower()] = val
+
+    return {"ano": ano, "items_rel": items_rel, "indicadores": indicadores}
+
+
+def gerar_txt_infra(ibge, mun, uf):
+    """Gera relatório de infraestrutura — idêntico ao original."""
+    return renderizar_txt_infra(modelo_infra(ibge), mun, uf)
+
+
+def renderizar_txt_infra(modelo, mun, uf):
+    if not modelo:
+        return (_hdr("RELATÓRIO DE INFRAESTRUTURA ESCOLAR - DADOS QEDU", mun, ano="N/D")
+                + "\n  ⚠️ Sem dados.\n" + _footer())
+
+    items_rel = modelo["items_rel"]
+    bloco = RelatorioTXT(_hdr("RELATÓRIO DE INFRAESTRUTURA ESCOLAR - DADOS QEDU",
+                              mun, rede="Municipal", ano=modelo["ano"]))
+
     # PARTE 1: Tabela
     bloco += f"\n\nPARTE 1: TABELA COMPARATIVA\n{SUBLINE}\n\n"
     bloco += f"{'Indicador':>20} {'Município':>10} {'Estado':>7} {'Brasil':>7} {'vs Brasil':>10} {'vs Estado':>10}\n"
@@ -878,7 +2244,7 @@ def gerar_txt_infra(ibge, mun, uf):
         bloco += f"   💡 Recomendação: Priorizar INFRAESTRUTURA BÁSICA — grande potencial de mercado.\n"
 
     bloco += _footer("QEdu (qedu.org.br)")
-    return bloco
+    return bloco.texto()
 
 
 # #############################################################################
@@ -887,14 +2253,13 @@ def gerar_txt_infra(ibge, mun, uf):
 #
 # #############################################################################
 
-def gerar_txt_censo(ibge, mun, uf):
-    """Gera relatório de Censo Escolar — idêntico ao original."""
+def modelo_censo(ibge):
+    """Modelo do relatório do Censo, ou None sem dados: registro bruto,
+    matrículas por etapa e totais."""
     dep_id = 3  # Municipal
     dados, ano = fetch_censo(ibge, dep_id)
-
     if not dados or "censo" not in dados:
-        return (_hdr("RELATÓRIO DO CENSO ESCOLAR - DADOS QEDU", mun)
-                + "\n  ⚠️ Sem dados.\n" + _footer())
+        return None
 
     c = dados["censo"]
     qtd_escolas = c.get("qtd_escolas", 0)
@@ -910,7 +2275,25 @@ def gerar_txt_censo(ibge, mun, uf):
 
     media_alunos = total_mat / qtd_escolas if qtd_escolas else 0
 
-    bloco = _hdr("RELATÓRIO DO CENSO ESCOLAR - DADOS QEDU", mun)
+    return {"ano": ano, "censo": c, "qtd_escolas": qtd_escolas, "mat_etapas": mat_etapas,
+            "total_mat": total_mat, "media_alunos": media_alunos}
+
+
+def gerar_txt_censo(ibge, mun, uf):
+    """Gera relatório de Censo Escolar — idêntico ao original."""
+    return renderizar_txt_censo(modelo_censo(ibge), mun, uf)
+
+
+def renderizar_txt_censo(modelo, mun, uf):
+    if not modelo:
+        return (_hdr("RELATÓRIO DO CENSO ESCOLAR - DADOS QEDU", mun)
+                + "\n  ⚠️ Sem dados.\n" + _footer())
+
+    c, ano = modelo["censo"], modelo["ano"]
+    qtd_escolas, total_mat = modelo["qtd_escolas"], modelo["total_mat"]
+    mat_etapas, media_alunos = modelo["mat_etapas"], modelo["media_alunos"]
+
+    bloco = RelatorioTXT(_hdr("RELATÓRIO DO CENSO ESCOLAR - DADOS QEDU", mun))
     bloco += "\n"
 
     # PARTE 1: Resumo geral
@@ -991,7 +2374,7 @@ def gerar_txt_censo(ibge, mun, uf):
         bloco += f"      → Potencial para: materiais adaptados, recursos de acessibilidade\n\n"
 
     bloco += _footer("QEdu - Censo Escolar (qedu.org.br)")
-    return bloco
+    return bloco.texto()
 
 
 # #############################################################################
@@ -1012,16 +2395,146 @@ def _trend_slope(anos, valores):
     return 0.0
 
 
+def _ideb_tabela(df_ideb, df_uf_seg, df_br_seg):
+    """Alinha município × estado × Brasil por ano num único frame.
+
+    Uma linha por registro de `df_ideb` (ordem preservada), com o valor do
+    estado (`ve`) e da média/mediana Brasil (`vb_mean`/`vb_med`) do mesmo ano,
+    flags de presença (`tem_est`/`tem_br`) e as diferenças já calculadas.
+    """
+    tab = (df_ideb[["ano", "valor_numerico"]]
+           .rename(columns={"valor_numerico": "vm"})
+           .reset_index(drop=True))
+
+    if not df_uf_seg.empty:
+        est = (df_uf_seg[["ano", "valor_numerico"]].drop_duplicates("ano")
+               .rename(columns={"valor_numerico": "ve"}).assign(tem_est=True))
+        tab = tab.merge(est, on="ano", how="left")
+    else:
+        tab = tab.assign(ve=float("nan"), tem_est=False)
+
+    if not df_br_seg.empty:
+        br = (df_br_seg[["ano", "mean", "median"]].drop_duplicates("ano")
+              .rename(columns={"mean": "vb_mean", "median": "vb_med"}).assign(tem_br=True))
+        tab = tab.merge(br, on="ano", how="left")
+    else:
+        tab = tab.assign(vb_mean=float("nan"), vb_med=float("nan"), tem_br=False)
+
+    tab["tem_est"] = tab["tem_est"].fillna(False).astype(bool)
+    tab["tem_br"] = tab["tem_br"].fillna(False).astype(bool)
+    tab["d_est"] = tab["vm"] - tab["ve"]
+    tab["d_br"] = tab["vm"] - tab["vb_mean"]
+    tab["d_med"] = tab["vm"] - tab["vb_med"]
+    return tab
+
+
+def _ideb_insights(tab, esfera, seg_display):
+    """Insights e estatísticas de um esfera × segmento a partir da tabela alinhada.
+
+    Retorna (insight_lines, stats_dict) ou None se há menos de 2 anos válidos.
+    """
+    validos = tab[tab["vm"].notna() & (tab["vm"] > 0)]
+    if len(validos) < 2:
+        return None
+    vals_clean = validos["vm"].astype(float).tolist()
+    anos_clean = validos["ano"].astype(int).tolist()
+
+    variacao = ((vals_clean[-1] - vals_clean[0]) / vals_clean[0]) * 100 if vals_clean[0] != 0 else 0
+    trend = _trend_slope(anos_clean, vals_clean)
+
+    # médias das diferenças nos anos presentes nas duas séries
+    diff_est = tab.loc[tab["tem_est"], "d_est"].mean() if tab["tem_est"].any() else None
+    diff_br = tab.loc[tab["tem_br"], "d_br"].mean() if tab["tem_br"].any() else None
+    diff_med = tab.loc[tab["tem_br"], "d_med"].mean() if tab["tem_br"].any() else None
+
+    insight_lines = []
+
+    # vs Estado (municipal only)
+    if esfera == "municipal" and diff_est is not None:
+        if diff_est > 0.3:
+            insight_lines.append(f"  ✅ Município supera média estadual em {diff_est:.2f} pontos")
+        elif diff_est < -0.3:
+            insight_lines.append(f"  ⚠️ Município está {abs(diff_est):.2f} pontos abaixo do estado")
+        else:
+            insight_lines.append(f"  ➡️ Município próximo do estado ({diff_est:+.2f} pontos)")
+
+    # vs Brasil
+    if diff_br is not None:
+        if esfera == "municipal":
+            if diff_br > 0.3:
+                insight_lines.append(f"  ✅ Município supera média nacional em {diff_br:.2f} pontos")
+            elif diff_br < -0.3:
+                insight_lines.append(f"  ⚠️ Município está {abs(diff_br):.2f} pontos abaixo da média nacional")
+        else:
+            if diff_br > 0.3:
+                insight_lines.append(f"  ✅ Supera média nacional em {diff_br:.2f} pontos")
+            if diff_med > 0.3:
+                insight_lines.append(f"  ✅ Supera mediana nacional em {diff_med:.2f} pontos")
+
+    # Tendência
+    if trend > 0.05:
+        insight_lines.append(f"  📈 Tendência de crescimento (+{trend:.3f}/ano)")
+    elif trend < -0.05:
+        insight_lines.append(f"  📉 Tendência de queda ({trend:.3f}/ano)")
+    else:
+        insight_lines.append(f"  ➡️ Tendência estável ({trend:+.3f}/ano)")
+
+    # Crescimento expressivo
+    if variacao > 20:
+        insight_lines.append(f"  🚀 Crescimento expressivo de {variacao:.1f}% no período")
+    elif variacao < -10:
+        insight_lines.append(f"  🔻 Queda de {abs(variacao):.1f}% no período")
+
+    # Pandemia
+    anos_dict = dict(zip(anos_clean, vals_clean))
+    if 2019 in anos_dict and 2021 in anos_dict:
+        d_pan = anos_dict[2021] - anos_dict[2019]
+        if d_pan < -0.3:
+            insight_lines.append(f"  🦠 Impacto da pandemia detectado ({d_pan:+.1f} pontos 2019→2021)")
+        elif d_pan > 0.3:
+            insight_lines.append(f"  💪 Resiliência na pandemia (crescimento de {d_pan:.1f} pontos 2019→2021)")
+
+    # Recuperação
+    if 2021 in anos_dict and 2023 in anos_dict:
+        d_rec = anos_dict[2023] - anos_dict[2021]
+        if d_rec > 0.2:
+            insight_lines.append(f"  🔄 {seg_display} : Recuperação pós-pandemia (+{d_rec:.1f} pontos 2021→2023)")
+        elif d_rec < -0.2:
+            insight_lines.append(f"  ⚠️ {seg_display} : Continuidade de queda pós-pandemia ({d_rec:+.1f} pontos 2021→2023)")
+
+    stats_dict = {
+        "variacao": variacao,
+        "trend": trend,
+        "max": max(vals_clean),
+        "min": min(vals_clean),
+    }
+    # Adicionar médias vs referência
+    if esfera == "municipal" and diff_est is not None:
+        stats_dict["mun_vs_estado"] = diff_est
+    if diff_br is not None:
+        stats_dict["mun_vs_brasil"] = diff_br
+
+    return insight_lines, stats_dict
+
+
+def modelo_ideb(ibge):
+    """Modelo do relatório IDEB: (df_mun, df_uf, brasil_stats) de `load_ideb`."""
+    return load_ideb(ibge)
+
+
 def gerar_txt_ideb(ibge, mun, uf):
     """Gera relatório IDEB — idêntico ao original (CSV-based)."""
-    df_mun, df_uf, brasil_stats = load_ideb(ibge)
+    return renderizar_txt_ideb(modelo_ideb(ibge), mun, uf)
+
+
+def renderizar_txt_ideb(modelo, mun, uf):
+    df_mun, df_uf, brasil_stats = modelo
 
     if df_mun is None or df_mun.empty:
         return (_hdr("RELATÓRIO DE ANÁLISE IDEB", mun)
                 + "\n  ⚠️ Sem dados IDEB disponíveis.\n" + _footer("IDEB/SAEB - INEP/MEC"))
 
-    txt = f"{LINE}\nRELATÓRIO DE ANÁLISE IDEB\n"
-    txt += f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n{LINE}\n"
+    txt = RelatorioTXT(f"{LINE}\nRELATÓRIO DE ANÁLISE IDEB\n{LINE}\n")
     txt += f"\n📍 ESCOPO DA ANÁLISE\n{'-'*40}\n"
     txt += f"Município: {mun}\nEstado: {uf}\n"
     txt += f"Comparativo: Município vs Estado vs Brasil\n"
@@ -1030,56 +2543,50 @@ def gerar_txt_ideb(ibge, mun, uf):
     segmentos = ["anos iniciais", "anos finais", "ensino medio"]
     esferas   = ["municipal", "estadual"]
 
+    # Referências IDEB (estado e Brasil) — filtradas uma vez, fatiadas por segmento
+    uf_ideb = pd.DataFrame()
+    if df_uf is not None and not df_uf.empty:
+        uf_ideb = df_uf[df_uf["indicador_tipo_nome"] == "IDEB"]
+    br_ideb = pd.DataFrame()
+    if brasil_stats is not None and not brasil_stats.empty:
+        br_ideb = brasil_stats[brasil_stats["indicador_tipo_nome"] == "IDEB"]
+
+    def _ref_seg(ref, seg):
+        if ref.empty:
+            return ref
+        if "segmento" in ref.columns:
+            ref = ref[ref["segmento"] == seg]
+        return ref.sort_values("ano")
+
     for esfera in esferas:
         df_esf = df_mun[df_mun["esfera"] == esfera] if "esfera" in df_mun.columns else pd.DataFrame()
-        if df_esf.empty:
+        if df_esf.empty or "segmento" not in df_esf.columns:
             continue
 
         # Para estadual, só EM
         segs_usar = segmentos if esfera == "municipal" else ["ensino medio"]
 
-        has_data = False
+        esf_ideb = df_esf[df_esf["indicador_tipo_nome"] == "IDEB"]
+        series = {}
         for seg in segs_usar:
-            df_seg = df_esf[df_esf["segmento"] == seg] if "segmento" in df_esf.columns else pd.DataFrame()
-            df_ideb = df_seg[df_seg["indicador_tipo_nome"] == "IDEB"].sort_values("ano") if not df_seg.empty else pd.DataFrame()
+            df_ideb = esf_ideb[esf_ideb["segmento"] == seg].sort_values("ano")
             if not df_ideb.empty:
-                has_data = True
-                break
-        if not has_data:
+                series[seg] = df_ideb
+        if not series:
             continue
 
         insights_esfera = []
 
         txt += f"\n📊 HISTÓRICO IDEB POR SEGMENTO\n{'-'*40}\n"
 
-        for seg in segs_usar:
-            df_seg = df_esf[df_esf["segmento"] == seg] if "segmento" in df_esf.columns else pd.DataFrame()
-            df_ideb = df_seg[df_seg["indicador_tipo_nome"] == "IDEB"].sort_values("ano") if not df_seg.empty else pd.DataFrame()
-
-            if df_ideb.empty:
-                continue
-
+        for seg, df_ideb in series.items():
             seg_display = SEGMENTOS_DISPLAY.get(seg, seg.upper())
             if esfera == "estadual" and seg == "ensino medio":
                 seg_display = "ENSINO MEDIO (REDE ESTADUAL)"
 
             txt += f"\n▶ {seg_display}\n{SUBLINE}\n"
 
-            # Dados do estado
-            df_uf_seg = pd.DataFrame()
-            if df_uf is not None and not df_uf.empty:
-                mask_uf = (df_uf["indicador_tipo_nome"] == "IDEB")
-                if "segmento" in df_uf.columns:
-                    mask_uf = mask_uf & (df_uf["segmento"] == seg)
-                df_uf_seg = df_uf[mask_uf].sort_values("ano")
-
-            # Dados do Brasil
-            df_br_seg = pd.DataFrame()
-            if brasil_stats is not None and not brasil_stats.empty:
-                mask_br = (brasil_stats["indicador_tipo_nome"] == "IDEB")
-                if "segmento" in brasil_stats.columns:
-                    mask_br = mask_br & (brasil_stats["segmento"] == seg)
-                df_br_seg = brasil_stats[mask_br].sort_values("ano")
+            tab = _ideb_tabela(df_ideb, _ref_seg(uf_ideb, seg), _ref_seg(br_ideb, seg))
 
             # Cabeçalho da tabela depende se é municipal (Município col) ou estadual (Estado col)
             if esfera == "municipal":
@@ -1088,142 +2595,32 @@ def gerar_txt_ideb(ibge, mun, uf):
                 txt += f"{'Ano':<8} {'Estado':<12} {'Brasil(M)':<12} {'Brasil(Md)':<12} {'vs Média':<12} {'vs Mediana':<12}\n"
             txt += f"{SUBLINE}\n"
 
-            anos_list = []
-            vals_list = []
-
-            for _, row in df_ideb.iterrows():
-                a = int(row["ano"])
-                vm = row["valor_numerico"]
-                anos_list.append(a)
-                vals_list.append(float(vm) if pd.notna(vm) else 0)
-
-                ve = None
-                if not df_uf_seg.empty:
-                    uf_row = df_uf_seg[df_uf_seg["ano"] == a]
-                    if not uf_row.empty:
-                        ve = uf_row.iloc[0]["valor_numerico"]
-
-                vb_mean = vb_med = None
-                if not df_br_seg.empty:
-                    br_row = df_br_seg[df_br_seg["ano"] == a]
-                    if not br_row.empty:
-                        vb_mean = br_row.iloc[0]["mean"]
-                        vb_med = br_row.iloc[0]["median"] if "median" in br_row.columns else None
-
+            for a, vm, ve, vb_mean, vb_med, tem_est, tem_br, d_est, d_br, d_med in tab[
+                    ["ano", "vm", "ve", "vb_mean", "vb_med", "tem_est", "tem_br",
+                     "d_est", "d_br", "d_med"]].itertuples(index=False):
+                a = int(a)
+                tem_vm = pd.notna(vm)
+                ve = ve if tem_est else None
+                vb_mean, vb_med = (vb_mean, vb_med) if tem_br else (None, None)
                 if esfera == "municipal":
-                    d_est = f"{vm-ve:+.2f}" if ve is not None and pd.notna(vm) else ""
-                    d_br  = f"{vm-vb_mean:+.2f}" if vb_mean is not None and pd.notna(vm) else ""
-                    txt += f"{a:<8} {_val(vm):<12} {_val(ve):<12} {_val(vb_mean):<12} {d_est:<12} {d_br:<12}\n"
-                else:
-                    d_mean = f"{vm-vb_mean:+.2f}" if vb_mean is not None and pd.notna(vm) else ""
-                    d_med  = f"{vm-vb_med:+.2f}" if vb_med is not None and pd.notna(vm) else ""
-                    txt += f"{a:<8} {_val(vm):<12} {_val(vb_mean):<12} {_val(vb_med):<12} {d_mean:<12} {d_med:<12}\n"
-
-            # Calcular insights
-            vals_clean = [v for v in vals_list if v > 0]
-            anos_clean = [anos_list[i] for i, v in enumerate(vals_list) if v > 0]
-
-            if len(vals_clean) >= 2:
-                variacao = ((vals_clean[-1] - vals_clean[0]) / vals_clean[0]) * 100 if vals_clean[0] != 0 else 0
-                trend = _trend_slope(anos_clean, vals_clean)
-
-                insight_lines = []
-
-                # vs Estado (municipal only)
-                if esfera == "municipal" and not df_uf_seg.empty:
-                    merged = pd.merge(df_ideb[["ano", "valor_numerico"]],
-                                      df_uf_seg[["ano", "valor_numerico"]],
-                                      on="ano", suffixes=("_mun", "_est"))
-                    if not merged.empty:
-                        diff_est = (merged["valor_numerico_mun"] - merged["valor_numerico_est"]).mean()
-                        if diff_est > 0.3:
-                            insight_lines.append(f"  ✅ Município supera média estadual em {diff_est:.2f} pontos")
-                        elif diff_est < -0.3:
-                            insight_lines.append(f"  ⚠️ Município está {abs(diff_est):.2f} pontos abaixo do estado")
-                        else:
-                            insight_lines.append(f"  ➡️ Município próximo do estado ({diff_est:+.2f} pontos)")
-
-                # vs Brasil
-                if not df_br_seg.empty:
-                    if esfera == "municipal":
-                        merged_br = pd.merge(df_ideb[["ano", "valor_numerico"]],
-                                             df_br_seg[["ano", "mean"]], on="ano")
-                        if not merged_br.empty:
-                            diff_br = (merged_br["valor_numerico"] - merged_br["mean"]).mean()
-                            if diff_br > 0.3:
-                                insight_lines.append(f"  ✅ Município supera média nacional em {diff_br:.2f} pontos")
-                            elif diff_br < -0.3:
-                                insight_lines.append(f"  ⚠️ Município está {abs(diff_br):.2f} pontos abaixo da média nacional")
-                    else:
-                        merged_br = pd.merge(df_ideb[["ano", "valor_numerico"]],
-                                             df_br_seg[["ano", "mean", "median"]], on="ano")
-                        if not merged_br.empty:
-                            diff_mean = (merged_br["valor_numerico"] - merged_br["mean"]).mean()
-                            diff_med = (merged_br["valor_numerico"] - merged_br["median"]).mean()
-                            if diff_mean > 0.3:
-                                insight_lines.append(f"  ✅ Supera média nacional em {diff_mean:.2f} pontos")
-                            if diff_med > 0.3:
-                                insight_lines.append(f"  ✅ Supera mediana nacional em {diff_med:.2f} pontos")
-
-                # Tendência
-                if trend > 0.05:
-                    insight_lines.append(f"  📈 Tendência de crescimento (+{trend:.3f}/ano)")
-                elif trend < -0.05:
-                    insight_lines.append(f"  📉 Tendência de queda ({trend:.3f}/ano)")
+                    s_est = f"{d_est:+.2f}" if tem_est and tem_vm else ""
+                    s_br  = f"{d_br:+.2f}" if tem_br and tem_vm else ""
+                    txt += f"{a:<8} {_val(vm):<12} {_val(ve):<12} {_val(vb_mean):<12} {s_est:<12} {s_br:<12}\n"
                 else:
-                    insight_lines.append(f"  ➡️ Tendência estável ({trend:+.3f}/ano)")
-
-                # Crescimento expressivo
-                if variacao > 20:
-                    insight_lines.append(f"  🚀 Crescimento expressivo de {variacao:.1f}% no período")
-                elif variacao < -10:
-                    insight_lines.append(f"  🔻 Queda de {abs(variacao):.1f}% no período")
-
-                # Pandemia
-                anos_dict = dict(zip(anos_clean, vals_clean))
-                if 2019 in anos_dict and 2021 in anos_dict:
-                    d_pan = anos_dict[2021] - anos_dict[2019]
-                    if d_pan < -0.3:
-                        insight_lines.append(f"  🦠 Impacto da pandemia detectado ({d_pan:+.1f} pontos 2019→2021)")
-                    elif d_pan > 0.3:
-                        insight_lines.append(f"  💪 Resiliência na pandemia (crescimento de {d_pan:.1f} pontos 2019→2021)")
-
-                # Recuperação
-                if 2021 in anos_dict and 2023 in anos_dict:
-                    d_rec = anos_dict[2023] - anos_dict[2021]
-                    if d_rec > 0.2:
-                        insight_lines.append(f"  🔄 {seg_display} : Recuperação pós-pandemia (+{d_rec:.1f} pontos 2021→2023)")
-                    elif d_rec < -0.2:
-                        insight_lines.append(f"  ⚠️ {seg_display} : Continuidade de queda pós-pandemia ({d_rec:+.1f} pontos 2021→2023)")
-
-                stats_dict = {
-                    "variacao": variacao,
-                    "trend": trend,
-                    "max": max(vals_clean),
-                    "min": min(vals_clean),
-                }
-                # Adicionar médias vs referência
-                if esfera == "municipal" and not df_uf_seg.empty:
-                    merged_tmp = pd.merge(df_ideb[["ano", "valor_numerico"]],
-                                          df_uf_seg[["ano", "valor_numerico"]],
-                                          on="ano", suffixes=("_mun", "_est"))
-                    if not merged_tmp.empty:
-                        stats_dict["mun_vs_estado"] = (merged_tmp["valor_numerico_mun"] - merged_tmp["valor_numerico_est"]).mean()
-                if not df_br_seg.empty:
-                    merged_tmp2 = pd.merge(df_ideb[["ano", "valor_numerico"]],
-                                           df_br_seg[["ano", "mean"]], on="ano")
-                    if not merged_tmp2.empty:
-                        stats_dict["mun_vs_brasil"] = (merged_tmp2["valor_numerico"] - merged_tmp2["mean"]).mean()
-
-                insights_esfera.append((seg_display, insight_lines, stats_dict))
+                    s_mean = f"{d_br:+.2f}" if tem_br and tem_vm else ""
+                    s_med  = f"{d_med:+.2f}" if tem_br and tem_vm else ""
+                    txt += f"{a:<8} {_val(vm):<12} {_val(vb_mean):<12} {_val(vb_med):<12} {s_mean:<12} {s_med:<12}\n"
+
+            res = _ideb_insights(tab, esfera, seg_display)
+            if res is not None:
+                insights_esfera.append((seg_display, *res))
 
         # Bloco de insights
         if insights_esfera:
             txt += f"\n\n💡 INSIGHTS E OBSERVAÇÕES\n{LINE}\n"
             for seg_label, lines, _ in insights_esfera:
                 txt += f"\n▶ {seg_label}\n{'-'*40}\n"
-                for l in lines:
-                    txt += l + "\n"
+                txt.linhas(lines)
 
             txt += f"\n\n📈 ESTATÍSTICAS ADICIONAIS\n{LINE}\n"
             for seg_label, _, stats in insights_esfera:
@@ -1238,7 +2635,7 @@ def gerar_txt_ideb(ibge, mun, uf):
                 txt += f"  • Menor valor: {stats['min']:.2f}\n"
 
     txt += f"\n{LINE}\nFim do Relatório\n"
-    return txt
+    return txt.texto()
 
 
 # #############################################################################
@@ -1304,8 +2701,9 @@ def _get_nome_estado(dados):
     return "Estado"
 
 
-def gerar_txt_taxa(ibge, mun, uf):
-    """Gera relatório de Taxa de Rendimento — idêntico ao original."""
+def modelo_taxa(ibge):
+    """Modelo do relatório de Taxa de Rendimento: por ciclo, o último registro
+    do território (aprovados/reprovados/abandonos) e a resposta completa."""
 
     # Coletar dados para todos os ciclos
     etapas_dados = {}
@@ -1324,9 +2722,20 @@ def gerar_txt_taxa(ibge, mun, uf):
 
         etapas_dados[cid] = {
             "aprovados": aprov, "reprovados": reprov, "abandonos": aband,
-            "nome": cnome, "dados_full": dados, "ano": a,
+            "nome": cnome, "dados_full": dados, "ano": a, "tem_registro": reg_mun is not None,
         }
 
+    return {"ano_ref": ano_ref, "etapas": etapas_dados}
+
+
+def gerar_txt_taxa(ibge, mun, uf):
+    """Gera relatório de Taxa de Rendimento — idêntico ao original."""
+    return renderizar_txt_taxa(modelo_taxa(ibge), mun, uf)
+
+
+def renderizar_txt_taxa(modelo, mun, uf):
+    ano_ref, etapas_dados = modelo["ano_ref"], modelo["etapas"]
+
     if not ano_ref:
         return (_hdr("RELATÓRIO DE TAXAS DE RENDIMENTO - DADOS QEDU", mun)
                 + "\n  ⚠️ Sem dados.\n" + _footer())
@@ -1341,8 +2750,8 @@ def gerar_txt_taxa(ibge, mun, uf):
     anos_hist = sorted(anos_hist)
     periodo = f"{anos_hist[0]} a {anos_hist[-1]}" if len(anos_hist) >= 2 else str(ano_ref)
 
-    bloco = _hdr("RELATÓRIO DE TAXAS DE RENDIMENTO - DADOS QEDU",
-                  mun, ano=ano_ref, periodo=periodo)
+    bloco = RelatorioTXT(_hdr("RELATÓRIO DE TAXAS DE RENDIMENTO - DADOS QEDU",
+                              mun, ano=ano_ref, periodo=periodo))
     bloco += "\n"
 
     # PARTE 1: Taxas por etapa
@@ -1420,15 +2829,11 @@ def gerar_txt_taxa(ibge, mun, uf):
                     r = reg.get("rendimento", reg)
                     regs_dict[reg.get("ano")] = r.get(campo)
 
-                vals_str = ""
-                first_v = last_v = None
-                for a in all_anos:
-                    v = regs_dict.get(a)
-                    vals_str += f"{_safe_taxa(v):>6}"
-                    if v is not None:
-                        if first_v is None:
-                            first_v = v
-                        last_v = v
+                vals = [regs_dict.get(a) for a in all_anos]
+                vals_str = "".join(f"{_safe_taxa(v):>6}" for v in vals)
+                presentes = [v for v in vals if v is not None]
+                first_v = presentes[0] if presentes else None
+                last_v = presentes[-1] if presentes else None
 
                 var_str = ""
                 if first_v is not None and last_v is not None:
@@ -1444,7 +2849,7 @@ def gerar_txt_taxa(ibge, mun, uf):
     destaques = []
 
     # Diagnóstico por etapa
-    bloco += f"\n{SUBLINE}\n📊 DIAGNÓSTICO POR ETAPA DE ENSINO\n{SUBLINE}\n"
+    bloco.secao("📊 DIAGNÓSTICO POR ETAPA DE ENSINO")
 
     for cid, cnome in CICLOS.items():
         ed = etapas_dados.get(cid)
@@ -1477,7 +2882,7 @@ def gerar_txt_taxa(ibge, mun, uf):
             destaques.append(f"{cnome}: Excelente aprovação ({apv:.1f}%)")
 
     # Comparativo qualitativo
-    bloco += f"\n{SUBLINE}\n📈 COMPARATIVO {ano_ref}: {mun.upper()} vs {nome_estado.upper()} vs BRASIL\n{SUBLINE}\n"
+    bloco.secao(f"📈 COMPARATIVO {ano_ref}: {mun.upper()} vs {nome_estado.upper()} vs BRASIL")
 
     for cid in CICLOS:
         ed = etapas_dados.get(cid)
@@ -1536,7 +2941,7 @@ def gerar_txt_taxa(ibge, mun, uf):
             a_first, r_first, ab_first = _get_rendimento(regs[0])
             a_last, r_last, ab_last   = _get_rendimento(regs[-1])
 
-            bloco += f"\n{SUBLINE}\n📅 EVOLUÇÃO TEMPORAL ({periodo})\n{SUBLINE}\n"
+            bloco.secao(f"📅 EVOLUÇÃO TEMPORAL ({periodo})")
 
             if a_first is not None and a_last is not None:
                 d = (a_last - a_first)
@@ -1584,7 +2989,7 @@ def gerar_txt_taxa(ibge, mun, uf):
         bloco += f"   💼 Abordagem: RECUPERAÇÃO e reforço escolar. Grande potencial de mercado.\n"
 
     bloco += _footer("QEdu - Taxas de Rendimento / INEP (qedu.org.br)")
-    return bloco
+    return bloco.texto()
 
 
 # #############################################################################
@@ -1593,20 +2998,23 @@ def gerar_txt_taxa(ibge, mun, uf):
 #
 # #############################################################################
 
-def coletar_dados_estruturados(ibge, mun, uf):
-    """Coleta dados numéricos estruturados — reutiliza cache das chamadas já feitas."""
+def coletar_dados_estruturados(ibge, mun, uf, modelos=None):
+    """Dados numéricos estruturados a partir dos mesmos modelos dos TXTs.
+
+    `modelos` ({"aprendizado": ..., "censo": ..., ...}) vem de `gerar_todos`;
+    sem ele, os modelos são montados aqui (respostas já estão no cache).
+    """
+    if modelos is None:
+        modelos = {nome: fn(ibge) for nome, fn in [("aprendizado", modelo_aprendizado),
+                                                   ("censo", modelo_censo),
+                                                   ("infra", modelo_infra),
+                                                   ("taxa_rendimento", modelo_taxa)]}
     dados = {"entidade": mun, "uf": uf, "tipo": "estado" if is_estado(ibge) else "municipio"}
 
     # --- Aprendizado ---
-    dep_id = 5
     aprendizado = {}
-    for cid, cnome in CICLOS.items():
-        raw = fetch_aprendizado(ibge, dep_id, cid)
-        mun_recs, est_recs, br_recs = _extrair_territorios(raw, ibge)
-        if not mun_recs:
-            continue
-        ultimo = sorted(mun_recs, key=lambda x: x.get("ano", 0))[-1]
-        ultimo_br = sorted(br_recs, key=lambda x: x.get("ano", 0))[-1] if br_recs else None
+    for ciclo in modelos.get("aprendizado") or []:
+        ultimo, ultimo_br = ciclo["ultimo_mun"], ciclo["ultimo_br"]
         ciclo_d = {"ano": ultimo.get("ano"), "disciplinas": {}}
         for disc, disc_nome in DISCIPLINAS.items():
             ent_d = {}
@@ -1621,57 +3029,36 @@ def coletar_dados_estruturados(ibge, mun, uf):
                     if v is not None:
                         br_d[nk] = round(v * 100 if abs(v) <= 1.01 else v, 2)
             ciclo_d["disciplinas"][disc_nome] = {"entidade": ent_d, "brasil": br_d}
-        aprendizado[cid] = ciclo_d
+        aprendizado[ciclo["cid"]] = ciclo_d
     if aprendizado:
         dados["aprendizado"] = aprendizado
 
     # --- Censo ---
-    dep_id = 3
-    raw_c, ano_c = fetch_censo(ibge, dep_id)
-    if raw_c and "censo" in raw_c:
-        c = raw_c["censo"]
-        censo_d = {"ano": ano_c, "qtd_escolas": c.get("qtd_escolas"), "matriculas": {}}
-        total = 0
-        for campo, label in CAMPOS_MATRICULA:
-            v = c.get(campo)
-            if v is not None:
-                censo_d["matriculas"][label] = v
-                total += v
-        censo_d["total_matriculas"] = total
-        dados["censo"] = censo_d
+    m_censo = modelos.get("censo")
+    if m_censo:
+        dados["censo"] = {"ano": m_censo["ano"], "qtd_escolas": m_censo["censo"].get("qtd_escolas"),
+                          "matriculas": dict(m_censo["mat_etapas"]),
+                          "total_matriculas": m_censo["total_mat"]}
 
     # --- Infra ---
-    dep_id = 3
-    raw_i, ano_i = fetch_infra(ibge, dep_id)
-    if raw_i:
-        infra_d = {"ano": ano_i, "indicadores": {}}
-        for sec in raw_i:
-            for item in sec.get("items", []):
-                label = item.get("label", "")
-                for v in item.get("values", []):
-                    ent = v.get("entidade", "")
-                    val = v.get("value")
-                    if val is not None:
-                        if label not in infra_d["indicadores"]:
-                            infra_d["indicadores"][label] = {}
-                        key = ent.lower()
-                        infra_d["indicadores"][label][key] = round(val * 100, 2)
-        dados["infra"] = infra_d
+    m_infra = modelos.get("infra")
+    if m_infra:
+        dados["infra"] = {"ano": m_infra["ano"], "indicadores": {
+            label: {ent: round(val * 100, 2) for ent, val in vals.items()}
+            for label, vals in m_infra["indicadores"].items()}}
 
     # --- Taxa de Rendimento ---
     taxa_d = {}
-    for cid, cnome in CICLOS.items():
-        raw_t, ano_t = fetch_taxa(ibge, cid)
-        if raw_t:
-            reg = _get_ultimo_reg(raw_t.get("municipio", []))
-            if reg:
-                ap, rp, ab = _get_rendimento(reg)
-                taxa_d[cid] = {
-                    "nome": cnome, "ano": ano_t,
-                    "aprovacao_pct": round(ap * 100, 2) if ap else None,
-                    "reprovacao_pct": round(rp * 100, 2) if rp else None,
-                    "abandono_pct": round(ab * 100, 2) if ab else None,
-                }
+    m_taxa = modelos.get("taxa_rendimento")
+    for cid, ed in (m_taxa["etapas"].items() if m_taxa else []):
+        if ed and ed["tem_registro"]:
+            ap, rp, ab = ed["aprovados"], ed["reprovados"], ed["abandonos"]
+            taxa_d[cid] = {
+                "nome": ed["nome"], "ano": ed["ano"],
+                "aprovacao_pct": round(ap * 100, 2) if ap else None,
+                "reprovacao_pct": round(rp * 100, 2) if rp else None,
+                "abandono_pct": round(ab * 100, 2) if ab else None,
+            }
     if taxa_d:
         dados["taxa_rendimento"] = taxa_d
 
@@ -1684,41 +3071,372 @@ def coletar_dados_estruturados(ibge, mun, uf):
 #
 # #############################################################################
 
-def gerar_todos(ibge, output_dir=None):
-    """Gera os 5 relatórios TXT para um município ou estado."""
-    _clear_cache()  # limpa cache de requests para nova entidade
+# ---------- cache de renderização ----------
+# O corpo do TXT é função pura de (modelo, território, UF): mesmo hash de
+# entrada → mesmo texto, sem renderizar de novo.
+_RENDER_CACHE = CacheLRU(RENDER_CACHE_ITENS, RENDER_CACHE_BYTES, CACHE_TTL)
+
+
+def _hash_modelo(*partes) -> str:
+    """SHA-256 estável de um modelo (dicts/listas/escalares e DataFrames)."""
+    h = hashlib.sha256()
+
+    def add(o):
+        if isinstance(o, pd.DataFrame):
+            h.update(b"D" + repr(list(o.columns)).encode())
+            h.update(pd.util.hash_pandas_object(o, index=False).values.tobytes())
+        elif isinstance(o, dict):
+            h.update(b"{")
+            for k in sorted(o, key=str):
+                add(k)
+                add(o[k])
+            h.update(b"}")
+        elif isinstance(o, (list, tuple)):
+            h.update(b"[")
+            for x in o:
+                add(x)
+            h.update(b"]")
+        else:
+            h.update(f"{type(o).__name__}:{o!r}\0".encode())
+
+    for p in partes:
+        add(p)
+    return h.hexdigest()
+
+
+def _renderizar(nome, render_fn, modelo, mun, uf) -> Tuple[str, str]:
+    """(txt, hash_entrada) — do cache se o modelo não mudou."""
+    h = _hash_modelo(nome, modelo, mun, uf)
+    txt = _RENDER_CACHE.get((nome, h), None)
+    if txt is None:
+        txt = render_fn(modelo, mun, uf)
+        _RENDER_CACHE.set((nome, h), txt)
+    return txt, h
+
+
+# (nome, modelo, renderização TXT) — na ordem dos arquivos gerados
+RELATORIOS = [
+    ("aprendizado",     modelo_aprendizado, renderizar_txt_aprendizado),
+    ("infra",           modelo_infra,       renderizar_txt_infra),
+    ("censo",           modelo_censo,       renderizar_txt_censo),
+    ("ideb",            modelo_ideb,        renderizar_txt_ideb),
+    ("taxa_rendimento", modelo_taxa,        renderizar_txt_taxa),
+]
+TIPOS_RELATORIO = tuple(nome for nome, _, _ in RELATORIOS)
+
+# tipo de relatório → base da API (registro de anos, single-flight); o IDEB vem do CSV
+_ENDPOINT_DO_TIPO = {"aprendizado": "aprendizado", "censo": "censo",
+                     "infra": "infra", "taxa_rendimento": "taxa"}
+
+
+def normalizar_tipos(tipos) -> Tuple[str, ...]:
+    """Tipos pedidos → tupla na ordem de RELATORIOS (None/vazio = todos)."""
+    if not tipos:
+        return TIPOS_RELATORIO
+    if isinstance(tipos, str):
+        tipos = tipos.split(",")
+    pedidos = {t.strip().lower() for t in tipos if t and t.strip()}
+    invalidos = pedidos - set(TIPOS_RELATORIO)
+    if invalidos:
+        raise ValueError(f"Tipo(s) inválido(s): {', '.join(sorted(invalidos))}. "
+                         f"Use: {', '.join(TIPOS_RELATORIO)}")
+    return tuple(t for t in TIPOS_RELATORIO if t in pedidos) or TIPOS_RELATORIO
+
+
+def gerar_todos(ibge, output_dir=None, tipos=None, max_idade_respostas: float = None):
+    """Gera os relatórios TXT para um município ou estado — os 5, ou só os
+    `tipos` pedidos (ex.: ["censo", "ideb"]; só as chamadas deles vão à API).
+
+    Chamadas simultâneas para o mesmo IBGE (ex.: /gerar + /relatorio disparados
+    juntos pelo n8n) aguardam uma única geração e compartilham o resultado: a
+    chave é o IBGE + as bases da API consultadas, e um pedido cujas bases já
+    estão numa geração em voo espera por ela. Cada um leva só os seus tipos.
+
+    `max_idade_respostas` (s): respostas da API em cache mais velhas que isso
+    são buscadas de novo (ver `_escopo_cache`) — `obter_relatorios` usa a idade
+    máxima da saída, para que um relatório "novo" não saia de dados velhos.
+    """
+    ibge = str(ibge).strip()
+    tipos = normalizar_tipos(tipos)
+    endpoints = frozenset(_ENDPOINT_DO_TIPO[t] for t in tipos if t in _ENDPOINT_DO_TIPO)
+    base = ("gerar", ibge, str(output_dir) if output_dir else None, max_idade_respostas)
+    r = _SINGLE_FLIGHT.do((*base, endpoints), _gerar_todos, ibge, output_dir,
+                          _tipos_das_bases(endpoints), max_idade_respostas,
+                          cobre=lambda k: k[:4] == base and k[4] >= endpoints)
+    return _filtrar_resultado(r, tipos)
+
+
+def _tipos_das_bases(endpoints) -> Tuple[str, ...]:
+    """Todos os tipos que saem só dessas bases (+ IDEB, que não usa a API) —
+    o que uma geração com essas chamadas consegue entregar."""
+    return tuple(t for t in TIPOS_RELATORIO
+                 if t not in _ENDPOINT_DO_TIPO or _ENDPOINT_DO_TIPO[t] in endpoints)
+
+
+def _filtrar_resultado(r: dict, tipos) -> dict:
+    """Resultado de `gerar_todos` restrito aos `tipos` pedidos."""
+    sufixos = tuple(f"_{t}.txt" for t in tipos)
+    gerados_em = {t: g for t, g in r["gerados_em"].items() if t in tipos}
+    return {**r,
+            "arquivos": {f: txt for f, txt in r["arquivos"].items() if f.endswith(sufixos)},
+            "dados_estruturados": {k: v for k, v in r["dados_estruturados"].items()
+                                   if k not in _ENDPOINT_DO_TIPO or k in tipos},
+            "gerado_em": min(gerados_em.values(), default=r["gerado_em"]),
+            "gerados_em": gerados_em,
+            "hashes": {t: h for t, h in r["hashes"].items() if t in tipos},
+            "digests": {t: d for t, d in r["digests"].items() if t in tipos}}
+
+
+def _gerar_todos(ibge, output_dir=None, tipos=TIPOS_RELATORIO, max_idade_respostas=None):
+    # visão própria do cache: reaproveita respostas de gerações anteriores
+    # sem que gerações concorrentes apaguem o cache umas das outras
+    with _escopo_cache(max_idade_respostas):
+        _prefetch(ibge, tipos)  # chamadas da API em paralelo — geradores leem do cache
+
+        mun, uf_sigla = descobrir_municipio(ibge)
+        slug = _slug(mun)
+
+        # cada relatório: modelo calculado uma vez → TXT e dados estruturados
+        arquivos, modelos, hashes = {}, {}, {}
+        for nome, modelo_fn, render_fn in RELATORIOS:
+            if nome not in tipos:
+                continue
+            try:
+                modelos[nome] = modelo_fn(ibge)
+                txt, hashes[nome] = _renderizar(nome, render_fn, modelos[nome], mun, uf_sigla)
+            except Exception as e:
+                txt = f"❌ Erro ao gerar {nome}: {e}"
+            fname = f"{slug}_{nome}.txt"
+            arquivos[fname] = txt
+
+        dados_estruturados = coletar_dados_estruturados(ibge, mun, uf_sigla, modelos)
+        agora = datetime.now().isoformat(timespec="seconds")
+        resultado = {"municipio": mun, "uf": uf_sigla, "ibge": ibge,
+                     "arquivos": arquivos, "dados_estruturados": dados_estruturados,
+                     "gerado_em": agora, "gerados_em": {t: agora for t in hashes},
+                     "hashes": hashes,
+                     "digests": {t: _digest(arquivos[f"{slug}_{t}.txt"]) for t in hashes}}
+
+        if output_dir:
+            output_dir = pathlib.Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            # só os tipos gerados sem erro (com hash): quem falhou mantém o último
+            # TXT bom e a sua entrada no relatorios.json — arquivo e metadados
+            # continuam descrevendo o mesmo conteúdo
+            for nome in hashes:
+                fname = f"{slug}_{nome}.txt"
+                _gravar_atomico(output_dir / fname, arquivos[fname])
+            resultado["gerados_em"] = _gravar_meta_saida(output_dir, resultado, _anos_fonte(modelos))
+            resultado["gerado_em"] = min(resultado["gerados_em"].values(), default=agora)
+
+        return resultado
 
-    mun, uf_sigla = descobrir_municipio(ibge)
-    slug = _slug(mun)
 
-    geradores = [
-        ("aprendizado",     gerar_txt_aprendizado),
-        ("infra",           gerar_txt_infra),
-        ("censo",           gerar_txt_censo),
-        ("ideb",            gerar_txt_ideb),
-        ("taxa_rendimento", gerar_txt_taxa),
-    ]
+# =============================================================================
+# SAÍDA EM DISCO  (OUTPUT_DIR/<ibge>/ — servida de volta enquanto fresca)
+# =============================================================================
+# Ao lado dos TXTs fica `relatorios.json`: por tipo, arquivo, data de geração,
+# hash do modelo, ano da fonte e o ano do registro da base naquele momento;
+# mais os dados estruturados. Pastas sem esse arquivo (ex.: geradas por versões
+# antigas) são sempre regeradas.
+SAIDA_META = "relatorios.json"
+
+_SAIDA_LOCK = threading.Lock()
+
+
+def _digest(texto: str) -> str:
+    """Hash do TXT como gravado/lido — identifica o conteúdo de fato servido."""
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+
+def _gravar_atomico(caminho: pathlib.Path, texto: str):
+    """Grava num temporário ao lado e troca de uma vez (`replace`): quem lê a
+    pasta ao mesmo tempo vê o arquivo antigo ou o novo, nunca um pela metade.
+    O temporário leva pid/thread — gerações concorrentes não se atropelam."""
+    tmp = caminho.with_name(f"{caminho.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp.write_text(texto, encoding="utf-8")
+        tmp.replace(caminho)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def _anos_fonte(modelos: dict) -> Dict[str, Optional[int]]:
+    """Ano mais recente dos dados usados em cada relatório."""
+    anos = {}
+    if "aprendizado" in modelos:
+        anos["aprendizado"] = max((c["ultimo_mun"].get("ano") or 0 for c in modelos["aprendizado"]),
+                                  default=0) or None
+    for tipo in ("censo", "infra"):
+        if tipo in modelos:
+            anos[tipo] = (modelos[tipo] or {}).get("ano")
+    if "taxa_rendimento" in modelos:
+        anos["taxa_rendimento"] = modelos["taxa_rendimento"]["ano_ref"] or None
+    if "ideb" in modelos:
+        df_mun = modelos["ideb"][0]
+        anos["ideb"] = int(df_mun["ano"].max()) if df_mun is not None and not df_mun.empty else None
+    return anos
+
+
+def _gravar_meta_saida(output_dir: pathlib.Path, resultado: dict, anos: dict) -> Dict[str, str]:
+    """Atualiza relatorios.json com os tipos recém-gerados (mantém os demais).
+
+    Tipo regerado com o mesmo hash mantém o `gerado_em` anterior (o conteúdo
+    não mudou — Last-Modified e corpo continuam os mesmos); `gerado_em_ts`
+    sempre avança, e é ele que conta a idade. Retorna tipo → gerado_em."""
+    caminho = output_dir / SAIDA_META
+    agora = time.time()
+    with _SAIDA_LOCK:
+        try:
+            meta = json.loads(caminho.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            meta = {}
+        relatorios = meta.get("relatorios", {})
+        dados = meta.get("dados", {})
+        slug = _slug(resultado["municipio"])
+        gerados_em = {}
+        for tipo, h in resultado["hashes"].items():  # só os gerados sem erro
+            endpoint = _ENDPOINT_DO_TIPO.get(tipo)
+            anterior = relatorios.get(tipo) or {}
+            gerados_em[tipo] = (anterior["gerado_em"] if anterior.get("hash") == h
+                                and anterior.get("gerado_em") else resultado["gerado_em"])
+            relatorios[tipo] = {"arquivo": f"{slug}_{tipo}.txt", "gerado_em": gerados_em[tipo],
+                                "gerado_em_ts": agora, "hash": h, "ano_fonte": anos.get(tipo),
+                                "ano_registro": _ano_registrado(endpoint) if endpoint else None}
+            dados.pop(tipo, None)
+        dados.update(resultado["dados_estruturados"])
+        meta = {"ibge": resultado["ibge"], "municipio": resultado["municipio"],
+                "uf": resultado["uf"], "relatorios": relatorios, "dados": dados}
+        try:
+            _gravar_atomico(caminho, json.dumps(meta, ensure_ascii=False, indent=1))
+        except OSError:
+            pass  # disco somente leitura — só não dá para servir do disco depois
+        return gerados_em
+
+
+def _ler_meta_saida(output_dir: pathlib.Path, tipos, max_idade: float) -> Optional[dict]:
+    """Metadados de `tipos` em relatorios.json — sem ler os TXTs. None se faltar
+    algum tipo ou passar de `max_idade` (s). `ano_novo` indica que o registro de
+    anos de alguma base avançou desde a geração (compara com o ano registrado na
+    época, não com o ano dos dados do território — um município sem dados no ano
+    mais novo não fica sempre velho)."""
+    try:
+        meta = json.loads((output_dir / SAIDA_META).read_text(encoding="utf-8"))
+        relatorios = meta["relatorios"]
+        entradas = {t: relatorios[t] for t in tipos}
+        idade = time.time() - min(e["gerado_em_ts"] for e in entradas.values())
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if idade > max_idade:
+        return None
+    ano_novo = False
+    for tipo, e in entradas.items():
+        endpoint = _ENDPOINT_DO_TIPO.get(tipo)
+        registrado = _ano_registrado(endpoint) if endpoint else None
+        if registrado and e.get("ano_registro") and registrado > e["ano_registro"]:
+            ano_novo = True  # saiu ano novo desde a geração
+    gerados_em = {t: e["gerado_em"] for t, e in entradas.items()}
+    return {"meta": meta, "entradas": entradas, "gerado_em": min(gerados_em.values()),
+            "gerados_em": gerados_em, "hashes": {t: e["hash"] for t, e in entradas.items()},
+            "idade_s": idade, "ano_novo": ano_novo}
+
+
+def ler_saida(ibge, output_dir, tipos=None, max_idade: float = SAIDA_MAX_IDADE) -> Optional[dict]:
+    """Resultado no formato de `gerar_todos` lido de `output_dir`, ou None se
+    faltar algum tipo ou passar de `max_idade` (s). `idade_s` traz a idade e
+    `ano_novo` se o registro de anos avançou desde a geração."""
+    tipos = normalizar_tipos(tipos)
+    output_dir = pathlib.Path(output_dir)
+    m = _ler_meta_saida(output_dir, tipos, max_idade)
+    if m is None:
+        return None
+    meta, entradas = m.pop("meta"), m.pop("entradas")
+    try:
+        textos = {t: (output_dir / e["arquivo"]).read_text(encoding="utf-8")
+                  for t, e in entradas.items()}
+    except OSError:
+        return None
+    arquivos = {entradas[t]["arquivo"]: txt for t, txt in textos.items()}
+    m["digests"] = {t: _digest(txt) for t, txt in textos.items()}
+    dados = {k: v for k, v in meta.get("dados", {}).items()
+             if k not in _ENDPOINT_DO_TIPO or k in tipos}
+    return {"municipio": meta["municipio"], "uf": meta["uf"], "ibge": str(ibge),
+            "arquivos": arquivos, "dados_estruturados": dados, **m}
+
 
-    arquivos = {}
-    for nome, fn in geradores:
+_REVALIDANDO: set = set()
+_REVALIDANDO_LOCK = threading.Lock()
+
+
+def _revalidar(ibge, output_dir, tipos, max_idade_respostas: float = None) -> bool:
+    """Agenda uma regeração em segundo plano (uma por ibge/pasta/tipos), com
+    respostas da API de no máximo `max_idade_respostas` (s)."""
+    chave = (ibge, str(output_dir), tipos)
+    with _REVALIDANDO_LOCK:
+        if chave in _REVALIDANDO:
+            return False
+        _REVALIDANDO.add(chave)
+
+    def tarefa():
         try:
-            txt = fn(ibge, mun, uf_sigla)
-        except Exception as e:
-            txt = f"❌ Erro ao gerar {nome}: {e}"
-        fname = f"{slug}_{nome}.txt"
-        arquivos[fname] = txt
+            gerar_todos(ibge, output_dir, tipos, max_idade_respostas)
+        except Exception:
+            pass  # arquivos antigos continuam servindo; próxima requisição tenta de novo
+        finally:
+            with _REVALIDANDO_LOCK:
+                _REVALIDANDO.discard(chave)
 
-    # Dados estruturados (JSON-friendly) — reutiliza cache, custo zero
-    dados_estruturados = coletar_dados_estruturados(ibge, mun, uf_sigla)
+    _submit(_pool("revalidar", REVALIDAR_WORKERS), tarefa)
+    return True
+
+
+def obter_relatorios(ibge, output_dir=None, tipos=None, max_idade: float = SAIDA_MAX_IDADE,
+                     max_idade_dura: float = SAIDA_MAX_IDADE_DURA) -> dict:
+    """Como `gerar_todos`, mas lê de `output_dir` (padrão OUTPUT_DIR/<ibge>).
+
+    - até `max_idade` (s): arquivos do disco                  → origem "disco"
+    - até `max_idade_dura` (ou ano novo na fonte): arquivos do
+      disco e regeração em segundo plano                      → origem "disco_expirado"
+    - sem arquivos ou mais velhos: gera e espera              → origem "gerado"
+
+    Regerações (as duas últimas) não reaproveitam respostas da API em cache
+    mais velhas que `max_idade` — a idade da saída vale também para os dados.
+    """
+    ibge = str(ibge).strip()
+    tipos = normalizar_tipos(tipos)
+    output_dir = pathlib.Path(output_dir) if output_dir else OUTPUT_DIR / ibge
+    if max_idade > 0:
+        r = ler_saida(ibge, output_dir, tipos, max(max_idade, max_idade_dura))
+        if r is not None:
+            return _servir_do_disco(ibge, output_dir, tipos, r, max_idade)
+    r = gerar_todos(ibge, output_dir, tipos, max_idade if max_idade > 0 else None)
+    return {**r, "idade_s": 0.0, "ano_novo": False, "origem": "gerado"}
+
+
+def validar_saida(ibge, output_dir=None, tipos=None, max_idade: float = SAIDA_MAX_IDADE,
+                  max_idade_dura: float = SAIDA_MAX_IDADE_DURA) -> Optional[dict]:
+    """Só os metadados que `obter_relatorios` serviria do disco (hashes,
+    gerado_em, idade, origem), sem ler os TXTs nem gerar — para responder a um
+    If-None-Match antes de qualquer trabalho. Expirado também agenda a
+    regeração. None → não há saída utilizável (a requisição vai gerar)."""
+    ibge = str(ibge).strip()
+    tipos = normalizar_tipos(tipos)
+    output_dir = pathlib.Path(output_dir) if output_dir else OUTPUT_DIR / ibge
+    if max_idade <= 0:
+        return None
+    m = _ler_meta_saida(output_dir, tipos, max(max_idade, max_idade_dura))
+    if m is None:
+        return None
+    del m["meta"], m["entradas"]
+    return _servir_do_disco(ibge, output_dir, tipos, m, max_idade)
 
-    if output_dir:
-        output_dir = pathlib.Path(output_dir)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        for fname, txt in arquivos.items():
-            (output_dir / fname).write_text(txt, encoding="utf-8")
 
-    return {"municipio": mun, "uf": uf_sigla, "ibge": ibge,
-            "arquivos": arquivos, "dados_estruturados": dados_estruturados}
+def _servir_do_disco(ibge, output_dir, tipos, r: dict, max_idade: float) -> dict:
+    if r["idade_s"] <= max_idade and not r["ano_novo"]:
+        return {**r, "origem": "disco"}
+    _revalidar(ibge, output_dir, tipos, max_idade)
+    return {**r, "origem": "disco_expirado"}
 
 
 # =============================================================================
@@ -1727,12 +3445,48 @@ def gerar_todos(ibge, output_dir=None):
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Gerador QEDU — CLI")
-    parser.add_argument("ibge", help="Código IBGE (7 dígitos para município, 2 dígitos para estado)")
+    parser.add_argument("ibge", nargs="?", help="Código IBGE (7 dígitos para município, 2 dígitos para estado)")
     parser.add_argument("--output", default=None)
+    parser.add_argument("--tipos", default=None,
+                        help=f"Relatórios a gerar, separados por vírgula ({','.join(TIPOS_RELATORIO)})")
+    parser.add_argument("--build-ideb", action="store_true",
+                        help="Gera/atualiza o cache colunar (.feather) dos CSVs do IDEB e sai")
+    parser.add_argument("--build-municipios", action="store_true",
+                        help="Regrava dados/municipios_ibge.csv (cadastro IBGE → nome/UF) e sai")
+    parser.add_argument("--memoria-ideb", action="store_true",
+                        help="Mostra a memória ocupada pelos dados do IDEB e sai")
     args = parser.parse_args()
+    if args.build_ideb:
+        feitos = atualizar_cache_ideb()
+        print(f"✅ Cache IDEB: {len(feitos)} arquivo(s) regravado(s)")
+        for f in feitos:
+            print(f"   📦 {f}")
+    if args.build_municipios:
+        n = atualizar_cadastro_municipios()
+        if not n:
+            sys.exit(f"❌ Cadastro de municípios vazio — {MUNICIPIOS_CSV} ausente e sem CSV do IDEB")
+        print(f"✅ Cadastro de municípios: {n} município(s) em {MUNICIPIOS_CSV}")
+    if args.build_ideb or args.build_municipios:
+        sys.exit(0)
+    if args.memoria_ideb:
+        rel = ideb_memoria()
+        if rel is None:
+            sys.exit("❌ CSVs do IDEB não encontrados")
+        for tabela in ("municipios", "estados"):
+            t = rel[tabela]
+            print(f"📊 {tabela}: {t['linhas']} linhas, {t['bytes'] / 1024:.1f} KiB")
+            for col, c in t["colunas"].items():
+                print(f"   {col:<22} {c['dtype']:<10} {c['bytes'] / 1024:>9.1f} KiB")
+        print(f"Total: {rel['total_bytes'] / 1024:.1f} KiB")
+        sys.exit(0)
+    if not args.ibge:
+        parser.error("informe o código IBGE (ou --build-ideb / --build-municipios / --memoria-ideb)")
     out = pathlib.Path(args.output) if args.output else OUTPUT_DIR / args.ibge
     print(f"\n🔄 Gerando relatórios para IBGE {args.ibge}...")
-    res = gerar_todos(args.ibge, out)
+    try:
+        res = gerar_todos(args.ibge, out, args.tipos)
+    except ValueError as e:
+        parser.error(str(e))
     print(f"✅ {res['municipio']} ({res['uf']}) — {len(res['arquivos'])} arquivos em {out}")
     for f in res["arquivos"]:
         print(f"   📄 {f}")
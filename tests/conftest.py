@@ -0,0 +1,184 @@
+"""Fixtures comuns: gerador isolado (caches, registro de anos, saída em tmp)
+e uma API QEdu falsa no lugar da sessão HTTP — nenhum teste sai para a rede."""
+
+import os
+import sys
+import csv
+import json
+import shutil
+import pathlib
+import tempfile
+import threading
+
+RAIZ = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+# antes de importar o gerador: constantes são lidas do ambiente no import
+os.environ.setdefault("QEDU_CACHE_DIR", tempfile.mkdtemp(prefix="qedu-cache-"))
+os.environ.setdefault("QEDU_DISCO_CACHE", "0")
+os.environ.setdefault("QEDU_RETRY_BASE_S", "0")
+os.environ.setdefault("QEDU_RETRY_MAX_S", "0")
+
+import pytest  # noqa: E402
+
+import gerador  # noqa: E402
+
+
+# =============================================================================
+# API QEDU FALSA
+# =============================================================================
+def _rec(ibge, parent, ano, base):
+    d = {"territorio": {"ibge_id": ibge, "parent_id": parent}, "ano": ano}
+    for disc, off in (("lp", 0.0), ("mt", -0.08)):
+        adq = base + off + (ano - 2019) * 0.01
+        d[f"{disc}_adequado"] = round(adq, 4)
+        d[f"{disc}_avancado"] = round(adq * 0.3, 4)
+        d[f"{disc}_proficiente"] = round(adq * 0.7, 4)
+        d[f"{disc}_basico"] = round((1 - adq) * 0.6, 4)
+        d[f"{disc}_insuficiente"] = round((1 - adq) * 0.4, 4)
+    return d
+
+
+def _taxa_reg(ano, aprovados, nome, sigla=None):
+    t = {"nome": nome, **({"sigla": sigla} if sigla else {})}
+    return {"ano": ano, "rendimento": {"aprovados": aprovados,
+                                       "reprovados": round((1 - aprovados) * 0.7, 4),
+                                       "abandonos": round((1 - aprovados) * 0.3, 4),
+                                       "territorio": t}}
+
+
+def rota_padrao(url, params):
+    """(status, json) da API falsa: censo/infra até 2024, taxa até 2023,
+    aprendizado com SAEB 2019/2021/2023."""
+    ano = int(params.get("ano", 0) or 0)
+    if "/aprendizado/" in url:
+        ibge = int(url.split("/aprendizado/")[1].split("/")[0])
+        ciclo = params.get("ciclo_id")
+        if ciclo == "EM" and ibge > 99:
+            return 200, []
+        base = {"AI": 0.55, "AF": 0.40, "EM": 0.30}[ciclo]
+        anos = (2019, 2021, 2023)
+        return 200, [[_rec(ibge, 23, a, base) for a in anos],
+                     [_rec(23, None, a, base + 0.05) for a in anos],
+                     [_rec(7, None, a, base + 0.02) for a in anos]]
+    if "/censo/" in url:
+        if ano > 2024:
+            return 200, {"censo": None}
+        return 200, {"censo": {"qtd_escolas": 300 + int(params["dependencia_id"]),
+                               "matriculas_creche": 20000, "matriculas_pre_escolar": 25000,
+                               "matriculas_anos_iniciais": 90000, "matriculas_anos_finais": 70000,
+                               "matriculas_eja": 8000, "matriculas_educacao_especial": 5000,
+                               "territorio": {"nome": "Fortaleza", "parent": {"sigla": "CE"}}}}
+    if "/infra/" in url:
+        if ano > 2024:
+            return 200, [{"items": [{"label": "Internet", "values": []}]}]
+        items = [{"label": lab, "values": [{"entidade": "Municipio", "value": 0.3 + i * 0.12},
+                                           {"entidade": "Estado", "value": 0.5},
+                                           {"entidade": "Brasil", "value": 0.55 - i * 0.05}]}
+                 for i, lab in enumerate(["Biblioteca*", "Internet", "Banda Larga",
+                                          "Quadra de Esportes"])]
+        return 200, [{"items": items}]
+    if "/taxa-rendimento/" in url:
+        if ano > 2023:
+            return 404, None
+        if params.get("ciclo_id") == "EM":
+            return 200, {"entidade": [], "parent": [], "brasil": []}
+        anos = range(2019, ano + 1)
+        return 200, {"entidade": [_taxa_reg(a, 0.9 + (a - 2019) * 0.01, "Fortaleza") for a in anos],
+                     "parent": [_taxa_reg(a, 0.91, "Ceará", "CE") for a in anos],
+                     "brasil": [_taxa_reg(a, 0.92, "Brasil") for a in anos]}
+    return 404, None
+
+
+class RespostaFalsa:
+    def __init__(self, status, payload, headers=None):
+        self.status_code = status
+        self._payload = payload
+        self.headers = headers or {}
+        self.content = json.dumps(payload).encode() if payload is not None else b""
+
+    def json(self):
+        if self._payload is None:
+            raise ValueError("sem JSON")
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            erro = requests.HTTPError(str(self.status_code))
+            erro.response = self
+            raise erro
+
+
+class SessaoFalsa:
+    """Substitui a requests.Session do gerador; registra as chamadas feitas."""
+
+    def __init__(self):
+        self.rota = rota_padrao
+        self.chamadas = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        params = dict(params or {})
+        with self._lock:
+            self.chamadas.append((url, params))
+        resposta = self.rota(url, params)
+        if isinstance(resposta, BaseException):
+            raise resposta
+        return RespostaFalsa(*resposta)
+
+
+# =============================================================================
+# FIXTURES
+# =============================================================================
+@pytest.fixture(autouse=True)
+def isolado(tmp_path, monkeypatch):
+    """Cada teste começa com caches, registro de anos, circuit breaker e
+    limitador novos, saída em tmp e a API falsa no lugar da rede."""
+    monkeypatch.setattr(gerador, "ANOS_REGISTRO_FILE", tmp_path / "anos.json")
+    monkeypatch.setattr(gerador, "_ANOS_REGISTRO", {})
+    monkeypatch.setattr(gerador, "_ANOS_REGISTRO_CARREGADO", True)
+    monkeypatch.setattr(gerador, "_CIRCUITO", gerador.CircuitBreaker(5, 30))
+    monkeypatch.setattr(gerador, "_LIMITADOR",
+                        gerador.LimitadorAdaptativo(1000, 1000, 1000, 16, 60))
+    monkeypatch.setattr(gerador, "_DISCO_CACHE", None)
+    monkeypatch.setattr(gerador, "OUTPUT_DIR", tmp_path / "output")
+    monkeypatch.setattr(gerador, "MUNICIPIOS_APRENDIDOS_FILE", tmp_path / "aprendidos.json")
+    monkeypatch.setattr(gerador, "_MUNICIPIOS_APRENDIDOS", None)
+    monkeypatch.setattr(gerador, "_MUNICIPIOS_VERSAO", gerador._AUSENTE)
+    monkeypatch.setattr(gerador, "IDEB_MUN_CSV", tmp_path / "sem_ideb_municipios.csv")
+    monkeypatch.setattr(gerador, "_IDEB_STORE", None)
+    monkeypatch.setattr(gerador, "_IDEB_STORE_VERSAO", None)
+    gerador._clear_cache()
+    gerador._RENDER_CACHE.clear()
+    sessao = SessaoFalsa()
+    monkeypatch.setattr(gerador, "_SESSION", sessao)
+    yield sessao
+
+
+@pytest.fixture
+def qedu(isolado):
+    """A API falsa: `.chamadas` registra (url, params); `.rota` pode ser trocada."""
+    return isolado
+
+
+@pytest.fixture
+def ideb(tmp_path, monkeypatch):
+    """CSVs do IDEB em tmp: estados = cópia do CSV real; municípios = Fortaleza
+    (CE + 0.4, rede municipal). Retorna (csv_municipios, csv_estados)."""
+    pasta = tmp_path / "dados"
+    pasta.mkdir()
+    uf_csv = pasta / gerador.IDEB_UF_CSV.name
+    shutil.copy(RAIZ / "dados" / gerador.IDEB_UF_CSV.name, uf_csv)
+    mun_csv = pasta / "ideb_municipios.csv"
+    with open(uf_csv, encoding="utf-8") as f, open(mun_csv, "w", encoding="utf-8", newline="") as g:
+        w = csv.writer(g)
+        w.writerow(["codigo_ibge", "indicador_municipio", "indicador_uf", "indicador_tipo_nome",
+                    "ano", "valor", "esfera", "segmento"])
+        for row in csv.DictReader(f, delimiter=";"):
+            if row["indicador_uf"] == "CE":
+                w.writerow(["2304400", "Fortaleza", "CE", row["indicador_tipo_nome"], row["ano"],
+                            round(float(row["valor"]) + 0.4, 2), "municipal", row["segmento"]])
+    monkeypatch.setattr(gerador, "IDEB_MUN_CSV", mun_csv)
+    monkeypatch.setattr(gerador, "IDEB_UF_CSV", uf_csv)
+    return mun_csv, uf_csv
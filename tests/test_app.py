@@ -0,0 +1,208 @@
+"""API Flask: ETag dos relatórios, 304 antes de gerar e compressão."""
+
+import gzip
+import json
+
+import pytest
+
+import app as api
+import gerador
+
+
+@pytest.fixture
+def cliente(qedu, ideb, monkeypatch):
+    monkeypatch.setattr(api, "OUTPUT_DIR", gerador.OUTPUT_DIR)
+    api._COMPRIMIDOS.clear()
+    return api.app.test_client()
+
+
+@pytest.fixture
+def geracoes(monkeypatch):
+    feitas = []
+    original = gerador.gerar_todos
+    monkeypatch.setattr(gerador, "gerar_todos", lambda *a, **k: feitas.append(a) or original(*a, **k))
+    return feitas
+
+
+def _sidecar(ibge="2304400"):
+    return gerador.OUTPUT_DIR / ibge / gerador.SAIDA_META
+
+
+# ---------- ETag / 304 ----------
+
+def test_if_none_match_responde_304_sem_gerar(cliente, qedu, geracoes, monkeypatch):
+    r = cliente.get("/gerar?ibge=2304400")
+    assert r.status_code == 200 and r.headers["X-Cache"] == "MISS"
+    etag = r.headers["ETag"]
+    assert etag.startswith('W/"')
+    qedu.chamadas.clear()
+    geracoes.clear()
+    monkeypatch.setattr(gerador, "ler_saida", lambda *a, **k: pytest.fail("leu os TXTs"))
+
+    r2 = cliente.get("/gerar?ibge=2304400", headers={"If-None-Match": etag})
+    assert r2.status_code == 304 and r2.data == b""
+    assert r2.headers["ETag"] == etag and r2.headers["X-Cache"] == "HIT"
+    assert r2.headers["X-Gerado-Em"] == r.headers["X-Gerado-Em"]
+    assert qedu.chamadas == [] and geracoes == []
+
+
+def test_etag_vem_dos_hashes_nao_do_corpo(cliente, monkeypatch):
+    r1 = cliente.get("/gerar?ibge=2304400&tipos=censo")
+    meta = json.loads(_sidecar().read_text(encoding="utf-8"))
+    meta["relatorios"]["censo"]["gerado_em"] = "2020-01-01T00:00:00"
+    meta["relatorios"]["censo"]["gerado_em_ts"] -= 10 * gerador.SAIDA_MAX_IDADE_DURA
+    _sidecar().write_text(json.dumps(meta), encoding="utf-8")
+    gerador._clear_cache()
+
+    r2 = cliente.get("/gerar?ibge=2304400&tipos=censo")  # velho demais: regera
+    assert r2.headers["X-Cache"] == "MISS"
+    assert r2.headers["ETag"] == r1.headers["ETag"]
+    # mesmo conteúdo: a data de geração anterior é mantida
+    assert r2.get_json()["gerado_em"] == "2020-01-01T00:00:00"
+
+
+def test_conteudo_novo_muda_a_etag(cliente):
+    etag = cliente.get("/gerar?ibge=2304400&tipos=censo").headers["ETag"]
+    meta = json.loads(_sidecar().read_text(encoding="utf-8"))
+    meta["relatorios"]["censo"]["hash"] = "outro"
+    _sidecar().write_text(json.dumps(meta), encoding="utf-8")
+    r = cliente.get("/gerar?ibge=2304400&tipos=censo", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["ETag"] != etag
+
+
+def test_etag_distingue_formato_e_tipos(cliente):
+    txt = cliente.get("/relatorio?ibge=2304400&tipo=censo")
+    json_censo = cliente.get("/gerar?ibge=2304400&tipos=censo")
+    todos = cliente.get("/gerar/2304400")
+    assert len({txt.headers["ETag"], json_censo.headers["ETag"], todos.headers["ETag"]}) == 3
+    r = cliente.get("/relatorio?ibge=2304400&tipo=censo", headers={"If-None-Match": txt.headers["ETag"]})
+    assert r.status_code == 304
+
+
+def test_304_expirado_agenda_revalidacao(cliente, monkeypatch):
+    etag = cliente.get("/gerar?ibge=2304400&tipos=censo").headers["ETag"]
+    agendadas = []
+    monkeypatch.setattr(gerador, "_revalidar", lambda *a: agendadas.append(a) or True)
+    gerador._registrar_ano("censo", gerador.ANO_ATUAL + 1)
+    r = cliente.get("/gerar?ibge=2304400&tipos=censo", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.headers["X-Cache"] == "STALE"
+    assert "max-age=0" in r.headers["Cache-Control"] and len(agendadas) == 1
+
+
+def _envelhecer(tipo, segundos, ibge="2304400"):
+    meta = json.loads(_sidecar(ibge).read_text(encoding="utf-8"))
+    meta["relatorios"][tipo]["gerado_em_ts"] -= segundos
+    _sidecar(ibge).write_text(json.dumps(meta), encoding="utf-8")
+
+
+def _quebrar(monkeypatch, tipo):
+    def falha(ibge):
+        raise RuntimeError("resposta inesperada")
+
+    monkeypatch.setattr(gerador, "RELATORIOS", [(n, falha if n == tipo else m, r)
+                                                 for n, m, r in gerador.RELATORIOS])
+
+
+def test_regeracao_com_erro_nao_reaproveita_a_etag(cliente, monkeypatch):
+    bom = cliente.get("/gerar?ibge=2304400")
+    etag = bom.headers["ETag"]
+    _envelhecer("censo", 10 * gerador.SAIDA_MAX_IDADE_DURA)  # velho demais: regera
+    _quebrar(monkeypatch, "censo")
+
+    for _ in range(2):  # nem na regeração que falhou, nem na seguinte
+        r = cliente.get("/gerar?ibge=2304400", headers={"If-None-Match": etag})
+        assert r.status_code == 200 and r.headers["X-Cache"] == "MISS"
+        assert r.get_json()["relatorios"]["censo"].startswith("❌ Erro ao gerar censo")
+        assert "ETag" not in r.headers
+
+
+def test_revalidacao_com_erro_segue_servindo_o_ultimo_bom(cliente, monkeypatch):
+    bom = cliente.get("/gerar?ibge=2304400&tipos=censo")
+    _envelhecer("censo", gerador.SAIDA_MAX_IDADE + 60)  # vencido, ainda servível
+    _quebrar(monkeypatch, "censo")
+    monkeypatch.setattr(gerador, "_revalidar",
+                        lambda *a: gerador.gerar_todos(*a) and True)
+
+    r = cliente.get("/gerar?ibge=2304400&tipos=censo")  # revalida (e falha) na hora
+    assert r.headers["X-Cache"] == "STALE" and r.headers["ETag"] == bom.headers["ETag"]
+    assert r.get_json()["relatorios"] == bom.get_json()["relatorios"]
+    r = cliente.get("/gerar?ibge=2304400&tipos=censo", headers={"If-None-Match": bom.headers["ETag"]})
+    assert r.status_code == 304  # o disco ainda tem exatamente o corpo daquela ETag
+    assert cliente.get("/gerar?ibge=2304400&tipos=censo").get_json()["relatorios"] == \
+        bom.get_json()["relatorios"]
+
+
+def test_tipos_seguem_a_normalizacao_do_gerador(cliente, geracoes):
+    r1 = cliente.get("/gerar?ibge=2304400&tipos=censo,ideb")
+    r2 = cliente.get("/gerar?ibge=2304400&tipos= IDEB,censo,censo")
+    assert r2.status_code == 200 and r2.headers["ETag"] == r1.headers["ETag"]
+    assert list(r2.get_json()["relatorios"]) == list(r1.get_json()["relatorios"])
+    assert [a[2] for a in geracoes] == [gerador.normalizar_tipos("censo,ideb")]
+
+
+def test_tipo_invalido_responde_400_com_a_mensagem_do_gerador(cliente, geracoes):
+    with pytest.raises(ValueError) as e:
+        gerador.normalizar_tipos("censo,foo")
+    r = cliente.get("/gerar?ibge=2304400&tipos=censo,foo")
+    assert r.status_code == 400 and r.get_json()["erro"] == str(e.value)
+    assert geracoes == []
+
+
+def test_municipio_mantem_etag_do_corpo(cliente):
+    r = cliente.get("/municipio?ibge=2304400")
+    assert r.status_code == 200 and not r.headers["ETag"].startswith("W/")
+    assert cliente.get("/municipio?ibge=2304400",
+                       headers={"If-None-Match": r.headers["ETag"]}).status_code == 304
+
+
+# ---------- compressão ----------
+
+def test_gzip_ida_e_volta(cliente):
+    puro = cliente.get("/gerar?ibge=2304400")
+    assert "Content-Encoding" not in puro.headers
+    r = cliente.get("/gerar?ibge=2304400", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in r.headers["Vary"]
+    assert r.headers["ETag"] == puro.headers["ETag"][:-1] + '-gzip"'
+    assert len(r.data) < len(puro.data) / 3
+    assert gzip.decompress(r.data) == puro.data
+
+
+def test_corpo_pequeno_sai_sem_compressao(cliente):
+    r = cliente.get("/health", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200 and "Content-Encoding" not in r.headers
+
+
+def test_comprimido_fica_em_disco_junto_dos_relatorios(cliente, monkeypatch):
+    primeiro = cliente.get("/gerar?ibge=2304400", headers={"Accept-Encoding": "gzip"})
+    pasta = gerador.OUTPUT_DIR / "2304400" / api.COMPRIMIDOS_DIR
+    arquivos = list(pasta.iterdir())
+    assert len(arquivos) == 1 and arquivos[0].suffix == ".gzip"
+    assert arquivos[0].read_bytes() == primeiro.data
+
+    # processo novo (LRU vazio): lê do disco, sem comprimir de novo
+    api._COMPRIMIDOS.clear()
+    monkeypatch.setitem(api._COMPRESSORES, "gzip", lambda b: pytest.fail("comprimiu de novo"))
+    r = cliente.get("/gerar?ibge=2304400", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["X-Cache"] == "HIT" and r.data == primeiro.data
+
+
+def test_comprimido_acompanha_o_txt_do_disco(cliente):
+    cliente.get("/gerar?ibge=2304400&tipos=censo", headers={"Accept-Encoding": "gzip"})
+    # TXT trocado sem passar pelo relatorios.json (mesma ETag, mesmo gerado_em)
+    txt = gerador.OUTPUT_DIR / "2304400" / "Fortaleza_censo.txt"
+    txt.write_text(txt.read_text(encoding="utf-8") + "editado\n", encoding="utf-8")
+    api._COMPRIMIDOS.clear()
+
+    puro = cliente.get("/gerar?ibge=2304400&tipos=censo")
+    z = cliente.get("/gerar?ibge=2304400&tipos=censo", headers={"Accept-Encoding": "gzip"})
+    assert puro.get_json()["relatorios"]["censo"].endswith("editado\n")
+    assert gzip.decompress(z.data) == puro.data
+    assert len(list((gerador.OUTPUT_DIR / "2304400" / api.COMPRIMIDOS_DIR).iterdir())) == 2
+
+
+def test_comprimidos_antigos_sao_podados(cliente, monkeypatch):
+    monkeypatch.setattr(api, "COMPRIMIDO_DISCO_ARQUIVOS", 2)
+    for tipos in ("censo", "infra", "aprendizado"):
+        cliente.get(f"/gerar?ibge=2304400&tipos={tipos},ideb", headers={"Accept-Encoding": "gzip"})
+    assert len(list((gerador.OUTPUT_DIR / "2304400" / api.COMPRIMIDOS_DIR).iterdir())) == 2
@@ -0,0 +1,139 @@
+"""Caches: LRU+TTL em memória, cache negativo e cache em disco (SQLite)."""
+
+import time
+
+import gerador
+from gerador import CacheLRU
+
+
+# ---------- LRU + TTL ----------
+
+def test_cache_lru_expira_pelo_ttl():
+    c = CacheLRU(10, 10_000, ttl=0.05)
+    c.set("a", 1)
+    c.set("b", 2, ttl=60)
+    assert c.get("a") == 1
+    time.sleep(0.06)
+    assert c.get("a", None) is None
+    assert c.get("b") == 2
+    assert len(c) == 1
+
+
+def test_cache_lru_despeja_o_menos_usado():
+    c = CacheLRU(2, 10_000, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")          # "b" passa a ser o menos usado
+    c.set("c", 3)
+    assert c.get("b", None) is None
+    assert (c.get("a"), c.get("c")) == (1, 3)
+
+
+def test_cache_lru_respeita_limite_de_bytes():
+    c = CacheLRU(100, 250, ttl=60)
+    for i in range(5):
+        c.set(i, "x", tamanho=100)
+    assert c.stats()["bytes"] <= 250
+    assert len(c) == 2 and c.get(4) == "x"
+
+
+def test_fetch_json_usa_cache(qedu):
+    url = f"{gerador.BASE_URL}/censo/territorios/matriculas"
+    params = {"ibge_id": 23, "ano": 2024, "dependencia_id": 0}
+    a = gerador.fetch_json(url, params)
+    b = gerador.fetch_json(url, dict(reversed(list(params.items()))))
+    assert a == b and len(qedu.chamadas) == 1
+
+
+# ---------- cache em disco ----------
+
+def _disco(tmp_path, max_bytes=1_000_000, ttl=3600):
+    return gerador.CacheDisco(tmp_path / "respostas.sqlite3", max_bytes,
+                              {"censo": ttl, "outros": ttl})
+
+
+def _soma(cache):
+    return cache._conexao().execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+
+
+def test_cache_disco_grava_le_e_sobrevive_a_reabertura(tmp_path):
+    c = _disco(tmp_path)
+    chave = ("https://x/censo", (("ano", 2024),))
+    c.set(chave, {"censo": {"qtd": 1}}, "censo")
+    assert c.get(chave) == {"censo": {"qtd": 1}}
+    assert _disco(tmp_path).get(chave) == {"censo": {"qtd": 1}}
+
+
+def test_cache_disco_vencido_vira_miss(tmp_path):
+    c = _disco(tmp_path, ttl=-1)
+    chave = ("u", ())
+    c.set(chave, [1], "censo")
+    assert c.get(chave, None) is None
+    assert c._bytes == _soma(c) == 0
+
+
+def _envelhecer_disco(cache, segundos):
+    conn = cache._conexao()
+    conn.execute("UPDATE respostas SET expira_em = expira_em - ?", (segundos,))
+    conn.commit()
+
+
+def test_cache_disco_max_idade_ignora_respostas_velhas(tmp_path):
+    c = _disco(tmp_path, ttl=7 * 86400)
+    chave = ("u", ())
+    c.set(chave, [1], "censo")
+    _envelhecer_disco(c, 30 * 3600)  # gravada há 30h, ainda no TTL de 7 dias
+    assert c.get(chave) == [1]
+    assert c.get(chave, None, max_idade=24 * 3600) is None
+    assert c.get(chave, None, max_idade=48 * 3600) == [1]
+    assert c.get(chave) == [1]  # continua lá para quem aceita o TTL
+
+
+def test_cache_disco_total_em_memoria_sem_varrer_a_tabela(tmp_path):
+    c = _disco(tmp_path, max_bytes=600)
+    consultas = []
+    c._conexao().set_trace_callback(consultas.append)
+    for i in range(60):
+        c.set((f"u{i}", ()), {"i": i, "texto": "abc" * (i % 7)}, "censo")
+    c.set(("u59", ()), {"i": 59, "texto": "trocado" * 20}, "censo")  # substitui: desconta o antigo
+    somas = [q for q in consultas if "SUM(tamanho)" in q and "WHERE" not in q]
+    assert len(somas) == 1  # só a contagem inicial
+    assert c._bytes == _soma(c)
+    assert c._bytes <= 600
+    assert c.get(("u59", ())) == {"i": 59, "texto": "trocado" * 20}
+    assert c.get(("u0", ()), None) is None  # acessos mais antigos saíram primeiro
+
+
+def test_cache_disco_reconta_ao_reabrir(tmp_path):
+    c = _disco(tmp_path)
+    for i in range(5):
+        c.set((f"u{i}", ()), list(range(i * 10)), "censo")
+    outro = _disco(tmp_path)
+    assert outro._total(outro._conexao()) == c._bytes > 0
+
+
+# ---------- cache negativo ----------
+
+URL_CENSO = f"{gerador.BASE_URL}/censo/territorios/matriculas"
+
+
+def test_resposta_vazia_vai_para_o_cache_negativo(qedu):
+    params = {"ibge_id": 23, "ano": 2026, "dependencia_id": 0}
+    vazio = gerador.fetch_json(URL_CENSO, params, tem_dados=gerador._censo_tem_dados)
+    assert vazio == {"censo": None}
+    chave = (URL_CENSO, tuple(sorted(params.items())))
+    assert gerador._FETCH_CACHE.get(chave, None) is None
+    assert gerador._NEG_CACHE.get(chave) == {"censo": None}
+    gerador.fetch_json(URL_CENSO, params, tem_dados=gerador._censo_tem_dados)
+    assert len(qedu.chamadas) == 1
+
+
+def test_falha_transitoria_lembrada_por_pouco_tempo(qedu, monkeypatch):
+    monkeypatch.setattr(gerador, "NEG_TTL_FALHA", 0.05)
+    qedu.rota = lambda url, params: (503, None)
+    assert gerador.fetch_json(URL_CENSO, {"ano": 1}, tentativas=1) is None
+    assert gerador.fetch_json(URL_CENSO, {"ano": 1}, tentativas=1) is None
+    assert len(qedu.chamadas) == 1
+    time.sleep(0.06)
+    qedu.rota = lambda url, params: (200, {"censo": {"qtd": 1}})
+    assert gerador.fetch_json(URL_CENSO, {"ano": 1}, tentativas=1) == {"censo": {"qtd": 1}}
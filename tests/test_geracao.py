@@ -0,0 +1,294 @@
+"""Geração: coalescência, tipos pedidos e saída em disco."""
+
+import json
+import pathlib
+import threading
+import time
+
+import pytest
+
+import gerador
+
+
+# ---------- single-flight ----------
+
+def _em_paralelo(n, fn):
+    resultados, erros = [], []
+    barreira = threading.Barrier(n)
+
+    def alvo():
+        barreira.wait()
+        try:
+            resultados.append(fn())
+        except Exception as e:
+            erros.append(e)
+
+    threads = [threading.Thread(target=alvo) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return resultados, erros
+
+
+def test_single_flight_executa_uma_vez():
+    sf = gerador.SingleFlight()
+    execucoes = []
+
+    def lenta():
+        execucoes.append(1)
+        time.sleep(0.05)
+        return object()
+
+    resultados, _ = _em_paralelo(6, lambda: sf.do("k", lenta))
+    assert len(execucoes) == 1
+    assert len({id(r) for r in resultados}) == 1
+
+
+def test_single_flight_propaga_erro_a_todos():
+    sf = gerador.SingleFlight()
+
+    def falha():
+        time.sleep(0.05)
+        raise RuntimeError("upstream fora")
+
+    _, erros = _em_paralelo(4, lambda: sf.do("k", falha))
+    assert len(erros) == 4 and all(isinstance(e, RuntimeError) for e in erros)
+    assert sf.do("k", lambda: 42) == 42  # chave liberada depois da falha
+
+
+def test_single_flight_cobre_chamada_em_voo():
+    sf = gerador.SingleFlight()
+    entrou, liberar = threading.Event(), threading.Event()
+
+    def lider():
+        entrou.set()
+        liberar.wait()
+        return {"a", "b"}
+
+    t = threading.Thread(target=lambda: sf.do(("k", "ab"), lider))
+    t.start()
+    entrou.wait()
+    saida = []
+    seguidor = threading.Thread(target=lambda: saida.append(
+        sf.do(("k", "a"), lambda: {"a"}, cobre=lambda k: "a" in k[1])))
+    seguidor.start()
+    time.sleep(0.02)
+    liberar.set()
+    t.join()
+    seguidor.join()
+    assert saida == [{"a", "b"}]
+
+
+# ---------- tipos pedidos ----------
+
+@pytest.fixture
+def geracoes(monkeypatch):
+    """Conta as execuções de _gerar_todos; cada uma espera `liberar`."""
+    original = gerador._gerar_todos
+    estado = {"tipos": [], "entrou": threading.Event(), "liberar": threading.Event()}
+
+    def contada(ibge, output_dir, tipos, max_idade_respostas=None):
+        estado["tipos"].append(tipos)
+        estado["entrou"].set()
+        estado["liberar"].wait(5)
+        return original(ibge, output_dir, tipos, max_idade_respostas)
+
+    monkeypatch.setattr(gerador, "_gerar_todos", contada)
+    return estado
+
+
+def test_relatorio_junta_se_ao_gerar_em_voo(qedu, ideb, geracoes):
+    resultados = {}
+    lider = threading.Thread(target=lambda: resultados.update(
+        todos=gerador.gerar_todos("2304400")))
+    lider.start()
+    geracoes["entrou"].wait(5)
+    seguidor = threading.Thread(target=lambda: resultados.update(
+        censo=gerador.gerar_todos("2304400", None, ["censo"])))
+    seguidor.start()
+    time.sleep(0.05)
+    geracoes["liberar"].set()
+    lider.join()
+    seguidor.join()
+
+    assert geracoes["tipos"] == [gerador.TIPOS_RELATORIO]  # uma geração só
+    assert len(resultados["todos"]["arquivos"]) == 5
+    censo = resultados["censo"]
+    assert list(censo["arquivos"]) == ["Fortaleza_censo.txt"]
+    assert list(censo["hashes"]) == ["censo"]
+    assert "censo" in censo["dados_estruturados"] and "infra" not in censo["dados_estruturados"]
+    assert censo["arquivos"]["Fortaleza_censo.txt"] == \
+        resultados["todos"]["arquivos"]["Fortaleza_censo.txt"]
+
+
+def test_gerar_nao_espera_geracao_menor(qedu, ideb, geracoes):
+    lider = threading.Thread(target=lambda: gerador.gerar_todos("2304400", None, ["censo"]))
+    lider.start()
+    geracoes["entrou"].wait(5)
+    todos = threading.Thread(target=gerador.gerar_todos, args=("2304400",))
+    todos.start()
+    limite = time.monotonic() + 5
+    while len(geracoes["tipos"]) < 2 and time.monotonic() < limite:
+        time.sleep(0.005)
+    geracoes["liberar"].set()  # a segunda começou com a primeira ainda em voo
+    lider.join()
+    todos.join()
+    assert geracoes["tipos"] == [("censo", "ideb"), gerador.TIPOS_RELATORIO]
+
+
+def test_tipos_pedidos_so_chamam_suas_bases(qedu, ideb):
+    r = gerador.gerar_todos("2304400", None, ["censo", "ideb"])
+    assert sorted(r["arquivos"]) == ["Fortaleza_censo.txt", "Fortaleza_ideb.txt"]
+    assert {url.split("/api/v1/")[1].split("/")[0] for url, _ in qedu.chamadas} == {"censo"}
+
+
+# ---------- saída em disco ----------
+
+def test_saida_gravada_via_temporario(qedu, ideb, tmp_path, monkeypatch):
+    escritos, trocas = [], []
+    write_text, replace = gerador.pathlib.Path.write_text, gerador.pathlib.Path.replace
+    monkeypatch.setattr(gerador.pathlib.Path, "write_text",
+                        lambda self, *a, **k: escritos.append(self) or write_text(self, *a, **k))
+    monkeypatch.setattr(gerador.pathlib.Path, "replace",
+                        lambda self, alvo: trocas.append(pathlib.Path(alvo)) or replace(self, alvo))
+    out = tmp_path / "saida"
+    gerador.gerar_todos("2304400", out)
+    escritos = [p.name for p in escritos if p.parent == out]
+    trocas = [p.name for p in trocas if p.parent == out]
+
+    finais = sorted(p.name for p in out.iterdir())
+    assert finais == sorted([*(f"Fortaleza_{t}.txt" for t in gerador.TIPOS_RELATORIO),
+                             gerador.SAIDA_META])
+    assert sorted(trocas) == finais
+    assert escritos and all(n.endswith(".tmp") for n in escritos)
+
+
+def test_falha_na_gravacao_preserva_o_arquivo_anterior(tmp_path, monkeypatch):
+    alvo = tmp_path / "Fortaleza_censo.txt"
+    alvo.write_text("versão anterior", encoding="utf-8")
+    write_text = gerador.pathlib.Path.write_text
+
+    def pela_metade(self, texto, **k):
+        write_text(self, texto[:3], **k)
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr(gerador.pathlib.Path, "write_text", pela_metade)
+    with pytest.raises(OSError):
+        gerador._gravar_atomico(alvo, "versão nova")
+    assert alvo.read_text(encoding="utf-8") == "versão anterior"
+    assert [p.name for p in tmp_path.iterdir()] == ["Fortaleza_censo.txt"]
+
+
+@pytest.fixture
+def revalidacoes(monkeypatch):
+    agendadas = []
+    monkeypatch.setattr(gerador, "_revalidar", lambda *a: agendadas.append(a) or True)
+    return agendadas
+
+
+def test_saida_fresca_vem_do_disco(qedu, ideb, tmp_path, revalidacoes):
+    out = tmp_path / "saida"
+    assert gerador.obter_relatorios("2304400", out)["origem"] == "gerado"
+    qedu.chamadas.clear()
+    r = gerador.obter_relatorios("2304400", out)
+    assert r["origem"] == "disco" and len(r["arquivos"]) == 5
+    assert qedu.chamadas == [] and revalidacoes == []
+
+
+def test_municipio_atrasado_nao_fica_sempre_velho(qedu, ideb, tmp_path, revalidacoes):
+    # outra entidade já tem censo 2025; este território só tem até 2024
+    gerador._registrar_ano("censo", 2025)
+    out = tmp_path / "saida"
+    gerado = gerador.obter_relatorios("2304400", out, ["censo"])
+    assert gerado["dados_estruturados"]["censo"]["ano"] == 2024
+    r = gerador.obter_relatorios("2304400", out, ["censo"])
+    assert r["origem"] == "disco" and not r["ano_novo"]
+    assert revalidacoes == []
+
+
+def test_registro_que_avanca_depois_da_geracao_expira(qedu, ideb, tmp_path, revalidacoes):
+    out = tmp_path / "saida"
+    gerador.obter_relatorios("2304400", out, ["censo"])
+    gerador._registrar_ano("censo", 2025)
+    r = gerador.obter_relatorios("2304400", out, ["censo"])
+    assert r["origem"] == "disco_expirado" and r["ano_novo"]
+    assert revalidacoes == [("2304400", out, ("censo",), gerador.SAIDA_MAX_IDADE)]
+
+
+def test_saida_vencida_serve_e_revalida(qedu, ideb, tmp_path, revalidacoes):
+    out = tmp_path / "saida"
+    gerador.obter_relatorios("2304400", out)
+    meta_path = out / gerador.SAIDA_META
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    for e in meta["relatorios"].values():
+        e["gerado_em_ts"] -= 100
+    meta_path.write_text(json.dumps(meta), encoding="utf-8")
+
+    r = gerador.obter_relatorios("2304400", out, max_idade=50, max_idade_dura=1000)
+    assert r["origem"] == "disco_expirado" and r["idade_s"] >= 100
+    assert len(revalidacoes) == 1
+    assert gerador.obter_relatorios("2304400", out, max_idade=50, max_idade_dura=80)["origem"] == "gerado"
+
+
+def _quebrar(monkeypatch, tipo):
+    """O modelo de `tipo` passa a falhar (ex.: resposta inesperada da API)."""
+    def falha(ibge):
+        raise RuntimeError("resposta inesperada")
+
+    monkeypatch.setattr(gerador, "RELATORIOS", [(n, falha if n == tipo else m, r)
+                                                 for n, m, r in gerador.RELATORIOS])
+
+
+def test_tipo_que_falha_mantem_o_ultimo_arquivo_bom(qedu, ideb, tmp_path, monkeypatch):
+    out = tmp_path / "saida"
+    bom = gerador.gerar_todos("2304400", out)
+    hash_bom = bom["hashes"]["censo"]
+    meta_antes = json.loads((out / gerador.SAIDA_META).read_text(encoding="utf-8"))
+
+    _quebrar(monkeypatch, "censo")
+    r = gerador.gerar_todos("2304400", out)
+    assert r["arquivos"]["Fortaleza_censo.txt"].startswith("❌ Erro ao gerar censo")
+    assert "censo" not in r["hashes"]
+
+    # disco: TXT e entrada do relatorios.json continuam os da última geração boa
+    assert (out / "Fortaleza_censo.txt").read_text(encoding="utf-8") == \
+        bom["arquivos"]["Fortaleza_censo.txt"]
+    meta = json.loads((out / gerador.SAIDA_META).read_text(encoding="utf-8"))
+    assert meta["relatorios"]["censo"] == meta_antes["relatorios"]["censo"]
+    lido = gerador.ler_saida("2304400", out, ["censo"])
+    assert lido["hashes"]["censo"] == hash_bom
+    assert lido["arquivos"]["Fortaleza_censo.txt"] == bom["arquivos"]["Fortaleza_censo.txt"]
+
+
+def _esperar_revalidacoes():
+    limite = time.monotonic() + 5
+    while gerador._REVALIDANDO and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert not gerador._REVALIDANDO
+
+
+@pytest.mark.parametrize("horas_respostas, busca_de_novo", [(30, True), (2, False)])
+def test_regeracao_de_saida_vencida_nao_usa_respostas_velhas(qedu, ideb, tmp_path, monkeypatch,
+                                                            horas_respostas, busca_de_novo):
+    disco = gerador.CacheDisco(tmp_path / "respostas.sqlite3", 10 ** 8, gerador.DISCO_CACHE_TTL)
+    monkeypatch.setattr(gerador, "_DISCO_CACHE", disco)
+    out = tmp_path / "saida"
+    gerador.obter_relatorios("2304400", out, ["censo"])
+
+    # processo novo (memória vazia); saída de 30h, respostas em disco de `horas_respostas`
+    gerador._clear_cache()
+    conn = disco._conexao()
+    conn.execute("UPDATE respostas SET expira_em = expira_em - ?", (horas_respostas * 3600,))
+    conn.commit()
+    meta = json.loads((out / gerador.SAIDA_META).read_text(encoding="utf-8"))
+    meta["relatorios"]["censo"]["gerado_em_ts"] -= 30 * 3600
+    (out / gerador.SAIDA_META).write_text(json.dumps(meta), encoding="utf-8")
+    qedu.chamadas.clear()
+
+    r = gerador.obter_relatorios("2304400", out, ["censo"], max_idade=24 * 3600)
+    _esperar_revalidacoes()
+    censo = [p for url, p in qedu.chamadas if "/censo/" in url and p["ano"] == 2024]
+    assert r["origem"] == "disco_expirado"
+    assert bool(censo) == busca_de_novo  # 30h > 24h: vai à API; 2h: o cache em disco serve
+    assert gerador.ler_saida("2304400", out, ["censo"], 24 * 3600)["idade_s"] < 60
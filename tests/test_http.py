@@ -0,0 +1,172 @@
+"""Sessão HTTP, prefetch e sondagem de anos."""
+
+import threading
+import time
+
+import requests
+
+import gerador
+
+
+# ---------- sessão compartilhada ----------
+
+def test_sessao_unica_entre_threads(monkeypatch):
+    monkeypatch.setattr(gerador, "_SESSION", None)
+    vistas = []
+    threads = [threading.Thread(target=lambda: vistas.append(gerador._get_session()))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(s) for s in vistas}) == 1
+    sessao = vistas[0]
+    assert isinstance(sessao, requests.Session)
+    assert sessao.get_adapter("https://qedu.org.br")._pool_maxsize == gerador.HTTP_POOL_SIZE
+    assert sessao.headers["Referer"] == gerador.HEADERS["Referer"]
+
+
+# ---------- prefetch paralelo ----------
+
+def test_prefetch_dispara_chamadas_em_paralelo(qedu):
+    rota = qedu.rota
+    ativos, pico, lock = [0], [0], threading.Lock()
+
+    def lenta(url, params):
+        with lock:
+            ativos[0] += 1
+            pico[0] = max(pico[0], ativos[0])
+        time.sleep(0.02)
+        with lock:
+            ativos[0] -= 1
+        return rota(url, params)
+
+    qedu.rota = lenta
+    with gerador._escopo_cache():
+        gerador._prefetch("2304400")
+    assert pico[0] > 1
+    urls = {url for url, _ in qedu.chamadas}
+    assert any("/aprendizado/" in u for u in urls) and any("/censo/" in u for u in urls)
+    assert any("/infra/" in u for u in urls) and any("/taxa-rendimento/" in u for u in urls)
+
+
+# ---------- sondagem de anos ----------
+
+def test_sondagem_acha_ano_mais_recente_com_dados(qedu):
+    d, ano = gerador.fetch_censo("2304400", 3)
+    assert ano == 2024 and d["censo"]["qtd_escolas"] == 303
+    anos = sorted(p["ano"] for url, p in qedu.chamadas)
+    assert anos[-1] == gerador.ANO_ATUAL  # sondou do ano atual para trás, em paralelo
+
+
+def test_sondagem_comeca_pelo_ano_registrado(qedu):
+    gerador.fetch_censo("2304400", 3)
+    gerador._clear_cache()
+    qedu.chamadas.clear()
+    _, ano = gerador.fetch_censo("2304400", 5)
+    assert ano == 2024
+    assert [p["ano"] for _, p in qedu.chamadas] == [2024]
+
+
+# ---------- registro de anos ----------
+
+def test_registro_de_anos_persiste_e_mantem_o_maior(monkeypatch):
+    gerador._registrar_ano("censo", 2024)
+    gerador._registrar_ano("censo", 2022)
+    assert gerador._ano_registrado("censo") == 2024
+
+    # novo processo: relê do arquivo
+    monkeypatch.setattr(gerador, "_ANOS_REGISTRO", {})
+    monkeypatch.setattr(gerador, "_ANOS_REGISTRO_CARREGADO", False)
+    assert gerador._ano_registrado("censo") == 2024
+    assert gerador._anos_candidatos(3, endpoint="censo") == [2024, 2023, 2022]
+
+
+def test_registro_de_anos_vence(monkeypatch):
+    gerador._registrar_ano("taxa", 2023)
+    monkeypatch.setattr(gerador, "ANOS_REGISTRO_TTL", -1)
+    assert gerador._ano_registrado("taxa") is None
+    assert gerador._anos_candidatos(2, endpoint="taxa")[0] == gerador.ANO_ATUAL
+
+
+# ---------- limite de taxa ----------
+
+def test_token_bucket_limita_a_taxa():
+    b = gerador.TokenBucket(taxa=50, capacidade=2)
+    t0 = time.monotonic()
+    for _ in range(4):
+        b.adquirir()
+    assert time.monotonic() - t0 >= 0.03  # 2 do burst + 2 a 50/s
+
+
+def test_token_bucket_ajustar_conta_fichas_pela_taxa_antiga():
+    b = gerador.TokenBucket(taxa=1000, capacidade=10)
+    for _ in range(10):
+        b.adquirir()
+    time.sleep(0.005)
+    b.ajustar(0.001)
+    assert b.taxa == 0.001
+    assert b._fichas >= 4
+
+
+def test_limitador_corta_no_429_e_recupera():
+    lim = gerador.LimitadorAdaptativo(20, 10, 20, concorrencia_max=8, latencia_alvo=5)
+    lim._bucket("censo")
+    lim.registrar(429, 0.1)
+    assert lim.stats()["concorrencia"] == 4
+    assert lim._global.taxa == 10 and lim._por_endpoint["censo"].taxa == 5
+    lim.registrar(429, 0.1)  # segundo corte no mesmo segundo é ignorado
+    assert lim.stats()["concorrencia"] == 4
+    for _ in range(200):
+        lim.registrar(200, 0.1)
+    assert lim.stats()["concorrencia"] == 8 and lim._global.taxa == 20
+
+
+# ---------- falhas: retentativas e circuit breaker ----------
+
+URL_CENSO = f"{gerador.BASE_URL}/censo/territorios/matriculas"
+
+
+def test_circuit_breaker_abre_e_testa_meio_aberto():
+    cb = gerador.CircuitBreaker(falhas_max=3, pausa=0.05)
+    for _ in range(3):
+        assert cb.permite("censo")
+        cb.falha("censo")
+    assert not cb.permite("censo")
+    assert cb.permite("infra")  # por base
+    time.sleep(0.06)
+    assert cb.permite("censo")       # meio-aberto: uma chamada de teste
+    assert not cb.permite("censo")
+    cb.sucesso("censo")
+    assert cb.stats()["censo"] == "fechado" and cb.permite("censo")
+
+
+def test_backoff_respeita_retry_after_e_teto(monkeypatch):
+    monkeypatch.setattr(gerador, "RETRY_MAX_S", 8)
+    assert gerador._backoff(0, "3") == 3
+    assert gerador._backoff(0, "120") == 8
+    monkeypatch.setattr(gerador, "RETRY_BASE_S", 0.5)
+    assert 1.0 <= gerador._backoff(2) <= 2.0
+
+
+def test_fetch_json_repete_erro_transitorio(qedu):
+    respostas = iter([(503, None), (200, {"ok": 1})])
+    qedu.rota = lambda url, params: next(respostas)
+    assert gerador.fetch_json(URL_CENSO, {"ano": 1}) == {"ok": 1}
+    assert len(qedu.chamadas) == 2
+
+
+def test_fetch_json_nao_repete_404(qedu):
+    qedu.rota = lambda url, params: (404, None)
+    assert gerador.fetch_json(URL_CENSO, {"ano": 1}) is None
+    assert len(qedu.chamadas) == 1
+
+
+def test_fetch_json_circuito_aberto_falha_sem_chamar(qedu, monkeypatch):
+    monkeypatch.setattr(gerador, "_CIRCUITO", gerador.CircuitBreaker(2, 60))
+    qedu.rota = lambda url, params: (503, None)
+    assert gerador.fetch_json(URL_CENSO, {"ano": 1}) is None
+    assert len(qedu.chamadas) == 2
+    qedu.chamadas.clear()
+    assert gerador.fetch_json(URL_CENSO, {"ano": 2}) is None
+    assert qedu.chamadas == []
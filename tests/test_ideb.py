@@ -0,0 +1,134 @@
+"""IDEB: store indexado, cache colunar, estatísticas Brasil, compactação."""
+
+import os
+import re
+
+import pandas as pd
+import pytest
+
+import gerador
+
+
+# ---------- store indexado ----------
+
+def test_store_carrega_uma_vez_e_indexa_por_ibge_e_uf(ideb):
+    store = gerador._ideb_store()
+    assert gerador._ideb_store() is store
+    fortaleza = store.municipio("2304400")
+    assert not fortaleza.empty and set(fortaleza["codigo_ibge"]) == {"2304400"}
+    assert store.municipio("9999999").empty
+    ceara = store.estado("CE")
+    assert set(ceara["indicador_uf"]) == {"CE"}
+
+    df_mun, df_uf, brasil = gerador.load_ideb("2304400")
+    assert len(df_mun) == len(fortaleza) and set(df_uf["indicador_uf"]) == {"CE"}
+    assert brasil is store.brasil_stats
+    assert gerador.load_ideb("23")[1] is None  # estado: CSV de estados é o primário
+
+
+def test_store_recarrega_quando_o_csv_muda(ideb):
+    mun_csv, _ = ideb
+    store = gerador._ideb_store()
+    with open(mun_csv, "a", encoding="utf-8") as f:
+        f.write("2307650,Maracanaú,CE,IDEB,2021,5.1,municipal,anos iniciais\n")
+    st = mun_csv.stat()
+    os.utime(mun_csv, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    novo = gerador._ideb_store()
+    assert novo is not store and not novo.municipio("2307650").empty
+
+
+def test_sem_csv_municipal_nao_ha_store():
+    assert gerador._ideb_store() is None
+    assert gerador.load_ideb("2304400") == (None, None, None)
+
+
+# ---------- cache colunar (Feather) ----------
+
+def test_feather_gerado_ao_lado_do_csv_e_invalidado_por_mudanca(ideb):
+    pytest.importorskip("pyarrow")
+    mun_csv, uf_csv = ideb
+    assert {p.name for p in gerador.atualizar_cache_ideb()} == \
+        {mun_csv.with_suffix(".feather").name, uf_csv.with_suffix(".feather").name}
+    assert gerador._colunar_atualizado(mun_csv)
+    assert gerador.atualizar_cache_ideb() == []  # nada mudou
+
+    lido = gerador._ler_colunar(mun_csv)
+    assert isinstance(lido["segmento"].dtype, pd.CategoricalDtype)
+
+    with open(mun_csv, "a", encoding="utf-8") as f:
+        f.write("2307650,Maracanaú,CE,IDEB,2021,5.1,municipal,anos iniciais\n")
+    assert not gerador._colunar_atualizado(mun_csv)
+    assert [p.name for p in gerador.atualizar_cache_ideb()] == [mun_csv.with_suffix(".feather").name]
+
+
+def test_feather_e_csv_dao_o_mesmo_store(ideb, monkeypatch):
+    pytest.importorskip("pyarrow")
+    via_feather = gerador._IdebStore(*gerador._ler_csvs_ideb())
+    monkeypatch.setattr(gerador, "feather", None)
+    via_csv = gerador._IdebStore(*gerador._ler_csvs_ideb())
+    pd.testing.assert_frame_equal(via_feather.municipio("2304400").reset_index(drop=True),
+                                  via_csv.municipio("2304400").reset_index(drop=True))
+
+
+# ---------- estatísticas Brasil ----------
+
+def test_brasil_stats_calculadas_uma_vez_por_versao(ideb):
+    store = gerador._ideb_store()
+    stats = gerador.ideb_brasil_stats()
+    assert stats is store.brasil_stats is gerador.ideb_brasil_stats()
+
+    uf = gerador._expandir_ideb(store.uf)
+    sel = uf[(uf["indicador_tipo_nome"] == "IDEB") & (uf["ano"] == 2021)
+             & (uf["segmento"] == "anos iniciais")]["valor_numerico"]
+    linha = stats[(stats["indicador_tipo_nome"] == "IDEB") & (stats["ano"] == 2021)
+                  & (stats["segmento"] == "anos iniciais")].iloc[0]
+    assert linha["count"] == sel.count() > 0
+    assert linha["mean"] == pytest.approx(sel.mean())
+    assert linha["median"] == pytest.approx(sel.median())
+
+
+# ---------- pipeline vetorizado ----------
+
+def test_ideb_tabela_alinha_municipio_estado_e_brasil_por_ano():
+    mun = pd.DataFrame({"ano": [2019, 2021, 2023], "valor_numerico": [5.0, 5.5, 6.0]})
+    uf = pd.DataFrame({"ano": [2019, 2021], "valor_numerico": [4.5, 5.0]})
+    br = pd.DataFrame({"ano": [2021], "mean": [5.2], "median": [5.1]})
+    tab = gerador._ideb_tabela(mun, uf, br)
+    assert list(tab["ano"]) == [2019, 2021, 2023]
+    assert list(tab["tem_est"]) == [True, True, False]
+    assert list(tab["tem_br"]) == [False, True, False]
+    assert tab.loc[1, "d_est"] == pytest.approx(0.5)
+    assert tab.loc[1, "d_br"] == pytest.approx(0.3)
+    assert tab.loc[1, "d_med"] == pytest.approx(0.4)
+
+
+def test_relatorio_ideb_do_municipio(ideb):
+    txt = gerador.gerar_txt_ideb("2304400", "Fortaleza", "CE")
+    assert "Município: Fortaleza" in txt
+    # anos iniciais 2023: CE 7.7 no CSV real; Fortaleza = CE + 0.4
+    assert re.search(r"^2023\s+8\.10\s+7\.70\s+\S+\s+\+0\.40", txt, re.M)
+
+
+# ---------- representação compacta ----------
+
+def test_store_compacto_e_fatias_nos_dtypes_largos(ideb):
+    store = gerador._ideb_store()
+    assert isinstance(store.mun["segmento"].dtype, pd.CategoricalDtype)
+    assert store.mun["ano"].dtype == "int16"
+    assert store.mun["valor_numerico"].dtype == "float32"
+
+    fatia = store.municipio("2304400")
+    assert fatia["segmento"].dtype == object and fatia["ano"].dtype == "int64"
+    assert fatia["valor_numerico"].dtype == "float64"
+    csv = gerador._ler_csv_ideb(ideb[0], ",", {"codigo_ibge": str})
+    assert sorted(fatia["valor_numerico"].dropna()) == sorted(csv["valor_numerico"].dropna())
+
+    mem = gerador.ideb_memoria()
+    assert mem["total_bytes"] == mem["municipios"]["bytes"] + mem["estados"]["bytes"]
+
+
+def test_compactacao_nao_altera_valor_que_nao_volta_do_float32():
+    df = pd.DataFrame({"ano": [2019, 2021], "valor_numerico": [6.449999999999999, 5.1]})
+    gerador._compactar_ideb(df)
+    assert df["valor_numerico"].dtype == "float64"
+    assert gerador._expandir_ideb(df)["valor_numerico"].iloc[0] == 6.449999999999999
@@ -0,0 +1,138 @@
+"""Cadastro local de municípios (IBGE → nome, UF) e busca por nome."""
+
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import gerador
+from conftest import RAIZ
+
+
+@pytest.fixture
+def cadastro(tmp_path, monkeypatch):
+    """Cadastro pequeno em tmp no lugar de dados/municipios_ibge.csv."""
+    caminho = tmp_path / "municipios_ibge.csv"
+    pd.DataFrame([("2304400", "Fortaleza", "CE", "23"),
+                  ("3550308", "São Paulo", "SP", "35"),
+                  ("3549904", "São José dos Campos", "SP", "35"),
+                  ("4125506", "São José dos Pinhais", "PR", "41"),
+                  ("2927408", "Salvador", "BA", "29"),
+                  ("3536505", "Paulínia", "SP", "35")],
+                 columns=["codigo_ibge", "nome", "uf", "codigo_uf"]).to_csv(caminho, index=False)
+    monkeypatch.setattr(gerador, "MUNICIPIOS_CSV", caminho)
+    return caminho
+
+
+# ---------- arquivo versionado ----------
+
+def test_cadastro_versionado_tem_todos_os_municipios():
+    df = pd.read_csv(RAIZ / "dados" / "municipios_ibge.csv", dtype=str, keep_default_na=False)
+    assert list(df.columns) == ["codigo_ibge", "nome", "uf", "codigo_uf"]
+    assert len(df) == 5571 and df["codigo_ibge"].is_unique
+    assert df["codigo_ibge"].str.fullmatch(r"\d{7}").all()
+    assert (df["codigo_uf"] == df["codigo_ibge"].str[:2]).all()
+    assert (df["uf"] == df["codigo_uf"].map(lambda c: gerador.UF_CODES[c][1])).all()
+    por_ibge = df.set_index("codigo_ibge")
+    assert tuple(por_ibge.loc["2304400", ["nome", "uf"]]) == ("Fortaleza", "CE")
+    assert tuple(por_ibge.loc["3550308", ["nome", "uf"]]) == ("São Paulo", "SP")
+
+
+def test_descobrir_municipio_usa_o_cadastro_sem_chamar_a_api(qedu):
+    assert gerador.descobrir_municipio("3536505") == ("Paulínia", "SP")
+    assert gerador.descobrir_municipio("5300108") == ("Brasília", "DF")
+    assert qedu.chamadas == []
+
+
+# ---------- fora do cadastro: API + aprendizado ----------
+
+def test_municipio_fora_do_cadastro_e_aprendido(qedu, cadastro, monkeypatch):
+    assert gerador.descobrir_municipio("2307650") == ("Fortaleza", "CE")  # nome da API falsa
+    assert qedu.chamadas
+    assert gerador.MUNICIPIOS_APRENDIDOS_FILE.exists()
+
+    # novo processo: relê o complemento, sem API
+    monkeypatch.setattr(gerador, "_MUNICIPIOS_APRENDIDOS", None)
+    monkeypatch.setattr(gerador, "_MUNICIPIOS_VERSAO", gerador._AUSENTE)
+    qedu.chamadas.clear()
+    assert gerador.municipio_cadastrado("2307650") == ("Fortaleza", "CE")
+    assert qedu.chamadas == []
+
+
+# ---------- --build-municipios ----------
+
+def test_build_nao_sobrescreve_nomes_do_cadastro(cadastro, ideb):
+    mun_csv, _ = ideb
+    df = pd.read_csv(mun_csv, dtype=str)
+    df["indicador_municipio"] = "FORTALEZA"
+    novo = df.assign(codigo_ibge="2399999", indicador_municipio="Cidade Nova")
+    pd.concat([df, novo]).to_csv(mun_csv, index=False)
+
+    assert gerador.atualizar_cadastro_municipios() == 7
+    lido = pd.read_csv(cadastro, dtype=str).set_index("codigo_ibge")
+    assert lido.loc["2304400", "nome"] == "Fortaleza"
+    assert tuple(lido.loc["2399999", ["nome", "uf", "codigo_uf"]]) == ("Cidade Nova", "CE", "23")
+
+
+def test_build_sem_fonte_falha(tmp_path):
+    if gerador.IDEB_MUN_CSV.exists():
+        pytest.skip("CSV do IDEB presente — o build não fica vazio")
+    env = {**os.environ, "QEDU_MUNICIPIOS_CSV": str(tmp_path / "ausente.csv"),
+           "QEDU_CACHE_DIR": str(tmp_path / "cache")}
+    r = subprocess.run([sys.executable, str(RAIZ / "gerador.py"), "--build-municipios"],
+                       env=env, capture_output=True, text=True, timeout=60)
+    assert r.returncode != 0
+    assert "vazio" in r.stderr
+    assert not (tmp_path / "ausente.csv").exists()
+
+
+# ---------- busca por nome ----------
+
+def test_busca_retorna_municipios_do_cadastro(cadastro):
+    r = gerador.buscar_municipios("sao jose")
+    assert [x["municipio"] for x in r] == ["São José dos Campos", "São José dos Pinhais"]
+    assert {x["tipo"] for x in r} == {"municipio"} and r[0]["score"] == 0.9
+    tipos = {(x["municipio"], x["tipo"]) for x in gerador.buscar_municipios("sao")}
+    assert ("São Paulo", "municipio") in tipos and ("São Paulo", "estado") in tipos
+
+
+def test_busca_ignora_acento_e_caixa(cadastro):
+    r = gerador.buscar_municipios("PAULINIA")
+    assert r[0] == {"ibge": "3536505", "municipio": "Paulínia", "uf": "SP",
+                    "tipo": "municipio", "score": 1.0}
+    assert gerador.buscar_municipios("josé dos p")[0]["ibge"] == "4125506"  # começo de palavra
+
+
+def test_busca_filtra_por_uf_e_limite(cadastro):
+    assert [x["ibge"] for x in gerador.buscar_municipios("sao jose", uf="pr")] == ["4125506"]
+    assert len(gerador.buscar_municipios("sao", limite=1)) == 1
+
+
+def test_busca_tolera_erro_de_digitacao(cadastro):
+    r = gerador.buscar_municipios("fortalexa")
+    assert r[0]["ibge"] == "2304400" and 0 < r[0]["score"] < 0.8
+    assert gerador.buscar_municipios("xyzwq") == []
+
+
+def test_indice_acompanha_o_cadastro(cadastro, monkeypatch):
+    assert gerador.buscar_municipios("cidade nova") == []
+    monkeypatch.setattr(gerador, "_descobrir_municipio_remoto", lambda ibge: ("Cidade Nova", "CE"))
+    gerador.descobrir_municipio("2399999")
+    assert gerador.buscar_municipios("cidade nova")[0]["ibge"] == "2399999"
+
+
+def test_endpoint_buscar(cadastro):
+    from app import app
+    r = app.test_client().get("/municipio/buscar?q=salvador&uf=BA")
+    assert r.status_code == 200
+    assert r.get_json()["resultados"][0] == {"ibge": "2927408", "municipio": "Salvador", "uf": "BA",
+                                             "tipo": "municipio", "score": 1.0}
+    assert app.test_client().get("/municipio/buscar").status_code == 400
+
+
+def test_busca_no_cadastro_versionado_acha_municipios():
+    r = gerador.buscar_municipios("sao jose dos", limite=50)
+    assert len(r) > 5 and {x["tipo"] for x in r} == {"municipio"}
+    assert gerador.buscar_municipios("paulinia")[0]["ibge"] == "3536505"
@@ -0,0 +1,92 @@
+"""Relatórios TXT: buffer de linhas, modelo × renderização e cache de renderização."""
+
+import gerador
+
+
+# ---------- buffer de linhas ----------
+
+def test_relatorio_txt_junta_as_partes_na_ordem():
+    r = gerador.RelatorioTXT("a\n")
+    r += "b\n"
+    r += gerador.RelatorioTXT("c\n", "d\n")
+    r.linhas(["e", "f"])
+    r.secao("T")
+    assert r.texto() == f"a\nb\nc\nd\ne\nf\n\n{gerador.SUBLINE}\nT\n{gerador.SUBLINE}\n"
+    assert r.texto() == r.texto()  # texto() não consome o buffer
+
+
+def test_relatorio_txt_vazio_e_falso():
+    assert not gerador.RelatorioTXT()
+    assert not gerador.RelatorioTXT("", "")
+    assert gerador.RelatorioTXT("", "x")
+
+
+def test_relatorio_txt_cresce_sem_recopiar():
+    r = gerador.RelatorioTXT()
+    for i in range(20000):
+        r += f"linha {i}\n"
+    assert len(r._partes) == 20000
+    assert r.texto().count("\n") == 20000 and r.texto().endswith("linha 19999\n")
+
+
+def test_geradores_devolvem_texto(qedu, ideb):
+    for nome in gerador.TIPOS_RELATORIO:
+        fn = getattr(gerador, f"gerar_txt_{nome.split('_')[0]}")
+        txt = fn("2304400", "Fortaleza", "CE")
+        assert isinstance(txt, str) and txt.startswith(gerador.LINE), nome
+        assert "Fortaleza" in txt and txt.endswith("\n"), nome
+
+
+# ---------- modelo × renderização ----------
+
+def test_modelo_mais_renderizacao_igual_ao_gerador(qedu, ideb):
+    for nome, modelo_fn, render_fn in gerador.RELATORIOS:
+        fn = getattr(gerador, f"gerar_txt_{nome.split('_')[0]}")
+        assert render_fn(modelo_fn("2304400"), "Fortaleza", "CE") == fn("2304400", "Fortaleza", "CE")
+
+
+def test_dados_estruturados_saem_dos_mesmos_modelos(qedu, ideb):
+    modelos = {nome: fn("2304400") for nome, fn, _ in gerador.RELATORIOS}
+    dados = gerador.coletar_dados_estruturados("2304400", "Fortaleza", "CE", modelos)
+    assert dados == gerador.coletar_dados_estruturados("2304400", "Fortaleza", "CE")
+    assert set(dados) >= {"aprendizado", "censo", "infra", "taxa_rendimento"}
+    assert dados["censo"]["ano"] == 2024 and dados["censo"]["qtd_escolas"] == 303
+
+
+def test_gerar_todos_busca_cada_resposta_uma_vez(qedu, ideb):
+    r = gerador.gerar_todos("2304400")
+    assert len(r["arquivos"]) == 5 and r["dados_estruturados"]["censo"]
+    chamadas = [(url, tuple(sorted(p.items()))) for url, p in qedu.chamadas]
+    assert len(chamadas) == len(set(chamadas))
+
+
+# ---------- corpo determinístico e cache de renderização ----------
+
+def test_hash_modelo_estavel():
+    import pandas as pd
+    df = pd.DataFrame({"ano": [2021, 2023], "valor": [5.1, 5.4]})
+    a = gerador._hash_modelo("censo", {"b": 1, "a": [1, 2.5, None]}, df)
+    assert a == gerador._hash_modelo("censo", {"a": [1, 2.5, None], "b": 1}, df.copy())
+    assert a != gerador._hash_modelo("censo", {"b": 1, "a": [1, 2.5, None]}, df.assign(valor=[5.1, 5.5]))
+    assert gerador._hash_modelo([1]) != gerador._hash_modelo(["1"])
+
+
+def test_corpo_sem_data_de_geracao(qedu, ideb):
+    r1 = gerador.gerar_todos("2304400")
+    gerador._RENDER_CACHE.clear()
+    r2 = gerador.gerar_todos("2304400")
+    assert r1["arquivos"] == r2["arquivos"] and r1["hashes"] == r2["hashes"]
+    assert not any("Gerado em" in txt for txt in r1["arquivos"].values())
+    assert r1["gerado_em"]  # a data vai nos metadados
+
+
+def test_cache_de_renderizacao_evita_renderizar_de_novo(qedu, ideb, monkeypatch):
+    renderizados = []
+    relatorios = [(nome, m, lambda mod, mun, uf, _r=r, _n=nome: renderizados.append(_n) or _r(mod, mun, uf))
+                  for nome, m, r in gerador.RELATORIOS]
+    monkeypatch.setattr(gerador, "RELATORIOS", relatorios)
+    primeiro = gerador.gerar_todos("2304400")
+    assert sorted(renderizados) == sorted(gerador.TIPOS_RELATORIO)
+    renderizados.clear()
+    assert gerador.gerar_todos("2304400")["arquivos"] == primeiro["arquivos"]
+    assert renderizados == []